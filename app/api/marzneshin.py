@@ -1,11 +1,18 @@
+import asyncio
 import logging
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 import httpx
 from pydantic import BaseModel, Field, field_validator
 from datetime import datetime
 
+from app.api.ratelimit import RateLimiter
+from app.core.config import DEFAULT_PANEL
+from app.core.events import user_events
+from app.core.health import health
+from app.core.metrics import PANEL_ERRORS, PANEL_LATENCY, record_cache
+
 class AdminInfo(BaseModel):
     id: int
     username: str
@@ -75,25 +82,49 @@ class User(BaseModel):
 
 # --- API Client ---
 
+# The panel paginates with fastapi-pagination, which rejects (422) any `size` above 100.
+MAX_PAGE_SIZE = 100
+
 class MarzneshinAPI:
-    def __init__(self, panel_url: str, username: str, password: str):
+    def __init__(
+        self,
+        panel_url: str,
+        username: str,
+        password: str,
+        panel_name: str = DEFAULT_PANEL,
+        http_client: Optional[httpx.AsyncClient] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
         self.base_url = panel_url.rstrip('/')
         self.username = username
         self.password = password
+        self.panel_name = panel_name
         self._token: Optional[str] = None
         self._expires_at: int = 0
-        self.client = httpx.AsyncClient(timeout=20.0, follow_redirects=True)
+        self._is_sudo: Optional[bool] = None
+        # Clients of the same panel share one connection pool and rate limiter (see APIClientManager).
+        self._owns_client = http_client is None
+        self.client = http_client or httpx.AsyncClient(timeout=20.0, follow_redirects=True)
+        self.rate_limiter = rate_limiter
 
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.client.aclose()
+        if self._owns_client:
+            await self.client.aclose()
+
+    async def _throttle(self):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
 
     async def _get_token(self, force_refresh: bool = False) -> Optional[str]:
         if not force_refresh and self._token and time.time() < self._expires_at - 60:
+            record_cache("panel_token", True)
             return self._token
+        record_cache("panel_token", False)
 
+        await self._throttle()
         try:
             response = await self.client.post(
                 f"{self.base_url}/api/admins/token",
@@ -112,15 +143,23 @@ class MarzneshinAPI:
             logging.error(f"Marzneshin Token Request Error: {e}")
         return None
 
-    async def _request(self, method: str, endpoint: str, **kwargs) -> Optional[httpx.Response]:
+    async def _request(
+        self, method: str, endpoint: str, route: Optional[str] = None, expected: Tuple[int, ...] = (), **kwargs
+    ) -> Optional[httpx.Response]:
+        # `route` is the endpoint template used as a metrics label, so usernames never become label values.
+        # Error statuses listed in `expected` are answers the caller handles, so they are returned as-is.
+        route = route or endpoint
         token = await self._get_token()
         if not token:
+            PANEL_ERRORS.labels(self.panel_name, method, route).inc()
             return None
 
         headers = kwargs.pop('headers', {})
         headers["Authorization"] = f"Bearer {token}"
         headers["accept"] = "application/json"
 
+        await self._throttle()
+        started = time.perf_counter()
         try:
             response = await self.client.request(method, f"{self.base_url}{endpoint}", headers=headers, **kwargs)
 
@@ -128,21 +167,45 @@ class MarzneshinAPI:
                 logging.warning("Token expired or invalid. Refreshing and retrying...")
                 token = await self._get_token(force_refresh=True)
                 if not token:
+                    health.panel_failed(self.panel_name)
+                    PANEL_ERRORS.labels(self.panel_name, method, route).inc()
                     return None
                 headers["Authorization"] = f"Bearer {token}"
+                await self._throttle()
                 response = await self.client.request(method, f"{self.base_url}{endpoint}", headers=headers, **kwargs)
 
-            response.raise_for_status()
+            if response.status_code not in expected:
+                response.raise_for_status()
+            health.panel_succeeded(self.panel_name)
             return response
         except httpx.HTTPStatusError as e:
+            if e.response.status_code < 500:
+                # The panel answered, so it is reachable even if the request itself was rejected.
+                health.panel_succeeded(self.panel_name)
+            else:
+                health.panel_failed(self.panel_name)
             logging.error(f"Marzneshin API HTTP Error on {method} {endpoint}: {e.response.status_code} - {e.response.text}")
         except httpx.RequestError as e:
+            health.panel_failed(self.panel_name)
             logging.error(f"Marzneshin API Request Error on {method} {endpoint}: {e}")
+        finally:
+            PANEL_LATENCY.labels(self.panel_name, method, route).observe(time.perf_counter() - started)
+        PANEL_ERRORS.labels(self.panel_name, method, route).inc()
         return None
     
     async def get_current_admin(self) -> Optional[AdminInfo]:
         response = await self._request("GET", "/api/admins/current")
-        return AdminInfo(**response.json()) if response else None
+        if not response:
+            return None
+        admin_info = AdminInfo(**response.json())
+        self._is_sudo = admin_info.is_sudo
+        return admin_info
+
+    async def is_sudo(self) -> Optional[bool]:
+        # An admin's role does not change while the bot runs, so it is only fetched once.
+        if self._is_sudo is None:
+            await self.get_current_admin()
+        return self._is_sudo
     
     async def get_nodes(
         self,
@@ -160,12 +223,42 @@ class MarzneshinAPI:
         response = await self._request("GET", "/api/nodes", params=params)
         return NodeList(**response.json()) if response else None
 
+    async def get_all_nodes(
+        self,
+        status: Optional[str] = None,
+        name: Optional[str] = None,
+        size: int = 100,
+        concurrency: int = 5,
+    ) -> Optional[List[Node]]:
+        first_page = await self.get_nodes(status=status, name=name, page=1, size=size)
+        if not first_page:
+            return None
+
+        nodes: Dict[int, Node] = {node.id: node for node in first_page.items}
+        if first_page.pages > 1:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def fetch_page(page: int) -> Optional[NodeList]:
+                async with semaphore:
+                    return await self.get_nodes(status=status, name=name, page=page, size=size)
+
+            remaining_pages = await asyncio.gather(*(fetch_page(page) for page in range(2, first_page.pages + 1)))
+            for page_number, node_page in enumerate(remaining_pages, start=2):
+                if node_page is None:
+                    # A partial list would make callers think the missing nodes were removed.
+                    logging.error(f"Failed to fetch nodes page {page_number}/{first_page.pages}.")
+                    return None
+                for node in node_page.items:
+                    nodes[node.id] = node
+
+        return list(nodes.values())
+
     async def resync_node(self, node_id: int) -> bool:
-        response = await self._request("POST", f"/api/nodes/{node_id}/resync")
+        response = await self._request("POST", f"/api/nodes/{node_id}/resync", route="/api/nodes/{id}/resync")
         return response is not None and response.status_code == 200
 
     async def get_user(self, username: str) -> Optional[User]:
-        response = await self._request("GET", f"/api/users/{username}")
+        response = await self._request("GET", f"/api/users/{username}", route="/api/users/{username}")
         return User(**response.json()) if response else None
 
     async def get_all_users(
@@ -219,53 +312,75 @@ class MarzneshinAPI:
             "pages": data.get("pages", 1),
         }
     
+    async def iter_users(self, page_size: int = MAX_PAGE_SIZE, **filters) -> AsyncIterator[List[User]]:
+        # Streams the user list one page at a time so callers never hold the whole panel in memory.
+        page = 1
+        while True:
+            data = await self.get_all_users(page=page, size=page_size, **filters)
+            if data is None:
+                raise RuntimeError(f"Failed to fetch users page {page} from panel '{self.panel_name}'.")
+            if data["users"]:
+                yield data["users"]
+            if page >= data["pages"] or not data["users"]:
+                return
+            page += 1
+    
     async def create_user(self, payload: Dict[str, Any]) -> Optional[User]:
         response = await self._request("POST", "/api/users", json=payload)
-        return User(**response.json()) if response else None
+        if not response:
+            return None
+        user = User(**response.json())
+        user_events.user_changed(self.panel_name, user.username, user)
+        return user
 
     async def update_user(self, username: str, payload: Dict[str, Any]) -> Optional[User]:
-        response = await self._request("PUT", f"/api/users/{username}", json=payload)
-        return User(**response.json()) if response else None
+        response = await self._request("PUT", f"/api/users/{username}", route="/api/users/{username}", json=payload)
+        if not response:
+            return None
+        user = User(**response.json())
+        user_events.user_changed(self.panel_name, username, user)
+        return user
 
     async def delete_user(self, username: str) -> bool:
-        response = await self._request("DELETE", f"/api/users/{username}")
-        return response is not None and response.status_code == 200
+        response = await self._request("DELETE", f"/api/users/{username}", route="/api/users/{username}")
+        deleted = response is not None and response.status_code == 200
+        if deleted:
+            user_events.user_deleted(self.panel_name, username)
+        return deleted
     
-    async def enable_user(self, username: str) -> bool:
-        response = await self._request("POST", f"/api/users/{username}/enable")
-        return response is not None and response.status_code == 200
+    # enable/disable/reset/revoke answer with the updated user, which callers render directly.
+    async def enable_user(self, username: str) -> Optional[User]:
+        response = await self._request("POST", f"/api/users/{username}/enable", route="/api/users/{username}/enable")
+        return self._user_mutated(username, response)
 
-    async def disable_user(self, username: str) -> bool:
-        response = await self._request("POST", f"/api/users/{username}/disable")
-        return response is not None and response.status_code == 200
+    async def disable_user(self, username: str) -> Optional[User]:
+        response = await self._request("POST", f"/api/users/{username}/disable", route="/api/users/{username}/disable")
+        return self._user_mutated(username, response)
+
+    def _user_mutated(self, username: str, response: Optional[httpx.Response]) -> Optional[User]:
+        if response is None or response.status_code != 200:
+            return None
+        user = User(**response.json())
+        user_events.user_changed(self.panel_name, username, user)
+        return user
     
     async def delete_expired_users(self, passed_time: int) -> Optional[Dict]:
-        url = f"{self.base_url}/api/users/expired"
-        headers = {"Authorization": f"Bearer {await self._get_token()}"}
-        params = {"passed_time": passed_time}
-        
-        try:
-            response = await self.client.delete(url, params=params, headers=headers)
-            response.raise_for_status()
-            return response.json()
-        
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 404:
-                logging.info("Attempted to delete expired users, but none were found.")
-                return e.response.json()
-            logging.error(f"Marzneshin API HTTP Error on DELETE /api/users/expired: {e.response.status_code} - {e.response.text}")
-            return None
-        except httpx.RequestError as e:
-            logging.error(f"Marzneshin API Request Error on DELETE /api/users/expired: {e}")
+        response = await self._request("DELETE", "/api/users/expired", params={"passed_time": passed_time}, expected=(404,))
+        if not response:
             return None
+        if response.status_code == 404:
+            logging.info("Attempted to delete expired users, but none were found.")
+        else:
+            user_events.users_bulk_changed(self.panel_name)
+        return response.json()
         
-    async def reset_usage(self, username: str) -> bool:
-        response = await self._request("POST", f"/api/users/{username}/reset")
-        return response is not None and response.status_code == 200
+    async def reset_usage(self, username: str) -> Optional[User]:
+        response = await self._request("POST", f"/api/users/{username}/reset", route="/api/users/{username}/reset")
+        return self._user_mutated(username, response)
 
-    async def revoke_sub(self, username: str) -> bool:
-        response = await self._request("POST", f"/api/users/{username}/revoke_sub")
-        return response is not None and response.status_code == 200
+    async def revoke_sub(self, username: str) -> Optional[User]:
+        response = await self._request("POST", f"/api/users/{username}/revoke_sub", route="/api/users/{username}/revoke_sub")
+        return self._user_mutated(username, response)
 
     async def get_services(self) -> Optional[List[UserService]]:
         response = await self._request("GET", "/api/services")
@@ -275,9 +390,8 @@ class MarzneshinAPI:
         return [UserService(**service_data) for service_data in data.get("items", [])]
     
     async def get_sub_info(self, username: str, key: str) -> Optional[Dict[str, Any]]:
-        url = f"{self.base_url}/sub/{username}/{key}/info"
-        response = await self.client.get(url)
-        return response.json()
+        response = await self._request("GET", f"/sub/{username}/{key}/info", route="/sub/{username}/{key}/info")
+        return response.json() if response else None
 
     async def get_system_traffic_stats(self) -> Optional[TrafficStats]:
         response = await self._request("GET", "/api/system/stats/traffic")
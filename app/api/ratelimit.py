@@ -0,0 +1,31 @@
+import asyncio
+import time
+
+class RateLimiter:
+    # Token bucket shared by every client of one panel, so a busy panel can't starve the others.
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        self._refill()
+        if self._tokens >= 1 and not self._lock.locked():
+            self._tokens -= 1
+            return
+        # Waiters queue on the lock so they are served in arrival order.
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import sys
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.api.marzneshin import MAX_PAGE_SIZE, MarzneshinAPI, User
+from app.cache.mirror import user_mirror
+from app.core.config import settings
+from app.core.events import UserEventListener, user_events
+from app.core.metrics import record_cache
+from app.utils.helpers import utc_timestamp
+
+logger = logging.getLogger(__name__)
+
+FLAG_ENABLED = 1
+FLAG_ACTIVE = 2
+FLAG_EXPIRED = 4
+FLAG_LIMITED = 8
+FLAG_ACTIVATED = 16
+FLAG_DELETED = 32
+
+# (username, owner_username, enabled, is_active, expired, data_limit_reached, activated,
+#  expire timestamp, data_limit, used_traffic), the column order of UserMirror.read_columns().
+ColumnRow = Tuple[str, Optional[str], bool, bool, bool, bool, bool, Optional[float], int, int]
+
+def _flags(enabled: bool, is_active: bool, expired: bool, limited: bool, activated: bool) -> int:
+    return (
+        (FLAG_ENABLED if enabled else 0) | (FLAG_ACTIVE if is_active else 0) | (FLAG_EXPIRED if expired else 0)
+        | (FLAG_LIMITED if limited else 0) | (FLAG_ACTIVATED if activated else 0)
+    )
+
+def _user_row(user: User) -> ColumnRow:
+    return (
+        user.username, user.owner_username, user.enabled, user.is_active, user.expired, user.data_limit_reached,
+        user.activated, utc_timestamp(user.expire_date), user.data_limit, user.used_traffic,
+    )
+
+class UserColumns:
+    # One panel's users as parallel NumPy arrays (about 30 bytes per user plus the interned name),
+    # so analytics are vectorized masks and reductions instead of loops over User models.
+    # Row i of every array belongs to usernames[i]; owners are ids into the `owners` table.
+    def __init__(
+        self,
+        usernames: List[str],
+        owners: List[str],
+        owner_ids: np.ndarray,
+        used_traffic: np.ndarray,
+        data_limit: np.ndarray,
+        expire_at: np.ndarray,
+        flags: np.ndarray,
+    ):
+        self.usernames = usernames
+        self.owners = owners
+        self.owner_ids = owner_ids
+        self.used_traffic = used_traffic
+        self.data_limit = data_limit
+        self.expire_at = expire_at
+        self.flags = flags
+        self.built_at = time.time()
+        self.stale = False
+        self.rows = {username: i for i, username in enumerate(usernames)}
+        self.owner_rows = {owner: i for i, owner in enumerate(owners)}
+
+    @classmethod
+    def build(cls, rows: Iterable[ColumnRow]) -> "UserColumns":
+        usernames: List[str] = []
+        owners: List[str] = []
+        owner_rows: Dict[str, int] = {}
+        owner_ids, flags = array("i"), array("B")
+        used_traffic, data_limit, expire_at = array("q"), array("q"), array("d")
+        for username, owner, enabled, is_active, expired, limited, activated, expires, limit, used in rows:
+            owner = owner or ""
+            owner_id = owner_rows.get(owner)
+            if owner_id is None:
+                owner_id = owner_rows[owner] = len(owners)
+                owners.append(sys.intern(owner))
+            usernames.append(sys.intern(username))
+            owner_ids.append(owner_id)
+            flags.append(_flags(enabled, is_active, expired, limited, activated))
+            used_traffic.append(used or 0)
+            data_limit.append(limit or 0)
+            expire_at.append(np.nan if expires is None else expires)
+        return cls(
+            usernames, owners,
+            np.array(owner_ids, dtype=np.int32), np.array(used_traffic, dtype=np.int64),
+            np.array(data_limit, dtype=np.int64), np.array(expire_at, dtype=np.float64),
+            np.array(flags, dtype=np.uint8),
+        )
+
+    def copy(self) -> "UserColumns":
+        # A private snapshot for worker threads: update() and delete() write the arrays in place on the
+        # event loop. Names and lookup tables are never modified after build(), so they are shared.
+        clone = UserColumns.__new__(UserColumns)
+        clone.__dict__.update(self.__dict__)
+        for name in ("owner_ids", "used_traffic", "data_limit", "expire_at", "flags"):
+            setattr(clone, name, getattr(self, name).copy())
+        return clone
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.select()))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.owner_ids, self.used_traffic, self.data_limit, self.expire_at, self.flags))
+
+    def update(self, user: User) -> bool:
+        # In-place refresh of a known user; False when the row set itself has to change (new user or owner).
+        i = self.rows.get(user.username)
+        owner_id = self.owner_rows.get(user.owner_username or "")
+        if i is None or owner_id is None:
+            return False
+        _, _, enabled, is_active, expired, limited, activated, expires, limit, used = _user_row(user)
+        self.owner_ids[i] = owner_id
+        self.flags[i] = _flags(enabled, is_active, expired, limited, activated)
+        self.used_traffic[i] = used
+        self.data_limit[i] = limit
+        self.expire_at[i] = np.nan if expires is None else expires
+        return True
+
+    def delete(self, username: str):
+        i = self.rows.get(username)
+        if i is not None:
+            self.flags[i] |= FLAG_DELETED
+
+    def _has(self, flag: int) -> np.ndarray:
+        return (self.flags & flag) != 0
+
+    def select(self, owner: Optional[str] = None) -> np.ndarray:
+        # Boolean mask of live users, optionally of one owner; the starting point of every query.
+        mask = ~self._has(FLAG_DELETED)
+        if owner is not None:
+            owner_id = self.owner_rows.get(owner)
+            if owner_id is None:
+                return np.zeros(len(self.usernames), dtype=bool)
+            mask &= self.owner_ids == owner_id
+        return mask
+
+    def status_masks(self, mask: np.ndarray) -> Dict[str, np.ndarray]:
+        # Same precedence as the bot's status emoji: disabled, expired, limited, active, inactive.
+        enabled = mask & self._has(FLAG_ENABLED)
+        expired = enabled & self._has(FLAG_EXPIRED)
+        limited = enabled & ~expired & self._has(FLAG_LIMITED)
+        active = enabled & ~expired & ~limited & self._has(FLAG_ACTIVE)
+        return {
+            "active": active,
+            "disabled": mask & ~enabled,
+            "expired": expired,
+            "limited": limited,
+            "inactive": enabled & ~expired & ~limited & ~active,
+        }
+
+    def usage_ratio(self) -> np.ndarray:
+        # Used / limit per user; NaN for unlimited users.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.data_limit > 0, self.used_traffic / self.data_limit, np.nan)
+
+    def over_quota(self, threshold: float, mask: np.ndarray) -> np.ndarray:
+        # Users at or above `threshold` of their data limit; unlimited users never match.
+        with np.errstate(invalid="ignore"):
+            return mask & (self.usage_ratio() >= threshold)
+
+    def expiring_between(self, start: float, end: float, mask: np.ndarray) -> np.ndarray:
+        with np.errstate(invalid="ignore"):
+            return mask & (self.expire_at >= start) & (self.expire_at < end)
+
+    def top_consumers(self, mask: np.ndarray, limit: int = 10) -> List[Tuple[str, int]]:
+        rows = np.flatnonzero(mask)
+        if rows.size > limit:
+            rows = rows[np.argpartition(self.used_traffic[rows], -limit)[-limit:]]
+        rows = rows[np.argsort(self.used_traffic[rows])[::-1]]
+        return [(self.usernames[i], int(self.used_traffic[i])) for i in rows]
+
+class UserColumnStore(UserEventListener):
+    # Columnar snapshots per panel, built from the SQLite mirror when it is ready and otherwise by
+    # streaming the panel with a sudo client. Changes to known users are applied in place; new users
+    # make the snapshot stale, and it is rebuilt on the next read.
+    def __init__(self):
+        self._snapshots: Dict[str, UserColumns] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        user_events.subscribe(self)
+
+    async def stream(self, api_client: MarzneshinAPI) -> Optional[UserColumns]:
+        rows: List[ColumnRow] = []
+        try:
+            async for users in api_client.iter_users(page_size=MAX_PAGE_SIZE):
+                rows.extend(_user_row(user) for user in users)
+        except RuntimeError as e:
+            logger.warning(f"Could not build user columns for panel '{api_client.panel_name}': {e}")
+            return None
+        return await asyncio.to_thread(UserColumns.build, rows)
+
+    async def _build(self, api_client: MarzneshinAPI) -> Optional[UserColumns]:
+        panel = api_client.panel_name
+        if await user_mirror.is_ready(panel):
+            rows = await user_mirror.read_columns(panel)
+            return await asyncio.to_thread(UserColumns.build, rows)
+        # Without the mirror only a sudo admin sees the whole panel.
+        if await api_client.is_sudo():
+            return await self.stream(api_client)
+        return None
+
+    async def get(self, api_client: MarzneshinAPI) -> Optional[UserColumns]:
+        panel = api_client.panel_name
+        snapshot = self._snapshots.get(panel)
+        fresh = snapshot is not None and not snapshot.stale and time.time() - snapshot.built_at <= settings.USER_COLUMNS_TTL
+        record_cache("user_columns", fresh)
+        if fresh:
+            return snapshot
+
+        async with self._locks.setdefault(panel, asyncio.Lock()):
+            snapshot = self._snapshots.get(panel)
+            if snapshot is not None and not snapshot.stale and time.time() - snapshot.built_at <= settings.USER_COLUMNS_TTL:
+                return snapshot
+            started = time.perf_counter()
+            rebuilt = await self._build(api_client)
+            if rebuilt is None:
+                return snapshot
+            self._snapshots[panel] = rebuilt
+            logger.info(
+                f"Built user columns for panel '{panel}': {len(rebuilt.usernames)} users, "
+                f"{rebuilt.nbytes / 1024:.0f} KiB in {time.perf_counter() - started:.2f}s."
+            )
+            return rebuilt
+
+    def on_user_changed(self, panel: str, username: str, user: Optional[User]):
+        snapshot = self._snapshots.get(panel)
+        if snapshot is not None and (user is None or not snapshot.update(user)):
+            snapshot.stale = True
+
+    def on_user_deleted(self, panel: str, username: str):
+        snapshot = self._snapshots.get(panel)
+        if snapshot is not None:
+            snapshot.delete(username)
+
+    def on_users_bulk_changed(self, panel: str):
+        snapshot = self._snapshots.get(panel)
+        if snapshot is not None:
+            snapshot.stale = True
+
+user_columns = UserColumnStore()
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Set, Tuple
+
+from app.api.marzneshin import AdminInfo, MarzneshinAPI, TrafficStats, User, UserStats
+from app.core.config import settings
+from app.core.events import UserEventListener, user_events
+from app.core.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+MAX_FINGERPRINTS = 50000
+
+def _stats_fingerprint(user: User) -> Tuple:
+    # The fields the user counts depend on (status, traffic limit, expiry, owner); notes, services
+    # and the like never move a user between counters.
+    return (
+        user.owner_username, user.enabled, user.is_active, user.activated, user.expired,
+        user.data_limit_reached, user.data_limit, user.expire_date,
+    )
+
+@dataclass(frozen=True)
+class DashboardSnapshot:
+    traffic_stats: Optional[TrafficStats]
+    user_stats: Optional[UserStats]
+    admin_info: Optional[AdminInfo]
+    fetched_at: float
+
+class DashboardCache(UserEventListener):
+    # Stale-while-revalidate: a cached snapshot is served immediately and refreshed in the
+    # background once older than DASHBOARD_CACHE_TTL. Scopes are (panel, admin) because
+    # non-sudo admins only see stats for their own users.
+    def __init__(self):
+        self._snapshots: Dict[Tuple[str, str], DashboardSnapshot] = {}
+        self._stale_user_stats: Set[Tuple[str, str]] = set()
+        self._refreshing: Dict[Tuple[str, str], asyncio.Task] = {}
+        # Last stats fingerprint seen per (panel, username), to tell which user events can change the counts.
+        self._fingerprints: "OrderedDict[Tuple[str, str], Tuple]" = OrderedDict()
+        user_events.subscribe(self)
+
+    @staticmethod
+    def _scope(api_client: MarzneshinAPI) -> Tuple[str, str]:
+        return api_client.panel_name, api_client.username
+
+    async def _fetch(self, api_client: MarzneshinAPI) -> DashboardSnapshot:
+        traffic_stats, user_stats, admin_info = await asyncio.gather(
+            api_client.get_system_traffic_stats(),
+            api_client.get_system_users_stats(),
+            api_client.get_current_admin()
+        )
+        return DashboardSnapshot(traffic_stats, user_stats, admin_info, time.time())
+
+    def _store(self, scope: Tuple[str, str], snapshot: DashboardSnapshot):
+        # Partial failures are not cached, so the next view retries instead of pinning "Not Available".
+        if snapshot.traffic_stats and snapshot.user_stats and snapshot.admin_info:
+            self._snapshots[scope] = snapshot
+            self._stale_user_stats.discard(scope)
+
+    async def _refresh(self, scope: Tuple[str, str], api_client: MarzneshinAPI):
+        try:
+            self._store(scope, await self._fetch(api_client))
+        except Exception as e:
+            logger.warning(f"Background dashboard refresh for {scope} failed: {e}")
+        finally:
+            self._refreshing.pop(scope, None)
+
+    async def get(self, api_client: MarzneshinAPI) -> DashboardSnapshot:
+        scope = self._scope(api_client)
+        snapshot = self._snapshots.get(scope)
+        if snapshot is None:
+            record_cache("dashboard", False)
+            snapshot = await self._fetch(api_client)
+            self._store(scope, snapshot)
+            return snapshot
+
+        record_cache("dashboard", True)
+        if scope in self._stale_user_stats:
+            # User counts changed through the bot or a webhook; they are cheap to refetch,
+            # unlike traffic stats, so only they are fetched before answering.
+            user_stats = await api_client.get_system_users_stats()
+            if user_stats:
+                snapshot = replace(snapshot, user_stats=user_stats)
+                self._snapshots[scope] = snapshot
+                self._stale_user_stats.discard(scope)
+
+        if time.time() - snapshot.fetched_at > settings.DASHBOARD_CACHE_TTL and scope not in self._refreshing:
+            self._refreshing[scope] = asyncio.create_task(self._refresh(scope, api_client))
+        return snapshot
+
+    def invalidate_users(self, panel: str):
+        self._stale_user_stats.update(scope for scope in self._snapshots if scope[0] == panel)
+
+    def on_user_changed(self, panel: str, username: str, user: Optional[User]):
+        key = (panel, username)
+        if user is None:
+            self._fingerprints.pop(key, None)
+            self.invalidate_users(panel)
+            return
+        fingerprint = _stats_fingerprint(user)
+        # A user seen for the first time may be new or may have changed; only a known, identical
+        # fingerprint proves the counts are unaffected.
+        if self._fingerprints.get(key) != fingerprint:
+            self.invalidate_users(panel)
+        self._fingerprints[key] = fingerprint
+        self._fingerprints.move_to_end(key)
+        while len(self._fingerprints) > MAX_FINGERPRINTS:
+            self._fingerprints.popitem(last=False)
+
+    def on_user_deleted(self, panel: str, username: str):
+        self._fingerprints.pop((panel, username), None)
+        self.invalidate_users(panel)
+
+    def on_users_bulk_changed(self, panel: str):
+        self.invalidate_users(panel)
+
+dashboard_cache = DashboardCache()
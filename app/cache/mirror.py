@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.api.marzneshin import MAX_PAGE_SIZE, MarzneshinAPI, User
+from app.core.config import settings
+from app.core.events import UserEventListener, user_events
+from app.core.metrics import record_cache
+from app.utils.helpers import utc_timestamp
+from app.utils.resync import PeriodicResync
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS users ("
+    "panel TEXT NOT NULL, username TEXT NOT NULL, owner_username TEXT, "
+    "is_active INTEGER NOT NULL, activated INTEGER NOT NULL, expired INTEGER NOT NULL, "
+    "data_limit_reached INTEGER NOT NULL, enabled INTEGER NOT NULL, "
+    "expire_date REAL, data_limit INTEGER NOT NULL, used_traffic INTEGER NOT NULL, created_at REAL NOT NULL, "
+    "sync_id INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (panel, username))",
+    "CREATE INDEX IF NOT EXISTS users_owner ON users (panel, owner_username, created_at)",
+    "CREATE INDEX IF NOT EXISTS users_status ON users (panel, enabled, expired, data_limit_reached, is_active)",
+    "CREATE INDEX IF NOT EXISTS users_expire ON users (panel, expire_date)",
+    "CREATE INDEX IF NOT EXISTS users_usage ON users (panel, used_traffic)",
+    "CREATE INDEX IF NOT EXISTS users_created ON users (panel, created_at)",
+    "CREATE TABLE IF NOT EXISTS syncs (panel TEXT PRIMARY KEY, sync_id INTEGER NOT NULL, completed_at REAL NOT NULL)",
+)
+
+UPSERT = (
+    "INSERT OR REPLACE INTO users (panel, username, owner_username, is_active, activated, expired, "
+    "data_limit_reached, enabled, expire_date, data_limit, used_traffic, created_at, sync_id, data) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# get_all_users() filters and orderings the mirror can answer; anything else goes to the panel.
+FILTER_COLUMNS = {"owner_username", "is_active", "activated", "expired", "data_limit_reached", "enabled"}
+ORDER_COLUMNS = {"created_at", "username", "expire_date", "data_limit", "used_traffic"}
+
+def _row(panel: str, user: User, sync_id: int) -> Tuple:
+    return (
+        panel, user.username, user.owner_username, user.is_active, user.activated, user.expired,
+        user.data_limit_reached, user.enabled, utc_timestamp(user.expire_date), user.data_limit,
+        user.used_traffic, utc_timestamp(user.created_at), sync_id, user.model_dump_json(),
+    )
+
+class UserMirror(UserEventListener):
+    # A copy of every panel's users in data/users.db so browsing and filtering never wait on the panel.
+    # The leader streams a full sync page by page and reconciles every USER_MIRROR_SYNC_INTERVAL;
+    # in between, bot mutations and webhook events are written through as they happen. Each full sync
+    # stamps its rows with a new sync_id, and rows it did not see (deleted users) are dropped at the end.
+    def __init__(self, db_path: str = "./data/users.db"):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = asyncio.Lock()
+        self._ready: Set[str] = set()
+        self._clients: Dict[str, MarzneshinAPI] = {}
+        self._sync_ids: Dict[str, int] = {}
+        # Users changed by events while a full sync runs; its (older) page data must not overwrite them.
+        self._touched: Dict[str, Set[str]] = {}
+        self._pending: Dict[Tuple[str, str], Optional[User]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._resync = PeriodicResync(settings.USER_MIRROR_SYNC_INTERVAL)
+        user_events.subscribe(self)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+        return self._conn
+
+    async def _run(self, func, *args):
+        # One connection, used from worker threads one call at a time.
+        async with self._lock:
+            return await asyncio.to_thread(func, *args)
+
+    def _write_rows(self, rows: List[Tuple], deletes: List[Tuple[str, str]]):
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            if rows:
+                conn.executemany(UPSERT, rows)
+            if deletes:
+                conn.executemany("DELETE FROM users WHERE panel = ? AND username = ?", deletes)
+
+    def _finish_sync(self, panel: str, sync_id: int) -> int:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            removed = conn.execute("DELETE FROM users WHERE panel = ? AND sync_id != ?", (panel, sync_id)).rowcount
+            conn.execute(
+                "INSERT OR REPLACE INTO syncs (panel, sync_id, completed_at) VALUES (?, ?, ?)",
+                (panel, sync_id, time.time()),
+            )
+        return removed
+
+    def _is_synced(self, panel: str) -> bool:
+        return self._connect().execute("SELECT 1 FROM syncs WHERE panel = ?", (panel,)).fetchone() is not None
+
+    async def is_ready(self, panel: str) -> bool:
+        # Standby replicas sharing ./data read the mirror the leader keeps, so the table is the source of truth.
+        if panel not in self._ready and await self._run(self._is_synced, panel):
+            self._ready.add(panel)
+        return panel in self._ready
+
+    async def sync(self, api_client: MarzneshinAPI) -> bool:
+        panel = api_client.panel_name
+        self._clients[panel] = api_client
+        sync_id = time.time_ns()
+        self._sync_ids[panel] = sync_id
+        touched = self._touched[panel] = set()
+        started = time.monotonic()
+        count = 0
+        try:
+            async for users in api_client.iter_users(page_size=MAX_PAGE_SIZE):
+                rows = [_row(panel, user, sync_id) for user in users if user.username not in touched]
+                await self._run(self._write_rows, rows, [])
+                count += len(users)
+        except RuntimeError as e:
+            logger.warning(f"User mirror sync for panel '{panel}' failed after {count} users: {e}")
+            return False
+        finally:
+            self._touched.pop(panel, None)
+
+        # Event writes for this panel are stamped with the new sync_id, so they survive the sweep.
+        await self._flush_pending()
+        removed = await self._run(self._finish_sync, panel, sync_id)
+        self._ready.add(panel)
+        logger.info(
+            f"Mirrored {count} users of panel '{panel}' in {time.monotonic() - started:.1f}s "
+            f"({removed} stale rows removed)."
+        )
+        return True
+
+    async def run_sync(self, api_client: MarzneshinAPI):
+        await self._resync.run(api_client.panel_name, lambda: self.sync(api_client))
+
+    def _enqueue(self, panel: str, username: str, user: Optional[User]):
+        touched = self._touched.get(panel)
+        if touched is not None:
+            touched.add(username)
+        self._pending[(panel, username)] = user
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_pending())
+            except RuntimeError:
+                pass
+
+    async def _flush_pending(self):
+        while self._pending:
+            pending, self._pending = self._pending, {}
+            rows = [
+                _row(panel, user, self._sync_ids.get(panel, 0))
+                for (panel, _), user in pending.items() if user is not None
+            ]
+            deletes = [key for key, user in pending.items() if user is None]
+            try:
+                await self._run(self._write_rows, rows, deletes)
+            except Exception as e:
+                logger.error(f"Failed to write {len(pending)} user changes to the mirror: {e}")
+
+    async def _refetch(self, api_client: MarzneshinAPI, username: str):
+        user = await api_client.get_user(username)
+        if user is not None:
+            self._enqueue(api_client.panel_name, username, user)
+
+    def on_user_changed(self, panel: str, username: str, user: Optional[User]):
+        if user is not None:
+            self._enqueue(panel, username, user)
+            return
+        client = self._clients.get(panel)
+        if client is None:
+            return
+        touched = self._touched.get(panel)
+        if touched is not None:
+            touched.add(username)
+        try:
+            asyncio.get_running_loop().create_task(self._refetch(client, username))
+        except RuntimeError:
+            pass
+
+    def on_user_deleted(self, panel: str, username: str):
+        self._enqueue(panel, username, None)
+
+    def on_users_bulk_changed(self, panel: str):
+        self._resync.request(panel)
+
+    def _query_page(self, where: str, params: List[Any], order: str, limit: int, offset: int) -> Tuple[int, List[str]]:
+        conn = self._connect()
+        total = conn.execute(f"SELECT COUNT(*) FROM users WHERE {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT data FROM users WHERE {where} ORDER BY {order}, username LIMIT ? OFFSET ?",
+            [*params, limit, offset],
+        ).fetchall()
+        return total, [row[0] for row in rows]
+
+    async def get_page(
+        self,
+        api_client: MarzneshinAPI,
+        api_filters: Dict[str, Any],
+        page: int,
+        page_size: int = 10,
+    ) -> Optional[Dict[str, Any]]:
+        # `page` is zero-based; the result mirrors MarzneshinAPI.get_all_users(). None means the
+        # mirror cannot answer (not synced yet, unknown admin role or an unsupported filter).
+        panel = api_client.panel_name
+        ready = await self.is_ready(panel)
+        record_cache("user_mirror", ready)
+        if not ready:
+            return None
+        is_sudo = await api_client.is_sudo()
+        if is_sudo is None:
+            return None
+
+        filters = dict(api_filters)
+        order_by = filters.pop("order_by", None) or "created_at"
+        descending = filters.pop("descending", None)
+        if not is_sudo:
+            # The panel only shows other admins their own users; the mirror holds everyone's.
+            filters["owner_username"] = api_client.username
+        if order_by not in ORDER_COLUMNS or not FILTER_COLUMNS.issuperset(filters):
+            return None
+
+        where = " AND ".join(["panel = ?", *(f"{column} = ?" for column in filters)])
+        params = [panel, *filters.values()]
+        order = f"{order_by} {'DESC' if descending else 'ASC'}"
+        total, rows = await self._run(self._query_page, where, params, order, page_size, page * page_size)
+        return {
+            "users": [User.model_validate_json(data) for data in rows],
+            "total": total,
+            "page": page + 1,
+            "size": page_size,
+            "pages": max(1, (total + page_size - 1) // page_size),
+        }
+
+    def _select_user(self, panel: str, username: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT data FROM users WHERE panel = ? AND username = ?", (panel, username)
+        ).fetchone()
+        return row[0] if row else None
+
+    async def get_user(self, panel: str, username: str) -> Optional[User]:
+        # The mirrored copy of one user; None when the panel is not synced yet or the user is unknown.
+        key = (panel, username)
+        if key in self._pending:
+            return self._pending[key]
+        if not await self.is_ready(panel):
+            return None
+        data = await self._run(self._select_user, panel, username)
+        return User.model_validate_json(data) if data else None
+
+    def _select_columns(self, panel: str) -> List[Tuple]:
+        return self._connect().execute(
+            "SELECT username, owner_username, enabled, is_active, expired, data_limit_reached, activated, "
+            "expire_date, data_limit, used_traffic FROM users WHERE panel = ?",
+            (panel,),
+        ).fetchall()
+
+    async def read_columns(self, panel: str) -> List[Tuple]:
+        # The indexed columns of every mirrored user, without decoding the stored JSON.
+        return await self._run(self._select_columns, panel)
+
+    async def close(self):
+        await self._flush_pending()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+
+user_mirror = UserMirror()
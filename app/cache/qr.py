@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.api.marzneshin import User
+from app.core.config import settings
+from app.core.events import UserEventListener, user_events
+from app.core.metrics import record_cache
+from app.utils.helpers import atomic_write_bytes, extract_subscription_data, generate_qr_code
+from app.utils.snapshot import DebouncedSnapshot
+
+logger = logging.getLogger(__name__)
+
+EVICT_EVERY = 64  # disk writes between checks of the cache directory's size
+
+UserKey = Tuple[str, str]
+
+def _render_png(link: str) -> bytes:
+    return generate_qr_code(link).getvalue()
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+def _link_owner(panel: str, link: str) -> UserKey:
+    subscription = extract_subscription_data(link)
+    return panel, subscription[0] if subscription else ""
+
+class QRCodeCache(UserEventListener):
+    # PNG bytes keyed by subscription URL. Rendering (PIL + PNG encoding) runs in a worker thread so
+    # it never blocks the event loop; concurrent requests for the same link share one render.
+    # On disk, PNGs live in one directory per (panel, user), so a revoke deletes the old link's image
+    # even after a restart; the directory is trimmed to max_disk_bytes, least recently used first.
+    def __init__(self, max_entries: int, directory: Optional[str] = None, max_disk_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.directory = directory or None
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: "OrderedDict[str, Tuple[UserKey, bytes]]" = OrderedDict()
+        self._rendering: Dict[str, asyncio.Future] = {}
+        self._links_by_user: Dict[UserKey, Set[str]] = {}
+        self._writes = 0
+        user_events.subscribe(self)
+
+    def _user_dir(self, key: UserKey) -> str:
+        return os.path.join(self.directory, _digest(f"{key[0]}\n{key[1]}")[:32])
+
+    def _path(self, panel: str, link: str) -> str:
+        return os.path.join(self._user_dir(_link_owner(panel, link)), f"{_digest(link)}.png")
+
+    def _remember(self, panel: str, link: str, png: bytes):
+        key = _link_owner(panel, link)
+        self._entries[link] = (key, png)
+        self._entries.move_to_end(link)
+        self._links_by_user.setdefault(key, set()).add(link)
+        while len(self._entries) > self.max_entries:
+            evicted, (evicted_key, _) = self._entries.popitem(last=False)
+            links = self._links_by_user.get(evicted_key)
+            if links is not None:
+                links.discard(evicted)
+                if not links:
+                    del self._links_by_user[evicted_key]
+
+    def _evict(self):
+        files: List[Tuple[float, int, str]] = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        used = sum(size for _, size, _ in files)
+        if used <= self.max_disk_bytes:
+            return
+        files.sort()
+        target = self.max_disk_bytes * 9 // 10
+        for _, size, path in files:
+            if used <= target:
+                break
+            try:
+                os.unlink(path)
+                used -= size
+            except OSError:
+                pass
+        logger.info(f"Trimmed QR cache directory {self.directory} to {used // 1024} KiB.")
+
+    def _load_or_render(self, panel: str, link: str) -> bytes:
+        if self.directory:
+            path = self._path(panel, link)
+            try:
+                with open(path, "rb") as f:
+                    png = f.read()
+                os.utime(path)  # mtime doubles as the last-use time for eviction
+                return png
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not read cached QR code {path}: {e}")
+        png = _render_png(link)
+        if self.directory:
+            try:
+                atomic_write_bytes(self._path(panel, link), png)
+                if self._writes % EVICT_EVERY == 0:
+                    self._evict()
+                self._writes += 1
+            except OSError as e:
+                logger.warning(f"Could not persist QR code: {e}")
+        return png
+
+    async def get_png(self, panel: str, link: str) -> bytes:
+        entry = self._entries.get(link)
+        record_cache("qr_png", entry is not None)
+        if entry is not None:
+            self._entries.move_to_end(link)
+            return entry[1]
+
+        future = self._rendering.get(link)
+        if future is None:
+            future = self._rendering[link] = asyncio.ensure_future(asyncio.to_thread(self._load_or_render, panel, link))
+
+            def rendered(finished: asyncio.Future):
+                self._rendering.pop(link, None)
+                if not finished.cancelled() and finished.exception() is None:
+                    self._remember(panel, link, finished.result())
+
+            future.add_done_callback(rendered)
+        # Every caller, the first included, is shielded: a cancelled handler never cancels the shared render.
+        return await asyncio.shield(future)
+
+    def _delete_files(self, key: UserKey, keep: Optional[str]):
+        directory = self._user_dir(key)
+        keep_name = f"{_digest(keep)}.png" if keep else None
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning(f"Could not list cached QR codes in {directory}: {e}")
+            return
+        for name in names:
+            if name != keep_name:
+                try:
+                    os.unlink(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    def invalidate_user(self, panel: str, username: str, keep: Optional[str] = None):
+        key = (panel, username)
+        for link in self._links_by_user.pop(key, set()):
+            if link == keep:
+                self._links_by_user.setdefault(key, set()).add(link)
+            else:
+                self._entries.pop(link, None)
+        # The directory also holds images from before a restart, which the in-memory index never saw.
+        if self.directory and os.path.isdir(self._user_dir(key)):
+            try:
+                asyncio.get_running_loop().create_task(asyncio.to_thread(self._delete_files, key, keep))
+            except RuntimeError:
+                self._delete_files(key, keep)
+
+    def on_user_changed(self, panel: str, username: str, user: Optional[User]):
+        # A revoked subscription gets a new link; drop whatever was rendered for the old one.
+        if user is not None:
+            self.invalidate_user(panel, username, keep=user.subscription_url)
+
+    def on_user_deleted(self, panel: str, username: str):
+        self.invalidate_user(panel, username)
+
+class PhotoFileIdStore(UserEventListener):
+    # Telegram file_ids of QR photos already uploaded, keyed by (panel, subscription URL), so repeat
+    # sends reference the stored photo instead of uploading it again. Persisted with a debounced write.
+    def __init__(self, db_path: str = "./data/qr_file_ids.json", max_entries: int = 10000, flush_delay: float = 5.0):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._ids: Optional["OrderedDict[Tuple[str, str], str]"] = None
+        self._links_by_user: Dict[UserKey, Set[str]] = {}
+        self._snapshot = DebouncedSnapshot(
+            db_path, lambda: [[panel, link, file_id] for (panel, link), file_id in self.ids.items()],
+            flush_delay, "QR file_id store",
+        )
+        user_events.subscribe(self)
+
+    @property
+    def ids(self) -> "OrderedDict[Tuple[str, str], str]":
+        if self._ids is None:
+            self._ids = OrderedDict()
+            if os.path.exists(self.db_path):
+                try:
+                    with open(self.db_path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    # Files from before entries recorded their panel hold a dict; those ids are dropped,
+                    # which only costs one upload each.
+                    if isinstance(data, list):
+                        self._ids.update(((panel, link), file_id) for panel, link, file_id in data)
+                except Exception as e:
+                    logger.error(f"QR file_id store {self.db_path} is unreadable ({e}); starting empty.")
+            for panel, link in self._ids:
+                self._index(panel, link, True)
+        return self._ids
+
+    def _index(self, panel: str, link: str, present: bool):
+        key = _link_owner(panel, link)
+        if present:
+            self._links_by_user.setdefault(key, set()).add(link)
+        else:
+            links = self._links_by_user.get(key)
+            if links is not None:
+                links.discard(link)
+                if not links:
+                    del self._links_by_user[key]
+
+    def get(self, panel: str, link: str) -> Optional[str]:
+        file_id = self.ids.get((panel, link))
+        record_cache("qr_file_id", file_id is not None)
+        if file_id is not None:
+            self.ids.move_to_end((panel, link))
+        return file_id
+
+    def set(self, panel: str, link: str, file_id: str):
+        self.ids[(panel, link)] = file_id
+        self.ids.move_to_end((panel, link))
+        self._index(panel, link, True)
+        while len(self.ids) > self.max_entries:
+            (evicted_panel, evicted), _ = self.ids.popitem(last=False)
+            self._index(evicted_panel, evicted, False)
+        self._snapshot.mark_dirty()
+
+    def discard(self, panel: str, link: str):
+        if self.ids.pop((panel, link), None) is not None:
+            self._index(panel, link, False)
+            self._snapshot.mark_dirty()
+
+    def invalidate_user(self, panel: str, username: str, keep: Optional[str] = None):
+        if not self.ids:  # also loads the store, which builds the per-user index
+            return
+        for link in list(self._links_by_user.get((panel, username), ())):
+            if link != keep:
+                self.discard(panel, link)
+
+    def on_user_changed(self, panel: str, username: str, user: Optional[User]):
+        if user is not None:
+            self.invalidate_user(panel, username, keep=user.subscription_url)
+
+    def on_user_deleted(self, panel: str, username: str):
+        self.invalidate_user(panel, username)
+
+    async def flush(self) -> bool:
+        return await self._snapshot.flush()
+
+qr_cache = QRCodeCache(settings.QR_CACHE_SIZE, settings.QR_CACHE_DIR, settings.QR_CACHE_DIR_MAX_MB * 1024 * 1024)
+qr_file_ids = PhotoFileIdStore()
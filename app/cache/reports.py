@@ -0,0 +1,169 @@
+import asyncio
+import csv
+import io
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.api.marzneshin import MarzneshinAPI
+from app.cache.columns import UserColumns, user_columns
+from app.core.config import settings
+from app.core.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ("active", "disabled", "expired", "limited", "inactive")
+# Upper bounds (seconds from now) of the expiry buckets; users without an expiry date are counted apart.
+EXPIRY_BUCKETS = (("24h", 86400), ("7d", 7 * 86400), ("30d", 30 * 86400))
+TOP_CONSUMERS = 5
+
+@dataclass(frozen=True)
+class OwnerUsage:
+    owner: str
+    users: int
+    statuses: Dict[str, int]
+    allocated: int
+    used: int
+    unlimited: int
+    over_quota: int
+    expiring: Dict[str, int]
+    no_expiry: int
+    top_user: Optional[str]
+    top_user_used: int
+
+@dataclass
+class UsageReport:
+    panel: str
+    generated_at: float
+    owners: List[OwnerUsage]
+    total: OwnerUsage
+    top_consumers: List[Tuple[str, int]]
+    # Users at or above USAGE_ALERT_QUOTA_THRESHOLD of their limit, fullest first, with their used fraction.
+    over_quota: List[Tuple[str, float]]
+    # Telegram file_id of the CSV once sent, so reopening the cached report does not upload it again.
+    csv_file_id: Optional[str] = field(default=None, compare=False)
+
+    def to_csv(self) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([
+            "owner", "users", *STATUSES, "allocated_bytes", "used_bytes", "unlimited_users", "over_quota",
+            *(f"expiring_{label}" for label, _ in EXPIRY_BUCKETS), "no_expiry", "top_user", "top_user_used_bytes",
+        ])
+        for usage in [*self.owners, self.total]:
+            writer.writerow([
+                usage.owner, usage.users, *(usage.statuses[status] for status in STATUSES), usage.allocated,
+                usage.used, usage.unlimited, usage.over_quota, *(usage.expiring[label] for label, _ in EXPIRY_BUCKETS),
+                usage.no_expiry, usage.top_user or "", usage.top_user_used,
+            ])
+        return buffer.getvalue().encode("utf-8")
+
+def build_report(panel: str, columns: UserColumns, owner: Optional[str]) -> UsageReport:
+    # Every per-owner figure is a bincount over the owner ids of a mask, so the cost does not grow
+    # with the number of admins.
+    mask = columns.select(owner)
+    size = len(columns.owners)
+    now = time.time()
+
+    def per_owner(selection: np.ndarray) -> np.ndarray:
+        return np.bincount(columns.owner_ids[selection], minlength=size)
+
+    def summed(values: np.ndarray) -> np.ndarray:
+        return np.bincount(columns.owner_ids[mask], weights=values[mask], minlength=size)
+
+    users = per_owner(mask)
+    statuses = {status: per_owner(selection) for status, selection in columns.status_masks(mask).items()}
+    allocated, used = summed(columns.data_limit), summed(columns.used_traffic)
+    unlimited = per_owner(mask & (columns.data_limit == 0))
+    over_quota_mask = columns.over_quota(settings.USAGE_ALERT_QUOTA_THRESHOLD, mask)
+    over_quota = per_owner(over_quota_mask)
+    expiring = {label: per_owner(columns.expiring_between(now, now + horizon, mask)) for label, horizon in EXPIRY_BUCKETS}
+    no_expiry = per_owner(mask & np.isnan(columns.expire_at))
+
+    # Heaviest user per owner: sort by (owner, usage) and take the last row of each owner's run.
+    rows = np.flatnonzero(mask)
+    rows = rows[np.lexsort((columns.used_traffic[rows], columns.owner_ids[rows]))]
+    last_of_owner = np.flatnonzero(np.append(np.diff(columns.owner_ids[rows]) != 0, True)) if rows.size else rows
+    top_rows = {int(columns.owner_ids[rows[i]]): int(rows[i]) for i in last_of_owner}
+
+    def usage(name: str, pick: Callable[[np.ndarray], int], top: Optional[int]) -> OwnerUsage:
+        return OwnerUsage(
+            owner=name,
+            users=pick(users),
+            statuses={status: pick(counts) for status, counts in statuses.items()},
+            allocated=pick(allocated),
+            used=pick(used),
+            unlimited=pick(unlimited),
+            over_quota=pick(over_quota),
+            expiring={label: pick(counts) for label, counts in expiring.items()},
+            no_expiry=pick(no_expiry),
+            top_user=columns.usernames[top] if top is not None else None,
+            top_user_used=int(columns.used_traffic[top]) if top is not None else 0,
+        )
+
+    owners = [
+        usage(name or "-", lambda counts, i=i: int(counts[i]), top_rows.get(i))
+        for i, name in enumerate(columns.owners) if users[i]
+    ]
+    owners.sort(key=lambda item: item.used, reverse=True)
+    ratio = columns.usage_ratio()
+    fullest = np.flatnonzero(over_quota_mask)
+    fullest = fullest[np.argsort(ratio[fullest], kind="stable")[::-1][:TOP_CONSUMERS]]
+    heaviest = max(top_rows.values(), key=lambda row: columns.used_traffic[row], default=None)
+    return UsageReport(
+        panel=panel,
+        generated_at=now,
+        owners=owners,
+        total=usage("TOTAL", lambda counts: int(counts.sum()), heaviest),
+        top_consumers=columns.top_consumers(mask, TOP_CONSUMERS),
+        over_quota=[(columns.usernames[i], float(ratio[i])) for i in fullest],
+    )
+
+class ReportCache:
+    # Reports per (panel, admin), kept for REPORT_CACHE_TTL: sudo admins get every owner on the panel,
+    # other admins only their own users.
+    def __init__(self):
+        self._reports: Dict[Tuple[str, str], UsageReport] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+    async def _build(self, api_client: MarzneshinAPI) -> Optional[UsageReport]:
+        is_sudo = await api_client.is_sudo()
+        if is_sudo is None:
+            return None
+        owner = None if is_sudo else api_client.username
+        columns = await user_columns.get(api_client)
+        if columns is not None:
+            # The store keeps applying user events to its arrays while the report is built in a thread.
+            columns = columns.copy()
+        if columns is None and not is_sudo:
+            # No shared snapshot yet; the admin's own user list is all the report needs.
+            columns = await user_columns.stream(api_client)
+            owner = None
+        if columns is None:
+            return None
+        return await asyncio.to_thread(build_report, api_client.panel_name, columns, owner)
+
+    async def get(self, api_client: MarzneshinAPI, refresh: bool = False) -> Optional[UsageReport]:
+        scope = (api_client.panel_name, api_client.username)
+        report = self._reports.get(scope)
+        fresh = report is not None and not refresh and time.time() - report.generated_at <= settings.REPORT_CACHE_TTL
+        record_cache("usage_report", fresh)
+        if fresh:
+            return report
+
+        async with self._locks.setdefault(scope, asyncio.Lock()):
+            report = self._reports.get(scope)
+            if report is not None and not refresh and time.time() - report.generated_at <= settings.REPORT_CACHE_TTL:
+                return report
+            started = time.perf_counter()
+            report = await self._build(api_client)
+            if report is None:
+                return None
+            self._reports[scope] = report
+            logger.info(f"Built usage report for {scope} in {time.perf_counter() - started:.2f}s.")
+            return report
+
+report_cache = ReportCache()
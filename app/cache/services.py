@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.api.marzneshin import MarzneshinAPI, UserService
+from app.core.config import settings
+from app.core.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+class ServiceCatalogCache:
+    # Services almost never change, so selection screens read them from here. Entries are per
+    # (panel, admin) since admins may see different services. If a refresh fails, the previous
+    # catalog keeps being served rather than blocking the flow.
+    def __init__(self):
+        self._catalogs: Dict[Tuple[str, str], Tuple[List[UserService], float]] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+    async def get(self, api_client: MarzneshinAPI, refresh: bool = False) -> Optional[List[UserService]]:
+        scope = (api_client.panel_name, api_client.username)
+        cached = self._catalogs.get(scope)
+        if not refresh and cached and time.time() - cached[1] <= settings.SERVICE_CACHE_TTL:
+            record_cache("services", True)
+            return cached[0]
+
+        lock = self._locks.setdefault(scope, asyncio.Lock())
+        async with lock:
+            cached = self._catalogs.get(scope)
+            # Someone else refreshed while we waited for the lock.
+            if cached and time.time() - cached[1] <= settings.SERVICE_CACHE_TTL and not refresh:
+                record_cache("services", True)
+                return cached[0]
+
+            record_cache("services", False)
+            services = await api_client.get_services()
+            if services is None:
+                if cached:
+                    logger.warning(f"Serving stale service catalog for {scope}; the panel did not answer.")
+                    return cached[0]
+                return None
+            self._catalogs[scope] = (services, time.time())
+            return services
+
+    def invalidate(self, api_client: MarzneshinAPI):
+        self._catalogs.pop((api_client.panel_name, api_client.username), None)
+
+service_catalog = ServiceCatalogCache()
@@ -0,0 +1,79 @@
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.api.marzneshin import MarzneshinAPI, User
+from app.cache.mirror import user_mirror
+from app.cache.user_index import username_index
+from app.core.events import UserEventListener, user_events
+from app.core.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+LinkKey = Tuple[str, str, str]
+
+class SubscriptionResolver(UserEventListener):
+    # Resolves pasted subscription links to users. Links whose key the user index already knows are
+    # answered from the mirror's copy of the user without a panel call; the rest cost one call to the
+    # panel's sub-info endpoint, whose answer is the user itself. Resolved usernames are remembered in
+    # a small LRU until the user's key changes or the user is deleted.
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._recent: "OrderedDict[LinkKey, str]" = OrderedDict()
+        user_events.subscribe(self)
+
+    async def resolve(self, api_client: MarzneshinAPI, username: str, key: str) -> Optional[User]:
+        panel = api_client.panel_name
+        known = username_index.has_subscription(panel, username, key)
+        record_cache("sub_key_index", known)
+        link_key = (panel, username, key)
+        if not known:
+            resolved = self._recent.get(link_key)
+            record_cache("sub_info", resolved is not None)
+            if resolved is None:
+                return await self._fetch(api_client, link_key)
+            self._recent.move_to_end(link_key)
+            username = resolved
+
+        user = await user_mirror.get_user(panel, username)
+        if user is None or user.key != key:
+            # Mirror not synced yet, or its copy is behind a revoke: one lookup settles it.
+            user = await api_client.get_user(username)
+            if user is None or user.key != key:
+                return None
+        return user if await self._visible(api_client, user) else None
+
+    async def _fetch(self, api_client: MarzneshinAPI, link_key: LinkKey) -> Optional[User]:
+        info = await api_client.get_sub_info(link_key[1], link_key[2])
+        if not isinstance(info, dict) or not info.get("username"):
+            return None
+        self._recent[link_key] = info["username"]
+        while len(self._recent) > self.max_entries:
+            self._recent.popitem(last=False)
+        try:
+            user = User(**info)
+        except ValidationError as e:
+            logger.warning(f"Unexpected sub-info payload for '{info['username']}' ({e}); fetching the user instead.")
+            user = await api_client.get_user(info["username"])
+        return user if user is not None and await self._visible(api_client, user) else None
+
+    @staticmethod
+    async def _visible(api_client: MarzneshinAPI, user: User) -> bool:
+        # Local copies hold every admin's users; the panel only shows other admins their own.
+        is_sudo = await api_client.is_sudo()
+        return bool(is_sudo) or user.owner_username == api_client.username
+
+    def _forget(self, panel: str, username: str, keep_key: Optional[str] = None):
+        for link_key in [k for k in self._recent if k[0] == panel and k[1] == username and k[2] != keep_key]:
+            del self._recent[link_key]
+
+    def on_user_changed(self, panel: str, username: str, user: Optional[User]):
+        # A revoke issues a new key; links with the old one must stop resolving.
+        self._forget(panel, username, keep_key=user.key if user is not None else None)
+
+    def on_user_deleted(self, panel: str, username: str):
+        self._forget(panel, username)
+
+subscription_resolver = SubscriptionResolver()
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.api.marzneshin import MAX_PAGE_SIZE, MarzneshinAPI, User
+from app.core.config import settings
+from app.core.events import UserEventListener, user_events
+from app.core.metrics import record_cache
+from app.utils.resync import PeriodicResync
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True, slots=True)
+class IndexedUser:
+    # The slice of a User that search results and status emojis need, a fraction of a full model's size.
+    username: str
+    key: str
+    owner_username: Optional[str]
+    subscription_url: Optional[str]
+    data_limit: int
+    used_traffic: int
+    expire_date: Optional[datetime]
+    enabled: bool
+    expired: bool
+    data_limit_reached: bool
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "IndexedUser":
+        return cls(
+            user.username, user.key, user.owner_username, user.subscription_url, user.data_limit, user.used_traffic,
+            user.expire_date, user.enabled, user.expired, user.data_limit_reached, user.is_active,
+        )
+
+class _SearchView:
+    # Lowercased usernames in sorted order plus the same names joined into one string: prefixes are
+    # a bisect away, and substrings are found by str.find over the blob instead of a Python loop.
+    def __init__(self, usernames):
+        pairs = sorted((username.lower(), username) for username in usernames)
+        self.keys = [key for key, _ in pairs]
+        self.names = [name for _, name in pairs]
+        self.starts: List[int] = []
+        position = 0
+        for key in self.keys:
+            self.starts.append(position)
+            position += len(key) + 1
+        self.blob = "\n".join(self.keys)
+
+    def search(self, term: str, limit: int) -> List[str]:
+        # Exact match first, then other prefix matches, then substring matches, each alphabetical.
+        term = term.lower()
+        if not term:
+            return self.names[:limit]
+        if "\n" in term:
+            return []
+        lo = bisect_left(self.keys, term)
+        hi = bisect_left(self.keys, term + "\uffff")
+        results = self.names[lo:min(hi, lo + limit)]
+        position = 0
+        while len(results) < limit:
+            found = self.blob.find(term, position)
+            if found < 0:
+                break
+            i = bisect_right(self.starts, found) - 1
+            if not lo <= i < hi:
+                results.append(self.names[i])
+            position = self.starts[i + 1] if i + 1 < len(self.starts) else len(self.blob)
+        return results
+
+class _PanelIndex:
+    def __init__(self, users: Dict[str, IndexedUser]):
+        self.users = users
+        self.by_owner: Dict[str, Set[str]] = {}
+        for user in users.values():
+            self.by_owner.setdefault(user.owner_username or "", set()).add(user.username)
+        # Views are rebuilt lazily on the next search, so a burst of webhook events costs one rebuild.
+        self._views: Dict[Optional[str], _SearchView] = {}
+
+    def put(self, user: IndexedUser):
+        previous = self.users.get(user.username)
+        if previous is not None and previous.owner_username == user.owner_username:
+            self.users[user.username] = user
+            return
+        if previous is not None:
+            self._drop_owner(previous)
+        self.users[user.username] = user
+        self.by_owner.setdefault(user.owner_username or "", set()).add(user.username)
+        self._views.pop(None, None)
+        self._views.pop(user.owner_username or "", None)
+
+    def remove(self, username: str):
+        previous = self.users.pop(username, None)
+        if previous is not None:
+            self._drop_owner(previous)
+            self._views.pop(None, None)
+
+    def _drop_owner(self, user: IndexedUser):
+        owner = user.owner_username or ""
+        names = self.by_owner.get(owner)
+        if names is not None:
+            names.discard(user.username)
+            if not names:
+                del self.by_owner[owner]
+        self._views.pop(owner, None)
+
+    def search(self, term: str, owner: Optional[str], limit: int) -> List[IndexedUser]:
+        view = self._views.get(owner)
+        if view is None:
+            view = self._views[owner] = _SearchView(self.users if owner is None else self.by_owner.get(owner, ()))
+        return [self.users[username] for username in view.search(term, limit)]
+
+class UsernameIndex(UserEventListener):
+    # Every user on each panel in compact form, rebuilt by streaming the user list with a sudo client
+    # and kept current from the user event bus. Username checks and inline search are answered
+    # locally; the panel is only asked to confirm names the index believes are free.
+    def __init__(self):
+        self._panels: Dict[str, _PanelIndex] = {}
+        self._clients: Dict[str, MarzneshinAPI] = {}
+        self._syncing: Dict[str, List[Tuple[str, Optional[IndexedUser]]]] = {}
+        self._refetching: Set[Tuple[str, str]] = set()
+        self._resync = PeriodicResync(settings.USERNAME_INDEX_SYNC_INTERVAL)
+        user_events.subscribe(self)
+
+    def __len__(self) -> int:
+        return sum(len(index.users) for index in self._panels.values())
+
+    def is_ready(self, panel: str) -> bool:
+        return panel in self._panels
+
+    def contains(self, panel: str, username: str) -> Optional[bool]:
+        # None while the panel has not been indexed yet: the caller must ask the panel.
+        index = self._panels.get(panel)
+        if index is None:
+            return None
+        return username in index.users
+
+    def has_subscription(self, panel: str, username: str, key: str) -> bool:
+        index = self._panels.get(panel)
+        user = index.users.get(username) if index is not None else None
+        return user is not None and user.key == key
+
+    def search(self, panel: str, term: str, owner: Optional[str] = None, limit: int = 50) -> Optional[List[IndexedUser]]:
+        index = self._panels.get(panel)
+        record_cache("user_search", index is not None)
+        if index is None:
+            return None
+        return index.search(term, owner, limit)
+
+    def _apply(self, panel: str, username: str, user: Optional[IndexedUser]):
+        # `user` None means the user is gone.
+        index = self._panels.get(panel)
+        if index is not None:
+            if user is None:
+                index.remove(username)
+            else:
+                index.put(user)
+        # Changes landing during a rebuild are replayed onto the new index when it is swapped in.
+        pending = self._syncing.get(panel)
+        if pending is not None:
+            pending.append((username, user))
+
+    def on_user_changed(self, panel: str, username: str, user: Optional[User]):
+        if user is not None:
+            self._apply(panel, username, IndexedUser.from_user(user))
+            return
+        client = self._clients.get(panel)
+        if client is None or (panel, username) in self._refetching:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._refetching.add((panel, username))
+        loop.create_task(self._refetch(client, username))
+
+    def on_user_deleted(self, panel: str, username: str):
+        self._apply(panel, username, None)
+
+    def on_users_bulk_changed(self, panel: str):
+        self._resync.request(panel)
+
+    async def _refetch(self, api_client: MarzneshinAPI, username: str):
+        try:
+            user = await api_client.get_user(username)
+            if user is not None:
+                self._apply(api_client.panel_name, username, IndexedUser.from_user(user))
+        finally:
+            self._refetching.discard((api_client.panel_name, username))
+
+    async def sync(self, api_client: MarzneshinAPI) -> bool:
+        panel = api_client.panel_name
+        self._clients[panel] = api_client
+        started = time.monotonic()
+        users: Dict[str, IndexedUser] = {}
+        self._syncing[panel] = []
+        try:
+            async for page in api_client.iter_users(page_size=MAX_PAGE_SIZE):
+                for user in page:
+                    users[user.username] = IndexedUser.from_user(user)
+        except RuntimeError as e:
+            logger.warning(f"Username index sync for panel '{panel}' failed: {e}")
+            return False
+        finally:
+            pending = self._syncing.pop(panel, [])
+
+        for username, user in pending:
+            if user is None:
+                users.pop(username, None)
+            else:
+                users[username] = user
+        self._panels[panel] = _PanelIndex(users)
+        logger.info(f"Indexed {len(users)} users on panel '{panel}' in {time.monotonic() - started:.1f}s.")
+        return True
+
+    async def run_sync(self, api_client: MarzneshinAPI):
+        await self._resync.run(api_client.panel_name, lambda: self.sync(api_client))
+
+    async def is_taken(self, api_client: MarzneshinAPI, username: str) -> bool:
+        known = self.contains(api_client.panel_name, username)
+        record_cache("username_index", known is not None)
+        if known:
+            return True
+        return await api_client.get_user(username) is not None
+
+username_index = UsernameIndex()
@@ -1,30 +1,82 @@
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
+
+import httpx
 
 from app.api.marzneshin import MarzneshinAPI
+from app.api.ratelimit import RateLimiter
 from app.core.config import Admin, settings
 
 class APIClientManager:
     def __init__(self):
-        self._clients: Dict[str, MarzneshinAPI] = {}
-        self._admin_map: Dict[int, Admin] = {}
+        self._clients: Dict[Tuple[str, str], MarzneshinAPI] = {}
+        self._http_clients: Dict[str, httpx.AsyncClient] = {}
+        self._rate_limiters: Dict[str, RateLimiter] = {}
+        # One chat may be bound to admins on several panels; the first one listed is its default.
+        self._admin_map: Dict[int, List[Admin]] = {}
+        self._active_panel: Dict[int, str] = {}
         for admin in settings.admins:
             for chat_id in admin.chat_ids:
-                self._admin_map[chat_id] = admin
+                self._admin_map.setdefault(chat_id, []).append(admin)
 
-    async def get_client(self, chat_id: int) -> Tuple[MarzneshinAPI, Admin]:
-        admin_config = self._admin_map.get(chat_id)
-        if not admin_config:
-            raise ValueError(f"No admin configuration found for chat_id {chat_id}")
+    def _client_for(self, admin_config: Admin) -> MarzneshinAPI:
+        key = (admin_config.panel, admin_config.panel_username)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
 
-        if admin_config.panel_username in self._clients:
-            return self._clients[admin_config.panel_username], admin_config
+        panel = settings.panel_map[admin_config.panel]
+        # Each panel gets its own connection pool and rate limit, so a slow panel can't starve the others.
+        http_client = self._http_clients.get(panel.name)
+        if http_client is None:
+            http_client = self._http_clients[panel.name] = httpx.AsyncClient(
+                timeout=20.0,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=panel.max_connections),
+            )
+            self._rate_limiters[panel.name] = RateLimiter(panel.rate_limit, panel.rate_burst)
 
         client = MarzneshinAPI(
-            panel_url=settings.PANEL_URL,
+            panel_url=panel.url,
             username=admin_config.panel_username,
-            password=admin_config.panel_password
+            password=admin_config.panel_password,
+            panel_name=panel.name,
+            http_client=http_client,
+            rate_limiter=self._rate_limiters[panel.name],
         )
-        self._clients[admin_config.panel_username] = client
-        return client, admin_config
+        self._clients[key] = client
+        return client
+
+    def _admins_for(self, chat_id: int) -> List[Admin]:
+        admins = self._admin_map.get(chat_id)
+        if not admins:
+            raise ValueError(f"No admin configuration found for chat_id {chat_id}")
+        return admins
+
+    async def get_client(self, chat_id: int) -> Tuple[MarzneshinAPI, Admin]:
+        admins = self._admins_for(chat_id)
+        active = self._active_panel.get(chat_id)
+        admin_config = next((admin for admin in admins if admin.panel == active), admins[0])
+        return self._client_for(admin_config), admin_config
+
+    async def get_clients(self, chat_id: int) -> List[Tuple[MarzneshinAPI, Admin]]:
+        return [(self._client_for(admin), admin) for admin in self._admins_for(chat_id)]
+
+    def get_panels(self, chat_id: int) -> List[str]:
+        return [admin.panel for admin in self._admin_map.get(chat_id, [])]
+
+    def set_active_panel(self, chat_id: int, panel: str) -> bool:
+        if panel not in self.get_panels(chat_id):
+            return False
+        self._active_panel[chat_id] = panel
+        return True
+
+    def clients_for_panel(self, panel: str) -> List[Tuple[MarzneshinAPI, Admin]]:
+        return [(self._client_for(admin), admin) for admin in settings.admins if admin.panel == panel]
+
+    async def close(self):
+        for http_client in self._http_clients.values():
+            await http_client.aclose()
+        self._http_clients.clear()
+        self._clients.clear()
 
-api_manager = APIClientManager()
\ No newline at end of file
+api_manager = APIClientManager()
@@ -1,25 +1,87 @@
 import logging
-from typing import List
-from pydantic import BaseModel, computed_field
+from typing import Dict, List, Optional
+from pydantic import BaseModel, computed_field, model_validator
 from pydantic_settings import BaseSettings, PydanticBaseSettingsSource, YamlConfigSettingsSource
 
+DEFAULT_PANEL = "default"
+
 # --- Pydantic Models for Structured Config ---
 
+class Panel(BaseModel):
+    name: str
+    url: str
+    max_connections: int = 20
+    rate_limit: float = 20.0
+    rate_burst: int = 40
+
 class Admin(BaseModel):
     chat_ids: List[int]
     panel_username: str
     panel_password: str
+    panel: str = DEFAULT_PANEL
 
 class Settings(BaseSettings):
     BOT_TOKEN: str
-    PANEL_URL: str
+    PANEL_URL: Optional[str] = None
 
     ENABLE_WEBHOOK: bool = False
     WEBHOOK_ADDRESS: str = "0.0.0.0"
     WEBHOOK_PORT: int = 9090
     WEBHOOK_SECRET: str = "default_secret_please_change"
+
+    MONITORING_INTERVAL: int = 120
+    MONITORING_INCIDENT_INTERVAL: int = 15
+    MONITORING_CONFIRM_DELAY: int = 5
+    MONITORING_CONCURRENCY: int = 50
+    MONITORING_RESYNC_CONCURRENCY: int = 5
+    MONITORING_FAIL_THRESHOLD: int = 2
+    MONITORING_RECOVERY_THRESHOLD: int = 2
+    MONITORING_FLAP_WINDOW: int = 1800
+    MONITORING_FLAP_THRESHOLD: int = 6
+    MONITORING_FLAP_SUMMARY_INTERVAL: int = 1800
+
+    USAGE_ALERTS_ENABLED: bool = True
+    USAGE_ALERT_EXPIRY_LEAD: int = 259200
+    USAGE_ALERT_QUOTA_THRESHOLD: float = 0.9
+    USAGE_ALERT_SCAN_INTERVAL: int = 21600
+
+    DASHBOARD_CACHE_TTL: int = 60
+    SERVICE_CACHE_TTL: int = 600
+    USERNAME_INDEX_SYNC_INTERVAL: int = 3600
+    INLINE_SEARCH_CACHE_TIME: int = 30
+    INLINE_SEARCH_DEBOUNCE: float = 0.4
+    USER_MIRROR_SYNC_INTERVAL: int = 1800
+    USER_COLUMNS_TTL: int = 300
+    REPORT_CACHE_TTL: int = 900
+    QR_CACHE_SIZE: int = 256
+    QR_CACHE_DIR: Optional[str] = None
+    QR_CACHE_DIR_MAX_MB: int = 64
+
+    LEADER_LEASE_TTL: int = 30
+
+    HEALTH_MAX_POLL_AGE: int = 90
+    HEALTH_MAX_PANEL_AGE: int = 300
+    HEALTH_MAX_QUEUE_LAG: int = 60
+    HEALTH_MAX_MONITORING_AGE: int = 300
     
     admin_config: List[Admin]
+    panels: List[Panel] = []
+
+    @model_validator(mode="after")
+    def _resolve_panels(self) -> "Settings":
+        # A plain PANEL_URL keeps working as the implicit "default" panel.
+        if self.PANEL_URL and not any(panel.name == DEFAULT_PANEL for panel in self.panels):
+            self.panels.insert(0, Panel(name=DEFAULT_PANEL, url=self.PANEL_URL))
+        if not self.panels:
+            raise ValueError("No panel configured: set PANEL_URL or declare `panels` in config.yml.")
+
+        names = [panel.name for panel in self.panels]
+        if len(names) != len(set(names)):
+            raise ValueError("Panel names must be unique.")
+        for admin in self.admin_config:
+            if admin.panel not in names:
+                raise ValueError(f"Admin '{admin.panel_username}' is bound to unknown panel '{admin.panel}'.")
+        return self
 
     @computed_field
     @property
@@ -27,13 +89,26 @@ class Settings(BaseSettings):
         all_ids = []
         for admin in self.admin_config:
             all_ids.extend(admin.chat_ids)
-        return all_ids
+        return list(dict.fromkeys(all_ids))
+
+    @computed_field
+    @property
+    def panel_map(self) -> Dict[str, Panel]:
+        return {panel.name: panel for panel in self.panels}
     
     @computed_field
     @property
     def admins(self) -> List[Admin]:
         return self.admin_config
 
+    def owner_chat_ids(self, owner_username: Optional[str], panel: str) -> List[int]:
+        # Chats of the admin accounts that own users as `owner_username` on `panel`.
+        chat_ids = []
+        for admin in self.admin_config:
+            if admin.panel == panel and admin.panel_username == owner_username:
+                chat_ids.extend(admin.chat_ids)
+        return chat_ids
+
     @classmethod
     def settings_customise_sources(
         cls,
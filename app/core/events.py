@@ -0,0 +1,51 @@
+import logging
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    from app.api.marzneshin import User
+
+logger = logging.getLogger(__name__)
+
+class UserEventListener:
+    # Callbacks run inline on the event loop; listeners that need I/O schedule it themselves.
+    def on_user_changed(self, panel: str, username: str, user: Optional["User"]):
+        pass
+
+    def on_user_deleted(self, panel: str, username: str):
+        pass
+
+    def on_users_bulk_changed(self, panel: str):
+        pass
+
+class UserEventBus:
+    # Fed by the panel client's mutations and by webhook events, so caches and scanners
+    # can refresh just the users that changed instead of polling the panel.
+    def __init__(self):
+        self._listeners: List[UserEventListener] = []
+
+    def subscribe(self, listener: UserEventListener):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener: UserEventListener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _emit(self, method: str, *args):
+        for listener in self._listeners:
+            try:
+                getattr(listener, method)(*args)
+            except Exception as e:
+                logger.error(f"User event listener {type(listener).__name__}.{method} failed: {e}", exc_info=True)
+
+    def user_changed(self, panel: str, username: str, user: Optional["User"] = None):
+        # `user` is the fresh object when the caller has one; None means "refetch if you care".
+        self._emit("on_user_changed", panel, username, user)
+
+    def user_deleted(self, panel: str, username: str):
+        self._emit("on_user_deleted", panel, username)
+
+    def users_bulk_changed(self, panel: str):
+        self._emit("on_users_bulk_changed", panel)
+
+user_events = UserEventBus()
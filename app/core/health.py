@@ -0,0 +1,153 @@
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from app.core.config import Settings
+from app.core.leader import leader
+
+class HealthState:
+    # Plain timestamps written from hot paths; probes only read them, so they cost nothing to serve.
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.last_poll_at: Optional[float] = None
+        # Set while this replica polls Telegram; standbys never poll, so polling age does not apply to them.
+        self.polling_since: Optional[float] = None
+        self.last_update_at: Optional[float] = None
+        self.last_webhook_at: Optional[float] = None
+        self.panel_last_success_at: Dict[str, float] = {}
+        self.panel_last_failure_at: Dict[str, float] = {}
+        # Per panel: when its monitoring loop became active (absent while idle) and when it last finished a cycle.
+        self.monitoring_since: Dict[str, float] = {}
+        self.monitoring_last_cycle_at: Dict[str, float] = {}
+        self._webhook_pending: deque = deque()
+
+    def update_received(self):
+        self.last_update_at = time.monotonic()
+
+    def poll_completed(self):
+        self.last_poll_at = time.monotonic()
+
+    def polling_started(self):
+        self.polling_since = time.monotonic()
+        self.last_poll_at = None
+
+    def polling_stopped(self):
+        self.polling_since = None
+
+    def panel_succeeded(self, panel: str):
+        self.panel_last_success_at[panel] = time.monotonic()
+
+    def panel_failed(self, panel: str):
+        self.panel_last_failure_at[panel] = time.monotonic()
+
+    def webhook_enqueued(self):
+        now = time.monotonic()
+        self.last_webhook_at = now
+        self._webhook_pending.append(now)
+
+    def webhook_dequeued(self):
+        if self._webhook_pending:
+            self._webhook_pending.popleft()
+
+    def monitoring_changed(self, panel: str, active: bool):
+        if not active:
+            self.monitoring_since.pop(panel, None)
+        elif panel not in self.monitoring_since:
+            self.monitoring_since[panel] = time.monotonic()
+
+    def monitoring_cycle_finished(self, panel: str):
+        self.monitoring_last_cycle_at[panel] = time.monotonic()
+
+    def _monitoring_stall(self, panel: str, now: float) -> Optional[float]:
+        # Seconds an active loop has gone without finishing a cycle; None while the panel is not monitored.
+        since = self.monitoring_since.get(panel)
+        if since is None:
+            return None
+        return now - max(since, self.monitoring_last_cycle_at.get(panel, since))
+
+    @staticmethod
+    def _age(ts: Optional[float], now: float) -> Optional[float]:
+        return None if ts is None else round(now - ts, 3)
+
+    def webhook_queue_lag(self, now: float) -> float:
+        return now - self._webhook_pending[0] if self._webhook_pending else 0.0
+
+    def liveness(self, settings: Settings) -> Tuple[bool, Dict[str, Any]]:
+        now = time.monotonic()
+        poll_age = self._age(self.last_poll_at, now)
+        if self.polling_since is None:
+            ok = True
+        else:
+            reference = poll_age if poll_age is not None else now - self.polling_since
+            ok = reference <= settings.HEALTH_MAX_POLL_AGE * 3
+        # A monitoring loop stuck well past the readiness threshold needs a restart, like a stalled poll.
+        stalled = [
+            panel for panel in self.monitoring_since
+            if (self._monitoring_stall(panel, now) or 0) > settings.HEALTH_MAX_MONITORING_AGE * 3
+        ]
+        ok = ok and not stalled
+        return ok, {
+            "status": "ok" if ok else "fail", "polling": self.polling_since is not None, "polling_age_seconds": poll_age,
+            "stalled_monitoring": stalled,
+        }
+
+    def readiness(self, settings: Settings) -> Tuple[bool, Dict[str, Any]]:
+        now = time.monotonic()
+        checks: Dict[str, Dict[str, Any]] = {}
+
+        poll_age = self._age(self.last_poll_at, now)
+        checks["telegram"] = {
+            "ok": self.polling_since is None or (poll_age is not None and poll_age <= settings.HEALTH_MAX_POLL_AGE),
+            "polling": self.polling_since is not None,
+            "polling_age_seconds": poll_age,
+            "last_update_age_seconds": self._age(self.last_update_at, now),
+        }
+
+        for panel in settings.panel_map:
+            last_success = self.panel_last_success_at.get(panel)
+            last_failure = self.panel_last_failure_at.get(panel)
+            success_age = self._age(last_success, now)
+            last_call_failed = last_failure is not None and (last_success is None or last_failure > last_success)
+            checks[f"panel:{panel}"] = {
+                "ok": success_age is not None and (not last_call_failed or success_age <= settings.HEALTH_MAX_PANEL_AGE),
+                "last_success_age_seconds": success_age,
+                "last_failure_age_seconds": self._age(last_failure, now),
+            }
+
+        if settings.ENABLE_WEBHOOK:
+            lag = round(self.webhook_queue_lag(now), 3)
+            checks["webhook"] = {
+                "ok": lag <= settings.HEALTH_MAX_QUEUE_LAG,
+                "queue_lag_seconds": lag,
+                "pending": len(self._webhook_pending),
+                "last_event_age_seconds": self._age(self.last_webhook_at, now),
+            }
+
+        for panel in settings.panel_map:
+            stall = self._monitoring_stall(panel, now)
+            checks[f"monitoring:{panel}"] = {
+                "ok": stall is None or stall <= settings.HEALTH_MAX_MONITORING_AGE,
+                "active": stall is not None,
+                "last_cycle_age_seconds": self._age(self.monitoring_last_cycle_at.get(panel), now),
+            }
+
+        ok = all(check["ok"] for check in checks.values())
+        return ok, {"status": "ok" if ok else "fail", "role": leader.role, "instance": leader.instance_id, "checks": checks}
+
+class PollingHealthMiddleware(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        response = await make_request(bot, method)
+        if isinstance(method, GetUpdates):
+            health.poll_completed()
+        return response
+
+health = HealthState()
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LEADER_GAUGE = metrics.gauge("sahrabot_leader", "1 if this replica currently holds the leader lease.")
+
+class LeaderElector:
+    # A single lease row in a local SQLite file shared by the replicas (the ./data volume).
+    # The holder renews it every ttl/3 seconds; a standby takes over once it has expired,
+    # so failover happens within roughly ttl + ttl/3 seconds.
+    def __init__(self, db_path: str = "./data/leader.db", lease_name: str = "sahrabot", ttl: float = 30.0):
+        self.db_path = db_path
+        self.lease_name = lease_name
+        self.ttl = ttl
+        self.instance_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        # True when the first lease attempt succeeded, i.e. no other replica was leading at startup.
+        self.started_as_leader = False
+        self._conn: Optional[sqlite3.Connection] = None
+        self._last_renewed = 0.0
+        self._state_changed = asyncio.Event()
+        LEADER_GAUGE.set_function(lambda: 1.0 if self.is_leader else 0.0)
+
+    @property
+    def role(self) -> str:
+        return "leader" if self.is_leader else "standby"
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS lease ("
+                "name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    def _try_acquire(self) -> bool:
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT INTO lease (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE lease.holder = excluded.holder OR lease.expires_at < ?",
+            (self.lease_name, self.instance_id, now + self.ttl, now),
+        )
+        row = conn.execute("SELECT holder FROM lease WHERE name = ?", (self.lease_name,)).fetchone()
+        return row is not None and row[0] == self.instance_id
+
+    def _release(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM lease WHERE name = ? AND holder = ?", (self.lease_name, self.instance_id))
+
+    def _set_leader(self, is_leader: bool):
+        if is_leader != self.is_leader:
+            self.is_leader = is_leader
+            logger.info(f"Replica {self.instance_id} is now {self.role}.")
+            self._state_changed.set()
+
+    async def run(self):
+        logger.info(f"Leader election started for replica {self.instance_id}.")
+        first_attempt = True
+        while True:
+            try:
+                acquired = await asyncio.to_thread(self._try_acquire)
+                if first_attempt:
+                    self.started_as_leader = acquired
+                if acquired:
+                    self._last_renewed = time.monotonic()
+                self._set_leader(acquired)
+            except Exception as e:
+                logger.warning(f"Leader lease heartbeat failed: {e}")
+                # Step down before the lease can expire under us and a standby takes over.
+                if self.is_leader and time.monotonic() - self._last_renewed > self.ttl * 2 / 3:
+                    self._set_leader(False)
+            first_attempt = False
+            await asyncio.sleep(self.ttl / 3)
+
+    async def release(self):
+        if not self.is_leader:
+            return
+        try:
+            await asyncio.to_thread(self._release)
+        except Exception as e:
+            logger.warning(f"Failed to release leader lease: {e}")
+        self._set_leader(False)
+
+    async def _wait_for_state(self, is_leader: bool):
+        while self.is_leader != is_leader:
+            self._state_changed.clear()
+            await self._state_changed.wait()
+
+    async def run_while_leader(self, name: str, factory: Callable[[], Awaitable[None]]):
+        while True:
+            await self._wait_for_state(True)
+            logger.info(f"Starting '{name}' on leader replica.")
+            task = asyncio.create_task(factory())
+            lost = asyncio.create_task(self._wait_for_state(False))
+            done, _ = await asyncio.wait({task, lost}, return_when=asyncio.FIRST_COMPLETED)
+            if task in done:
+                lost.cancel()
+                if not task.cancelled() and task.exception():
+                    logger.error(f"'{name}' stopped with an error: {task.exception()}")
+                await asyncio.sleep(5)
+                continue
+            logger.warning(f"Lost leadership; stopping '{name}'.")
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"'{name}' raised while stopping: {e}")
+
+leader = LeaderElector(ttl=settings.LEADER_LEASE_TTL)
@@ -4,6 +4,8 @@ from .menus import router as menus_router
 from .user import router as user_management_router
 from .search import router as inline_router
 from .nodes import router as nodes_router
+from .reports import router as reports_router
+from .export import router as export_router
 
 main_router = Router()
 
@@ -11,5 +13,7 @@ main_router.include_routers(
     menus_router,
     user_management_router,
     inline_router,
-    nodes_router
+    nodes_router,
+    reports_router,
+    export_router
 )
\ No newline at end of file
@@ -0,0 +1,218 @@
+import asyncio
+import csv
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from aiogram import Bot, F, Router
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject
+from aiogram.types import CallbackQuery, FSInputFile, Message
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from app.api.marzneshin import MAX_PAGE_SIZE, MarzneshinAPI, User
+from app.core.config import settings
+from .helpers import USER_STATUS_FILTERS, _determine_user_status
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+router.message.filter(F.from_user.id.in_(settings.admin_chat_ids))
+router.callback_query.filter(F.from_user.id.in_(settings.admin_chat_ids))
+
+EXPORT_PAGE_SIZE = MAX_PAGE_SIZE
+EXPORT_FORMATS = ("csv", "json")
+PROGRESS_INTERVAL = 2.0  # seconds between progress edits, well inside Telegram's edit limits
+GZIP_THRESHOLD = 10 * 1024 * 1024
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024
+
+STATUS_LABELS = {
+    "all": "👥 All", "active": "✅ Active", "disabled": "❌ Disabled",
+    "expired": "⏳ Expired", "limited": "🪫 Limited",
+}
+
+CSV_FIELDS = [
+    "username", "status", "owner_username", "enabled", "is_active", "expired", "data_limit_reached",
+    "data_limit", "used_traffic", "lifetime_used_traffic", "expire_strategy", "expire_date", "created_at",
+    "online_at", "sub_updated_at", "service_ids", "note", "subscription_url",
+]
+
+# One running export per chat; the dict also keeps the tasks referenced until they finish.
+_exports: Dict[int, asyncio.Task] = {}
+
+def _isoformat(value: Optional[datetime]) -> str:
+    return value.isoformat() if value else ""
+
+def _csv_row(user: User) -> List:
+    return [
+        user.username, _determine_user_status(user)[1], user.owner_username or "", user.enabled, user.is_active,
+        user.expired, user.data_limit_reached, user.data_limit, user.used_traffic, user.lifetime_used_traffic,
+        user.expire_strategy, _isoformat(user.expire_date), _isoformat(user.created_at), _isoformat(user.online_at),
+        _isoformat(user.sub_updated_at), ";".join(map(str, user.service_ids)), user.note or "",
+        user.subscription_url or "",
+    ]
+
+class _ExportFile:
+    # Rows are appended page by page to a temporary file, so memory stays flat however many users
+    # there are. Exports over GZIP_THRESHOLD are compressed (file to file) before upload.
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.count = 0
+        self._file = tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", newline="", suffix=f".{fmt}", prefix="sahrabot-export-", delete=False
+        )
+        self.path = self._file.name
+        self._paths = [self.path]
+        if fmt == "csv":
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(CSV_FIELDS)
+        else:
+            self._file.write("[")
+
+    def write(self, users: List[User]):
+        for user in users:
+            if self.fmt == "csv":
+                self._csv.writerow(_csv_row(user))
+            else:
+                self._file.write(("," if self.count else "") + "\n" + user.model_dump_json())
+            self.count += 1
+
+    def finish(self) -> str:
+        if self.fmt == "json":
+            self._file.write("\n]\n")
+        self._file.close()
+        if os.path.getsize(self.path) > GZIP_THRESHOLD:
+            compressed = f"{self.path}.gz"
+            self._paths.append(compressed)
+            with open(self.path, "rb") as source, gzip.open(compressed, "wb", compresslevel=6) as target:
+                shutil.copyfileobj(source, target)
+            self.path = compressed
+        return self.path
+
+    def discard(self):
+        self._file.close()
+        for path in self._paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+async def _edit_progress(progress: Message, text: str):
+    try:
+        await progress.edit_text(text)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            logger.warning(f"Could not update export progress: {e}")
+
+async def _run_export(bot: Bot, chat_id: int, api_client: MarzneshinAPI, fmt: str, status_filter: str, owner: Optional[str]):
+    label = STATUS_LABELS.get(status_filter, status_filter) + (f", admin {owner}" if owner else "")
+    progress = await bot.send_message(chat_id, f"📤 Exporting users ({label}) as {fmt.upper()}…")
+    export = await asyncio.to_thread(_ExportFile, fmt)
+    filters = dict(USER_STATUS_FILTERS.get(status_filter, {}))
+    if owner:
+        filters["owner_username"] = owner
+
+    try:
+        page, total = 1, 0
+        last_update = time.monotonic()
+        while True:
+            # Oldest first: users created while the export runs land on later pages instead of shifting earlier ones.
+            data = await api_client.get_all_users(page=page, size=EXPORT_PAGE_SIZE, order_by="created_at", **filters)
+            if data is None:
+                raise RuntimeError(f"the panel did not return page {page}")
+            total = data["total"]
+            if data["users"]:
+                await asyncio.to_thread(export.write, data["users"])
+            if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+                last_update = time.monotonic()
+                await _edit_progress(progress, f"📤 Exporting users ({label})… {export.count} / {total}")
+            if page >= data["pages"] or not data["users"]:
+                break
+            page += 1
+
+        path = await asyncio.to_thread(export.finish)
+        size = os.path.getsize(path)
+        if size > TELEGRAM_DOCUMENT_LIMIT:
+            raise RuntimeError(f"the file is {size / 1024 / 1024:.0f} MB, over Telegram's 50 MB limit")
+
+        await _edit_progress(progress, f"📤 Uploading {export.count} users…")
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M")
+        filename = f"users-{api_client.panel_name}-{status_filter}-{stamp}.{fmt}" + (".gz" if path.endswith(".gz") else "")
+        await bot.send_document(chat_id, FSInputFile(path, filename=filename), caption=f"📤 {export.count} users ({label})")
+        await _edit_progress(progress, f"✅ Exported {export.count} users ({label}).")
+    except Exception as e:
+        logger.error(f"User export for chat {chat_id} failed: {e}", exc_info=True)
+        await _edit_progress(progress, f"❌ Export failed after {export.count} users: {e}")
+    finally:
+        await asyncio.to_thread(export.discard)
+
+def _start_export(bot: Bot, chat_id: int, api_client: MarzneshinAPI, fmt: str, status_filter: str, owner: Optional[str] = None) -> bool:
+    # Runs in the background: the handler returns at once and other admins are never kept waiting.
+    running = _exports.get(chat_id)
+    if running is not None and not running.done():
+        return False
+    task = _exports[chat_id] = asyncio.create_task(_run_export(bot, chat_id, api_client, fmt, status_filter, owner))
+
+    def forget(finished: asyncio.Task):
+        if _exports.get(chat_id) is finished:
+            del _exports[chat_id]
+
+    task.add_done_callback(forget)
+    return True
+
+@router.callback_query(F.data == "panel:export")
+async def cb_export_menu(callback: CallbackQuery):
+    builder = InlineKeyboardBuilder()
+    for status_filter, label in STATUS_LABELS.items():
+        for fmt in EXPORT_FORMATS:
+            builder.button(text=f"{label} · {fmt.upper()}", callback_data=f"export:run:{fmt}:{status_filter}")
+    builder.button(text="⬅️ Back to Main Menu", callback_data="panel:main_menu")
+    builder.adjust(2)
+    await callback.message.edit_text(
+        "📤 *Export Users*\nChoose which users to export and the file format.\n"
+        "_Tip: /export csv expired admin=NAME exports one admin's users._",
+        reply_markup=builder.as_markup(),
+        parse_mode="Markdown"
+    )
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("export:run:"))
+async def cb_run_export(callback: CallbackQuery, bot: Bot, api_client: MarzneshinAPI):
+    try:
+        _, _, fmt, status_filter = callback.data.split(":")
+    except ValueError:
+        logger.warning(f"Invalid callback data for export: {callback.data}")
+        return await callback.answer()
+    if fmt not in EXPORT_FORMATS or status_filter not in USER_STATUS_FILTERS:
+        return await callback.answer()
+
+    if _start_export(bot, callback.message.chat.id, api_client, fmt, status_filter):
+        await callback.answer("Export started.")
+    else:
+        await callback.answer("An export is already running for this chat.", show_alert=True)
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject, bot: Bot, api_client: MarzneshinAPI):
+    # /export [csv|json] [all|active|disabled|expired|limited] [admin=NAME], in any order.
+    fmt, status_filter, owner = "csv", "all", None
+    for token in (command.args or "").split():
+        token_lower = token.lower()
+        if token_lower in EXPORT_FORMATS:
+            fmt = token_lower
+        elif token_lower in USER_STATUS_FILTERS:
+            status_filter = token_lower
+        elif token_lower.startswith("admin=") and len(token) > 6:
+            owner = token[6:]
+        else:
+            await message.answer(
+                "Usage: /export [csv|json] [all|active|disabled|expired|limited] [admin=NAME]"
+            )
+            return
+
+    if not _start_export(bot, message.chat.id, api_client, fmt, status_filter, owner):
+        await message.answer("⏳ An export is already running for this chat.")
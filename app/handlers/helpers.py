@@ -1,7 +1,8 @@
 import logging
 import asyncio
 from html import escape
-from typing import List, Tuple
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
 
 from aiogram import Bot
 from aiogram.exceptions import TelegramBadRequest
@@ -11,22 +12,32 @@ from aiogram.fsm.context import FSMContext
 
 from .states import GeneralPanelFSM, UserEditFSM
 from app.api.marzneshin import User, MarzneshinAPI
+from app.cache.dashboard import dashboard_cache
+from app.cache.qr import qr_cache, qr_file_ids
+from app.cache.services import service_catalog
 from app.utils.helpers import (
     format_expiry, format_time_ago,
-    format_traffic, generate_qr_code
+    format_traffic
 )
 
 logger = logging.getLogger(__name__)
 
+# get_all_users() filters behind the user list's status filters (and the export's).
+USER_STATUS_FILTERS = {
+    "active": {"is_active": True, "expired": False, "enabled": True, "data_limit_reached": False},
+    "disabled": {"enabled": False},
+    "expired": {"expired": True},
+    "limited": {"data_limit_reached": True, "expired": False},
+    "all": {}
+}
+
 async def _get_dashboard_content(
     api_client: MarzneshinAPI,
+    panels: Sequence[str] = (),
 ) -> Tuple[str, InlineKeyboardMarkup]:
     
-    traffic_stats, user_stats, admin_info = await asyncio.gather(
-        api_client.get_system_traffic_stats(),
-        api_client.get_system_users_stats(),
-        api_client.get_current_admin()
-    )
+    snapshot = await dashboard_cache.get(api_client)
+    traffic_stats, user_stats, admin_info = snapshot.traffic_stats, snapshot.user_stats, snapshot.admin_info
 
     traffic_text = "📊 Traffic Usage: _Not Available_"
     if traffic_stats:
@@ -45,10 +56,13 @@ async def _get_dashboard_content(
             f"🪫 Limited: {user_stats.limited}"
         )
 
+    panel_text = f"🌐 Panel: `{api_client.panel_name}`\n" if len(panels) > 1 else ""
+    fetched_at = datetime.fromtimestamp(snapshot.fetched_at, timezone.utc)
     text = (
-        f"📊 *SahraBot Dashboard*\n"
+        f"📊 *SahraBot Dashboard*\n{panel_text}"
         f"━━━━━━━━━━━━━━\n{users_text}\n"
-        f"━━━━━━━━━━━━━━\n{traffic_text}"
+        f"━━━━━━━━━━━━━━\n{traffic_text}\n"
+        f"━━━━━━━━━━━━━━\n🕒 _Data as of {fetched_at:%H:%M:%S} UTC ({format_time_ago(fetched_at)})_"
     )
 
     builder = InlineKeyboardBuilder()
@@ -59,9 +73,13 @@ async def _get_dashboard_content(
     if is_sudo_admin:
         builder.button(text="🛰️ Nodes", callback_data="nodes:menu")
 
+    builder.button(text="📈 Report", callback_data="panel:report")
+    builder.button(text="📤 Export", callback_data="panel:export")
     builder.button(text="🔍 Search User", callback_data="panel:search_user")
+    if len(panels) > 1:
+        builder.button(text="🌐 Switch Panel", callback_data="panel:switch")
     builder.button(text="✖️ Close", callback_data="panel:close")
-    builder.adjust(1, 2, 1)
+    builder.adjust(1, 2, 2, 1)
 
     return text, builder.as_markup()
 
@@ -86,9 +104,9 @@ def _get_user_details_content(user: User, back_callback: str) -> Tuple[str, Inli
 
     builder = InlineKeyboardBuilder()
     if user.enabled:
-        builder.button(text="🚫 Disable", callback_data=f"user:toggle_enable:{user.username}")
+        builder.button(text="🚫 Disable", callback_data=f"user:toggle_enable:{user.username}:0")
     else:
-        builder.button(text="✅ Enable", callback_data=f"user:toggle_enable:{user.username}")
+        builder.button(text="✅ Enable", callback_data=f"user:toggle_enable:{user.username}:1")
 
     builder.button(text="✏️ Edit", callback_data=f"user:edit_menu:{user.username}")
     builder.button(text="🔄 Renew", callback_data=f"user:renew_menu:{user.username}")
@@ -150,10 +168,11 @@ async def _display_user_details(
     username: str,
     back_callback: str,
     api_client: MarzneshinAPI,
+    user: Optional[User] = None,
 ):
-    api_params = {"username": username}
-
-    user = await api_client.get_user(**api_params)
+    # Callers that just mutated the user pass the panel's response to skip a refetch.
+    if user is None:
+        user = await api_client.get_user(username)
     if not user:
         await bot.edit_message_text(
             "❌ Could not fetch user details.",
@@ -202,14 +221,33 @@ async def _send_user_subscription_info(
     builder = InlineKeyboardBuilder()
     builder.button(text="🚀 Open Subscription Link", url=user.subscription_url)
 
-    qr_img = generate_qr_code(user.subscription_url)
-    await bot.send_photo(
+    link = user.subscription_url
+    panel = api_client.panel_name
+    file_id = qr_file_ids.get(panel, link)
+    if file_id:
+        try:
+            await bot.send_photo(
+                chat_id=message.chat.id,
+                photo=file_id,
+                caption=caption,
+                parse_mode="Markdown",
+                reply_markup=builder.as_markup()
+            )
+            return
+        except TelegramBadRequest as e:
+            logger.info(f"Stored QR file_id was rejected ({e}); uploading the image again.")
+            qr_file_ids.discard(panel, link)
+
+    qr_png = await qr_cache.get_png(panel, link)
+    sent = await bot.send_photo(
         chat_id=message.chat.id,
-        photo=BufferedInputFile(qr_img.getvalue(), "subscription.png"),
+        photo=BufferedInputFile(qr_png, "subscription.png"),
         caption=caption,
         parse_mode="Markdown",
         reply_markup=builder.as_markup()
     )
+    if sent.photo:
+        qr_file_ids.set(panel, link, sent.photo[-1].file_id)
 
 def _determine_user_status(user: User) -> Tuple[str, str]:
     if not user.enabled: return "❌", "Disabled"
@@ -222,22 +260,28 @@ async def _display_service_selection(
     message: Message,
     state: FSMContext,
     api_client: MarzneshinAPI,
+    refresh: bool = False,
 ):
     await state.set_state(UserEditFSM.waiting_for_services)
     fsm_data = await state.get_data() or {}
     username = fsm_data.get("username")
 
-    api_params = {}
-
-    all_services = await api_client.get_services(**api_params)
-    if not all_services:
-        return await message.edit_text("❌ No services are configured on the panel.")
-
+    # Toggles re-render from FSM state and the cached catalog; only the first render needs the user.
     selected_service_ids = fsm_data.get("selected_service_ids")
     if selected_service_ids is None:
-        user = await api_client.get_user(username, **api_params)
+        all_services, user = await asyncio.gather(
+            service_catalog.get(api_client, refresh=refresh),
+            api_client.get_user(username)
+        )
+        if not user:
+            return await message.edit_text("❌ Could not fetch user details.")
         selected_service_ids = set(user.service_ids)
         await state.update_data(selected_service_ids=list(selected_service_ids))
+    else:
+        all_services = await service_catalog.get(api_client, refresh=refresh)
+
+    if not all_services:
+        return await message.edit_text("❌ No services are configured on the panel.")
 
     builder = InlineKeyboardBuilder()
     for service in all_services:
@@ -246,6 +290,7 @@ async def _display_service_selection(
         builder.button(text=text, callback_data=f"user_edit_service:toggle:{service.id}")
     
     builder.button(text="💾 Save Changes", callback_data="user_edit_service:save")
+    builder.button(text="🔄 Refresh Services", callback_data="user_edit_service:refresh")
     builder.button(text="⬅️ Cancel", callback_data=f"user:edit_menu:{username}")
     builder.adjust(1)
     
@@ -289,9 +334,9 @@ async def _apply_user_update(
 
     payload["username"] = username
 
-    update_success = await api_client.update_user(username, payload)
+    updated_user = await api_client.update_user(username, payload)
 
-    if not update_success:
+    if not updated_user:
         await panel_message.edit_text("❌ An error occurred while updating the user.")
     
     await state.set_state(GeneralPanelFSM.view_user)
@@ -303,5 +348,6 @@ async def _apply_user_update(
         panel_message.message_id,
         username,
         back_callback,
-        api_client
+        api_client,
+        user=updated_user
     )
\ No newline at end of file
@@ -8,9 +8,11 @@ from aiogram.types import CallbackQuery, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from app.api.marzneshin import MarzneshinAPI
+from app.cache.mirror import user_mirror
+from app.core.api_manager import api_manager
 from app.core.config import settings
 from .helpers import (
-    _create_users_paginator, _display_user_details,
+    USER_STATUS_FILTERS, _create_users_paginator, _display_user_details,
     _get_dashboard_content
 )
 from .states import GeneralPanelFSM
@@ -33,7 +35,7 @@ async def cmd_start_panel(message: Message, state: FSMContext, bot: Bot, api_cli
         except TelegramBadRequest as e:
             logger.warning(f"Failed to delete old panel message: {e}")
 
-    text, keyboard = await _get_dashboard_content(api_client)
+    text, keyboard = await _get_dashboard_content(api_client, api_manager.get_panels(message.chat.id))
     
     new_panel = await message.answer(
         text,
@@ -55,23 +57,16 @@ async def cb_browse_users(callback: CallbackQuery, state: FSMContext, api_client
         logger.warning(f"Invalid callback data for user browsing: {callback.data}")
         return
 
-    filter_map = {
-        "active": {"is_active": True, "expired": False, "enabled": True, "data_limit_reached": False},
-        "disabled": {"enabled": False},
-        "expired": {"expired": True},
-        "limited": {"data_limit_reached": True, "expired": False},
-        "all": {}
-    }
-    
     api_params = {
-        "page": page + 1,
-        "size": 10,
         "order_by": "created_at",
         "descending": True
     }
-    api_params.update(filter_map.get(status_filter, {}))
+    api_params.update(USER_STATUS_FILTERS.get(status_filter, {}))
     
-    pagination_data = await api_client.get_all_users(**api_params)
+    # The panel is only asked while the local mirror is still being built.
+    pagination_data = await user_mirror.get_page(api_client, api_params, page)
+    if pagination_data is None:
+        pagination_data = await api_client.get_all_users(page=page + 1, size=10, **api_params)
     
     if not pagination_data or not pagination_data["users"]:
         text = f"ℹ️ No users found with filter: *{status_filter}*"
@@ -135,7 +130,7 @@ async def cb_back_to_main_menu(callback: CallbackQuery, state: FSMContext, api_c
         logger.warning(f"Failed to delete message on 'Back': {e}")
         await callback.answer()
 
-    text, keyboard = await _get_dashboard_content(api_client)
+    text, keyboard = await _get_dashboard_content(api_client, api_manager.get_panels(callback.message.chat.id))
 
     new_panel = await callback.message.answer(
         text,
@@ -146,6 +141,21 @@ async def cb_back_to_main_menu(callback: CallbackQuery, state: FSMContext, api_c
     await state.set_state(GeneralPanelFSM.main_menu)
     await state.update_data(main_panel_id=new_panel.message_id)
 
+@router.callback_query(F.data == "panel:switch", GeneralPanelFSM.main_menu)
+async def cb_switch_panel(callback: CallbackQuery, api_client: MarzneshinAPI):
+    chat_id = callback.message.chat.id
+    panels = api_manager.get_panels(chat_id)
+    if len(panels) < 2:
+        return await callback.answer()
+
+    next_panel = panels[(panels.index(api_client.panel_name) + 1) % len(panels)]
+    api_manager.set_active_panel(chat_id, next_panel)
+    await callback.answer(f"Switched to panel: {next_panel}")
+
+    api_client, _ = await api_manager.get_client(chat_id)
+    text, keyboard = await _get_dashboard_content(api_client, panels)
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+
 @router.callback_query(F.data.startswith("user:view:"))
 async def cb_view_user(callback: CallbackQuery, state: FSMContext, bot: Bot, api_client: MarzneshinAPI):
     await callback.answer()
@@ -1,3 +1,4 @@
+import time
 from typing import Any, Awaitable, Callable, Dict
 
 from aiogram import BaseMiddleware
@@ -5,6 +6,28 @@ from aiogram.types import TelegramObject
 
 from app.core.api_manager import api_manager
 from app.core.config import settings
+from app.core.health import health
+from app.core.metrics import HANDLER_ERRORS, HANDLER_LATENCY, UPDATES_TOTAL
+
+class MetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        health.update_received()
+        update_type = getattr(event, "event_type", None) or type(event).__name__
+        UPDATES_TOTAL.labels(update_type).inc()
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(update_type).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(update_type).observe(time.perf_counter() - started)
 
 class AdminAuthMiddleware(BaseMiddleware):
     async def __call__(
@@ -28,4 +51,4 @@ class AdminAuthMiddleware(BaseMiddleware):
             print(f"Middleware Error: {e}")
             return None
 
-        return await handler(event, data)
\ No newline at end of file
+        return await handler(event, data)
@@ -1,4 +1,7 @@
 import logging
+import time
+from datetime import timedelta
+from typing import Dict, Optional
 
 from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
@@ -7,7 +10,9 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from app.api.marzneshin import MarzneshinAPI
 from app.core.config import settings
+from app.core.leader import leader
 from app.handlers.states import NodeFSM
+from app.monitoring.history import WINDOWS, node_history
 from app.monitoring.state_manager import state_manager
 
 logger = logging.getLogger(__name__)
@@ -21,25 +26,59 @@ STATUS_EMOJI = {
     "disabled": "❌"
 }
 
+# Telegram caps messages at 4096 characters; large fleets are summarised instead of listed in full.
+NODES_TEXT_BUDGET = 3500
+UPTIME_PAGE_SIZE = 10
+
+def _format_uptime(value: Optional[float]) -> str:
+    return f"{value:.2f}%" if value is not None else "n/a"
+
+def _format_seconds(seconds: Optional[float]) -> str:
+    return str(timedelta(seconds=int(seconds))) if seconds is not None else "-"
+
 @router.callback_query(F.data == "nodes:menu")
 async def cb_nodes_menu(callback: CallbackQuery, state: FSMContext, api_client: MarzneshinAPI):
     
     await state.set_state(NodeFSM.menu)
     await callback.answer("Fetching node list...")
     
-    nodes_list = await api_client.get_nodes(size=100)
+    nodes_list = await api_client.get_all_nodes()
     
-    text_lines = ["🛰️ *Nodes List*\n━━━━━━━━━━━━━━"]
+    role_emoji = "👑" if leader.is_leader else "💤"
+    text_lines = [
+        "🛰️ *Nodes List*\n━━━━━━━━━━━━━━",
+        f"{role_emoji} Bot replica: *{leader.role.capitalize()}* (`{leader.instance_id}`)\n",
+    ]
     builder = InlineKeyboardBuilder()
     
-    if nodes_list and nodes_list.items:
-        for node in nodes_list.items:
+    if nodes_list:
+        status_counts: Dict[str, int] = {}
+        for node in nodes_list:
+            status_counts[node.status] = status_counts.get(node.status, 0) + 1
+        if len(nodes_list) > 1:
+            summary = " | ".join(
+                f"{STATUS_EMOJI.get(status, '❓')} {count}" for status, count in sorted(status_counts.items())
+            )
+            text_lines.append(f"Total: *{len(nodes_list)}* — {summary}\n")
+
+        # Problem nodes first, so they stay visible when the list has to be truncated.
+        ordered_nodes = sorted(nodes_list, key=lambda n: (n.status == "healthy", n.name.lower()))
+        text_length = sum(len(line) + 1 for line in text_lines)
+        for index, node in enumerate(ordered_nodes):
             emoji = STATUS_EMOJI.get(node.status, "❓")
-            text_lines.append(f"{emoji} *{node.name}* (`{node.status}`)")
+            line = f"{emoji} *{node.name}* (`{node.status}`)"
+            if text_length + len(line) + 1 > NODES_TEXT_BUDGET:
+                text_lines.append(f"_…and {len(ordered_nodes) - index} more._")
+                break
+            text_lines.append(line)
+            text_length += len(line) + 1
     else:
         text_lines.append("_No nodes found or access denied._")
     
-    builder.row(InlineKeyboardButton(text="📊 Node Monitoring", callback_data="nodes:monitoring_menu"))
+    builder.row(
+        InlineKeyboardButton(text="📊 Node Monitoring", callback_data="nodes:monitoring_menu"),
+        InlineKeyboardButton(text="📈 Uptime", callback_data="nodes:uptime:0"),
+    )
     builder.row(InlineKeyboardButton(text="⬅️ Back to Main Menu", callback_data="panel:main_menu"))
     
     await callback.message.edit_text(
@@ -59,7 +98,8 @@ async def cb_monitoring_menu(callback: CallbackQuery, state: FSMContext):
         f"📊 *Node Monitoring*\n"
         f"━━━━━━━━━━━━━━\n"
         f"Node monitoring is currently *{'ENABLED' if is_enabled else 'DISABLED'}*.\n\n"
-        "When enabled, the bot will run a background task to check all nodes every 60 seconds."
+        f"When enabled, the bot will run a background task to check all nodes every {settings.MONITORING_INTERVAL} seconds, "
+        f"and every {settings.MONITORING_INCIDENT_INTERVAL} seconds while a node is unhealthy."
     )
     
     builder = InlineKeyboardBuilder()
@@ -81,4 +121,70 @@ async def cb_toggle_monitoring(callback: CallbackQuery, state: FSMContext):
     await state_manager.set_monitoring_enabled(new_status)
     await callback.answer(f"✅ Monitoring is now {'ENABLED' if new_status else 'DISABLED'}.", show_alert=True)
     
-    await cb_monitoring_menu(callback, state)
\ No newline at end of file
+    await cb_monitoring_menu(callback, state)
+
+@router.callback_query(F.data.startswith("nodes:uptime:"))
+async def cb_uptime_list(callback: CallbackQuery, state: FSMContext, api_client: MarzneshinAPI):
+    await state.set_state(NodeFSM.menu)
+    try:
+        page = int(callback.data.split(":")[2])
+    except (ValueError, IndexError):
+        page = 0
+
+    # Only the nodes of the panel the admin is working on; history keys are "<panel>:<node id>".
+    rows = node_history.ranked_by_uptime(WINDOWS["24h"], prefix=f"{api_client.panel_name}:")
+    total_pages = max(1, (len(rows) + UPTIME_PAGE_SIZE - 1) // UPTIME_PAGE_SIZE)
+    page = min(max(page, 0), total_pages - 1)
+
+    builder = InlineKeyboardBuilder()
+    if rows:
+        text = f"📈 *Node Uptime (24h)* - Page {page + 1} / {total_pages}\n_Lowest uptime first. Tap a node for details._"
+        if len(settings.panels) > 1:
+            text += f"\n🌐 Panel: `{api_client.panel_name}`"
+        for key, history, uptime in rows[page * UPTIME_PAGE_SIZE:(page + 1) * UPTIME_PAGE_SIZE]:
+            emoji = "💔" if history.open_since is not None else "💚"
+            builder.row(InlineKeyboardButton(
+                text=f"{emoji} {history.name} — {_format_uptime(uptime)}",
+                callback_data=f"nodes:uptime_node:{key}:{page}"
+            ))
+    else:
+        text = "📈 *Node Uptime*\n\n_No history yet. Samples are collected while monitoring is enabled._"
+
+    nav_row = []
+    if page > 0:
+        nav_row.append(InlineKeyboardButton(text="⬅️ Prev", callback_data=f"nodes:uptime:{page - 1}"))
+    if page < total_pages - 1:
+        nav_row.append(InlineKeyboardButton(text="Next ➡️", callback_data=f"nodes:uptime:{page + 1}"))
+    if nav_row:
+        builder.row(*nav_row)
+    builder.row(InlineKeyboardButton(text="⬅️ Back to Nodes", callback_data="nodes:menu"))
+
+    await callback.message.edit_text(text, reply_markup=builder.as_markup(), parse_mode="Markdown")
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("nodes:uptime_node:"))
+async def cb_uptime_node(callback: CallbackQuery, api_client: MarzneshinAPI):
+    # The key itself contains a colon ("<panel>:<node id>"), so the page is taken from the end.
+    key, _, back_page = callback.data[len("nodes:uptime_node:"):].rpartition(":")
+
+    history = node_history.get(key) if key.startswith(f"{api_client.panel_name}:") else None
+    if history is None:
+        await callback.answer("❌ No history for this node.", show_alert=True)
+        return
+
+    now = time.time()
+    lines = [f"📈 *{history.name}*", "━━━━━━━━━━━━━━"]
+    if history.open_since is not None:
+        lines.append(f"💔 Down for `{_format_seconds(now - history.open_since)}`\n")
+    for label, window in WINDOWS.items():
+        incidents, mttr = history.incident_stats(window, now)
+        lines.append(
+            f"*{label}:* {_format_uptime(history.uptime(window, now))} | "
+            f"Incidents: {incidents} | MTTR: `{_format_seconds(mttr)}`"
+        )
+
+    builder = InlineKeyboardBuilder()
+    builder.button(text="⬅️ Back to Uptime", callback_data=f"nodes:uptime:{back_page}")
+
+    await callback.message.edit_text("\n".join(lines), reply_markup=builder.as_markup(), parse_mode="Markdown")
+    await callback.answer()
@@ -0,0 +1,128 @@
+import logging
+from datetime import datetime, timezone
+from html import escape
+from typing import Tuple
+
+from aiogram import F, Router
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command
+from aiogram.types import BufferedInputFile, CallbackQuery, InlineKeyboardMarkup, Message
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from app.api.marzneshin import MarzneshinAPI
+from app.cache.reports import EXPIRY_BUCKETS, UsageReport, report_cache
+from app.core.api_manager import api_manager
+from app.core.config import settings
+from app.utils.helpers import format_time_ago, format_traffic
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+router.message.filter(F.from_user.id.in_(settings.admin_chat_ids))
+router.callback_query.filter(F.from_user.id.in_(settings.admin_chat_ids))
+
+REPORT_OWNER_LINES = 10
+
+def _format_report(report: UsageReport, show_panel: bool) -> Tuple[str, InlineKeyboardMarkup]:
+    total = report.total
+    statuses = total.statuses
+    allocated = format_traffic(total.allocated)
+    share = f" ({total.used / total.allocated:.0%} of allocated)" if total.allocated else ""
+    expiring = " · ".join(f"{label} {total.expiring[label]}" for label, _ in EXPIRY_BUCKETS)
+
+    lines = ["📈 <b>Usage Report</b>"]
+    if show_panel:
+        lines.append(f"🌐 Panel: <code>{escape(report.panel)}</code>")
+    lines += [
+        "━━━━━━━━━━━━━━",
+        f"👥 Users: <b>{total.users}</b>",
+        f"✅ {statuses['active']} | ❌ {statuses['disabled']} | ⌛️ {statuses['expired']} | "
+        f"🪫 {statuses['limited']} | ⏸️ {statuses['inactive']}",
+        f"🔋 Allocated: {allocated} (+{total.unlimited} unlimited)",
+        f"📶 Used: {format_traffic(total.used)}{share}",
+        f"📅 Expiring within: {expiring} · never {total.no_expiry}",
+    ]
+
+    if report.top_consumers:
+        lines += ["━━━━━━━━━━━━━━", "🏆 <b>Top consumers</b>"]
+        lines += [
+            f"{rank}. <code>{escape(username)}</code> — {format_traffic(used)}"
+            for rank, (username, used) in enumerate(report.top_consumers, start=1)
+        ]
+
+    if total.over_quota:
+        threshold = f"{settings.USAGE_ALERT_QUOTA_THRESHOLD:.0%}"
+        lines += ["━━━━━━━━━━━━━━", f"🔥 <b>At {threshold}+ of quota</b>: {total.over_quota} users"]
+        lines += [f"<code>{escape(username)}</code> — {ratio:.0%}" for username, ratio in report.over_quota]
+        if total.over_quota > len(report.over_quota):
+            lines.append("<i>…the full count per admin is in the CSV.</i>")
+
+    if len(report.owners) > 1:
+        lines += ["━━━━━━━━━━━━━━", "👨‍💻 <b>Per admin</b> (by usage)"]
+        for usage in report.owners[:REPORT_OWNER_LINES]:
+            lines.append(
+                f"<code>{escape(usage.owner)}</code> — {usage.users} users · "
+                f"{format_traffic(usage.used)} / {format_traffic(usage.allocated)}"
+            )
+        if len(report.owners) > REPORT_OWNER_LINES:
+            lines.append(f"<i>…and {len(report.owners) - REPORT_OWNER_LINES} more in the CSV.</i>")
+
+    generated_at = datetime.fromtimestamp(report.generated_at, timezone.utc)
+    lines += ["━━━━━━━━━━━━━━", f"🕒 <i>Generated {generated_at:%H:%M:%S} UTC ({format_time_ago(generated_at)})</i>"]
+
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔄 Refresh", callback_data="report:refresh")
+    builder.button(text="⬅️ Back to Main Menu", callback_data="panel:main_menu")
+    builder.adjust(1)
+    return "\n".join(lines), builder.as_markup()
+
+async def _send_csv(message: Message, report: UsageReport):
+    # The cached report keeps the file_id of its CSV, so reopening it sends no new upload.
+    if report.csv_file_id:
+        try:
+            await message.answer_document(report.csv_file_id)
+            return
+        except TelegramBadRequest as e:
+            logger.info(f"Stored report file_id was rejected ({e}); uploading the CSV again.")
+            report.csv_file_id = None
+
+    generated_at = datetime.fromtimestamp(report.generated_at, timezone.utc)
+    filename = f"usage-{report.panel}-{generated_at:%Y%m%d-%H%M}.csv"
+    sent = await message.answer_document(BufferedInputFile(report.to_csv(), filename))
+    if sent.document:
+        report.csv_file_id = sent.document.file_id
+
+async def _show_report(message: Message, api_client: MarzneshinAPI, edit: bool, refresh: bool = False):
+    report = await report_cache.get(api_client, refresh=refresh)
+    if report is None:
+        text = "❌ The report is not available yet. Please try again in a few minutes."
+        if edit:
+            await message.edit_text(text)
+        else:
+            await message.answer(text)
+        return
+
+    text, keyboard = _format_report(report, len(api_manager.get_panels(message.chat.id)) > 1)
+    if edit:
+        try:
+            await message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+    else:
+        await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+    await _send_csv(message, report)
+
+@router.message(Command("report"))
+async def cmd_report(message: Message, api_client: MarzneshinAPI):
+    await _show_report(message, api_client, edit=False)
+
+@router.callback_query(F.data == "panel:report")
+async def cb_report(callback: CallbackQuery, api_client: MarzneshinAPI):
+    await callback.answer("Building report...")
+    await _show_report(callback.message, api_client, edit=True)
+
+@router.callback_query(F.data == "report:refresh")
+async def cb_refresh_report(callback: CallbackQuery, api_client: MarzneshinAPI):
+    await callback.answer("Refreshing report...")
+    await _show_report(callback.message, api_client, edit=True, refresh=True)
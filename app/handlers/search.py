@@ -1,7 +1,8 @@
+import asyncio
+import hashlib
 import logging
 import re
-import uuid
-from typing import Optional, List
+from typing import Dict, Optional, List, Tuple, Union
 from html import escape
 
 from aiogram import F, Bot, Router
@@ -11,14 +12,25 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 
 from app.api.marzneshin import MarzneshinAPI, User
+from app.cache.subscriptions import subscription_resolver
+from app.cache.user_index import IndexedUser, username_index
+from app.core.api_manager import api_manager
 from app.core.config import settings
-from app.utils.helpers import format_expiry, format_traffic, extract_subscription_data, extract_inline_username
+from app.utils.helpers import (
+    format_expiry, format_traffic, extract_subscription_data,
+    extract_inline_username, extract_inline_panel
+)
 from .helpers import _determine_user_status, _display_user_details
 from .states import GeneralPanelFSM
 
 router = Router()
 logger = logging.getLogger(__name__)
 
+INLINE_PAGE_SIZE = 50  # Telegram's maximum per answer
+
+# The newest inline query of each admin; typing a character supersedes the previous query.
+_inline_searches: Dict[int, asyncio.Task] = {}
+
 @router.message(GeneralPanelFSM.search_user)
 async def msg_handle_search_input(
     message: Message,
@@ -47,6 +59,12 @@ async def msg_handle_search_input(
 
     user: Optional[User] = None
     username_to_search: str = ""
+
+    # Results forwarded from a multi-panel inline search say which panel they came from.
+    panel_from_inline = extract_inline_panel(search_text)
+    if panel_from_inline and panel_from_inline != api_client.panel_name:
+        if api_manager.set_active_panel(message.chat.id, panel_from_inline):
+            api_client, _ = await api_manager.get_client(message.chat.id)
     
     username_from_inline = extract_inline_username(search_text)
     if username_from_inline:
@@ -56,10 +74,8 @@ async def msg_handle_search_input(
         sub_data = extract_subscription_data(search_text)
         if sub_data:
             sub_username, sub_key = sub_data
-            user_info_dict = await api_client.get_sub_info(sub_username, sub_key)
-            if user_info_dict:
-                user = User(**user_info_dict)
             username_to_search = sub_username
+            user = await subscription_resolver.resolve(api_client, sub_username, sub_key)
         else:
             username_to_search = search_text.splitlines()[0]
             if username_to_search:
@@ -69,7 +85,7 @@ async def msg_handle_search_input(
         await state.set_state(GeneralPanelFSM.view_user)
         back_callback = "panel:main_menu"
         await _display_user_details(
-            bot, message.chat.id, panel_message_id, user.username, back_callback, api_client
+            bot, message.chat.id, panel_message_id, user.username, back_callback, api_client, user=user
         )
     else:
         builder = InlineKeyboardBuilder().button(
@@ -83,35 +99,116 @@ async def msg_handle_search_input(
             parse_mode="Markdown"
         )
 
+def _match_rank(username: str, term: str) -> int:
+    username, term = username.lower(), term.lower()
+    if username == term:
+        return 0
+    if username.startswith(term):
+        return 1
+    return 2
+
+async def _search_index(client: MarzneshinAPI, term: str, owner: Optional[str], limit: int) -> Optional[List[IndexedUser]]:
+    # None when the panel has to be asked instead: its index is still cold or the admin's role is unknown.
+    is_sudo = await client.is_sudo()
+    if is_sudo is None:
+        return None
+    if not is_sudo:
+        # The index holds every user on the panel; other admins only ever see their own.
+        if owner and owner != client.username:
+            return []
+        owner = client.username
+    return username_index.search(client.panel_name, term, owner, limit)
+
+async def _search_panels(chat_id: int, term: str, owner: Optional[str], page: int) -> Tuple[List[Tuple[str, Union[User, IndexedUser]]], bool]:
+    # One page of results per panel, so scrolling costs each panel a single request; the panels share
+    # Telegram's per-answer limit. Also tells whether any panel has a further page.
+    clients = await api_manager.get_clients(chat_id)
+    size = max(1, INLINE_PAGE_SIZE // max(1, len(clients)))
+    start = (page - 1) * size
+
+    async def search(client: MarzneshinAPI) -> Tuple[List[Tuple[str, Union[User, IndexedUser]]], bool]:
+        try:
+            local = await _search_index(client, term, owner, start + size + 1)
+            if local is not None:
+                return [(client.panel_name, user) for user in local[start:start + size]], len(local) > start + size
+
+            # Only a query the admin stopped typing on is worth a panel search; a newer keystroke
+            # cancels this one during the wait.
+            await asyncio.sleep(settings.INLINE_SEARCH_DEBOUNCE)
+            api_params = {}
+            if term:
+                api_params["username"] = term
+            if owner:
+                api_params["owner_username"] = owner
+            pagination_data = await client.get_all_users(page=page, size=size, **api_params)
+            if not pagination_data:
+                return [], False
+            users = [user for user in pagination_data["users"] if isinstance(user, User)]
+        except Exception as e:
+            logger.warning(f"Inline search on panel '{client.panel_name}' failed: {e}")
+            return [], False
+        return [(client.panel_name, user) for user in users[:size]], page < pagination_data["pages"]
+
+    # Panels are queried in parallel; one slow or failing panel only drops its own results.
+    per_panel = await asyncio.gather(*(search(client) for client, _ in clients))
+    merged = [item for results, _ in per_panel for item in results]
+
+    merged.sort(key=lambda item: (_match_rank(item[1].username, term), item[1].username.lower(), item[0]))
+    return merged, any(more for _, more in per_panel)
+
+def _inline_result_id(panel_name: str, username: str) -> str:
+    # Stable across answers so Telegram can cache them; hashed to stay within the 64-byte id limit.
+    return hashlib.md5(f"{panel_name}:{username}".encode("utf-8")).hexdigest()
+
 @router.inline_query(F.from_user.id.in_(settings.admin_chat_ids))
-async def inline_search_handler(inline_query: InlineQuery, api_client: MarzneshinAPI):
+async def inline_search_handler(inline_query: InlineQuery):
+    admin_id = inline_query.from_user.id
+    previous = _inline_searches.get(admin_id)
+    if previous is not None and not previous.done():
+        previous.cancel()
+    current = _inline_searches[admin_id] = asyncio.current_task()
+    try:
+        await _answer_inline_search(inline_query)
+    finally:
+        if _inline_searches.get(admin_id) is current:
+            del _inline_searches[admin_id]
+
+async def _answer_inline_search(inline_query: InlineQuery):
     query_text = inline_query.query.strip()
 
     if not query_text:
         await inline_query.answer([], cache_time=1, switch_pm_text="🔎 Type a username...", switch_pm_parameter="start")
         return
 
-    api_params = {"size": 50}
-    
+    owner: Optional[str] = None
+    search_term = query_text
+
     admin_search_pattern = re.match(r"admin=(\w+)\s+(.+)", query_text, re.IGNORECASE)
     admin_only_pattern = re.match(r"admin=(\w+)", query_text, re.IGNORECASE)
 
     if admin_search_pattern:
         owner, search_term = admin_search_pattern.groups()
-        api_params["owner_username"] = owner
-        api_params["username"] = search_term
     elif admin_only_pattern:
         owner = admin_only_pattern.groups()[0]
-        api_params["owner_username"] = owner
-    else:
-        api_params["username"] = query_text
-    
-    pagination_data = await api_client.get_all_users(**api_params)
+        search_term = ""
+
+    try:
+        offset = max(0, int(inline_query.offset or 0))
+    except ValueError:
+        offset = 0
+
+    # The offset Telegram hands back is the one set below, so it always maps to a whole page.
+    page = offset // INLINE_PAGE_SIZE + 1
+    results, has_more = await _search_panels(inline_query.from_user.id, search_term, owner, page)
+    show_panel = len(api_manager.get_panels(inline_query.from_user.id)) > 1
     
-    if not pagination_data or not pagination_data["users"]:
+    if not results and offset:
+        return await inline_query.answer([], cache_time=settings.INLINE_SEARCH_CACHE_TIME, is_personal=True, next_offset="")
+
+    if not results:
         not_found_article = [
             InlineQueryResultArticle(
-                id=str(uuid.uuid4()),
+                id="not_found",
                 title="❌ No users found",
                 description="No results match your search",
                 input_message_content=InputTextMessageContent(
@@ -121,13 +218,8 @@ async def inline_search_handler(inline_query: InlineQuery, api_client: Marzneshi
         ]
         return await inline_query.answer(not_found_article, cache_time=1)
     
-    results = pagination_data["users"]
-
     articles: List[InlineQueryResultArticle] = []
-    for user in results:
-        if not isinstance(user, User):
-            continue
-
+    for panel_name, user in results:
         emoji, status_text = _determine_user_status(user)
         
         limit_str = "Unlimited" if user.data_limit == 0 else format_traffic(user.data_limit)
@@ -138,6 +230,8 @@ async def inline_search_handler(inline_query: InlineQuery, api_client: Marzneshi
             f"🔤 *Username*: `{escape(user.username)}`\n\n"
             f"🔗 *Sub Link*: `{escape(user.subscription_url)}`"
         )
+        if show_panel:
+            caption += f"\n\n🌐 *Panel*: `{escape(panel_name)}`"
         
         input_content = InputTextMessageContent(
             message_text=caption,
@@ -146,12 +240,17 @@ async def inline_search_handler(inline_query: InlineQuery, api_client: Marzneshi
         
         articles.append(
             InlineQueryResultArticle(
-                id=str(uuid.uuid4()),
-                title=f"{emoji} {user.username}",
+                id=_inline_result_id(panel_name, user.username),
+                title=f"{emoji} {user.username}" + (f" · {panel_name}" if show_panel else ""),
                 description=f"📊 {used_str} / {limit_str} | ⏳ {expire_str}",
                 input_message_content=input_content,
                 thumbnail_url="https://img.icons8.com/fluency/48/user-male-circle--v1.png"
             )
         )
 
-    await inline_query.answer(articles, cache_time=5, is_personal=True)
+    await inline_query.answer(
+        articles,
+        cache_time=settings.INLINE_SEARCH_CACHE_TIME,
+        is_personal=True,
+        next_offset=str(page * INLINE_PAGE_SIZE) if has_more else "",
+    )
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from html import escape
 from datetime import datetime, timezone, timedelta
@@ -9,6 +10,8 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.exceptions import TelegramBadRequest
 
 from app.api.marzneshin import MarzneshinAPI
+from app.cache.services import service_catalog
+from app.cache.user_index import username_index
 from app.core.config import settings
 from app.utils.helpers import (
     generate_random_username, parse_duration_to_datetime,
@@ -26,6 +29,8 @@ router.callback_query.filter(F.from_user.id.in_(settings.admin_chat_ids))
 
 logger = logging.getLogger(__name__)
 
+RANDOM_USERNAME_ATTEMPTS = 20
+
 # --- User Creation ---
 
 @router.callback_query(F.data == "panel:create_user", GeneralPanelFSM.main_menu)
@@ -48,12 +53,15 @@ async def cb_create_user_start(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(UserCreationFSM.waiting_for_username, F.data == "user_create:random_username")
 async def cb_random_username(callback: CallbackQuery, state: FSMContext, bot: Bot, api_client: MarzneshinAPI):
     await callback.answer("🎲 Generating...")
-    
-    while True:
-        username = generate_random_username()
-        existing_user = await api_client.get_user(username)
-        if not existing_user:
+
+    username = None
+    for _ in range(RANDOM_USERNAME_ATTEMPTS):
+        candidate = generate_random_username()
+        if not await username_index.is_taken(api_client, candidate):
+            username = candidate
             break
+    if username is None:
+        return await callback.answer("❌ Could not find a free username. Please type one instead.", show_alert=True)
             
     await state.update_data(username=username)
     await state.set_state(UserCreationFSM.waiting_for_data_and_expiry)
@@ -97,8 +105,7 @@ async def msg_username_input(message: Message, state: FSMContext, bot: Bot, api_
         )
         return
 
-    existing_user = await api_client.get_user(username)
-    if existing_user:
+    if await username_index.is_taken(api_client, username):
         await bot.edit_message_text(
             f"❌ Username `{escape(username)}` already exists. Please choose another.",
             chat_id=message.chat.id,
@@ -203,19 +210,18 @@ async def _display_service_selection_for_create(
     message: Message,
     state: FSMContext,
     bot: Bot, 
-    api_client: MarzneshinAPI
+    api_client: MarzneshinAPI,
+    refresh: bool = False
 ):
     await state.set_state(UserCreationFSM.waiting_for_services)
     
     fsm_data = await state.get_data() or {}
     panel_message_id = fsm_data.get("panel_message_id")
-    
-    api_params = {}
 
-    all_services = await api_client.get_services(**api_params)
+    all_services = await service_catalog.get(api_client, refresh=refresh)
     if not all_services:
         await message.answer("⚠️ No services found on the panel. Creating user without services.")
-        await finalize_user_creation(message, state, bot, api_client)
+        await finalize_user_creation(message, state, api_client)
         return
         
     fsm_data = await state.get_data() or {}
@@ -228,6 +234,7 @@ async def _display_service_selection_for_create(
         builder.button(text=text, callback_data=f"user_create_service:toggle:{service.id}")
     
     builder.button(text="✅ Create User", callback_data="user_create_service:save")
+    builder.button(text="🔄 Refresh Services", callback_data="user_create_service:refresh")
     builder.button(text="⬅️ Cancel", callback_data="panel:main_menu")
     builder.adjust(1)
 
@@ -259,6 +266,10 @@ async def cb_handle_service_toggle(callback: CallbackQuery, state: FSMContext, a
         await state.update_data(service_ids=list(selected_service_ids))
         await _display_service_selection_for_create(callback.message, state, callback.bot, api_client)
 
+    elif action == "refresh":
+        await callback.answer("🔄 Reloading services...")
+        await _display_service_selection_for_create(callback.message, state, callback.bot, api_client, refresh=True)
+
     elif action == "save":
         if not selected_service_ids:
             await callback.answer("❌ At least one service is required.", show_alert=True)
@@ -294,7 +305,7 @@ async def finalize_user_creation(message: Message, state: FSMContext, api_client
     if new_user:
         await state.set_state(GeneralPanelFSM.view_user)
         back_callback = "panel:main_menu"
-        await _display_user_details(message.bot, message.chat.id, panel_message_id, new_user.username, back_callback, api_client)
+        await _display_user_details(message.bot, message.chat.id, panel_message_id, new_user.username, back_callback, api_client, user=new_user)
     else:
         await message.bot.edit_message_text("❌ Failed to create user. The username might already exist or the payload was invalid.", chat_id=message.chat.id, message_id=panel_message_id)
     
@@ -309,23 +320,29 @@ async def cb_toggle_user_enable(
     bot: Bot,
     api_client: MarzneshinAPI
 ):
-    username = callback.data.split(":")[2]
+    parts = callback.data.split(":")
+    username = parts[2]
     await callback.answer("⏳ Toggling status...")
 
     api_params = {"username": username}
 
-    user = await api_client.get_user(**api_params)
-    if not user:
-        return await callback.answer("❌ User not found.", show_alert=True)
-
-    if user.enabled:
-        success = await api_client.disable_user(**api_params)
-        new_status_text = "Disabled"
+    # The button carries the target state; buttons rendered before it was added still need a lookup.
+    if len(parts) > 3:
+        enable = parts[3] == "1"
     else:
-        success = await api_client.enable_user(**api_params)
+        user = await api_client.get_user(**api_params)
+        if not user:
+            return await callback.answer("❌ User not found.", show_alert=True)
+        enable = not user.enabled
+
+    if enable:
+        updated_user = await api_client.enable_user(**api_params)
         new_status_text = "Enabled"
+    else:
+        updated_user = await api_client.disable_user(**api_params)
+        new_status_text = "Disabled"
 
-    if success:
+    if updated_user:
         await callback.answer(f"✅ Status set to {new_status_text}")
     else:
         await callback.answer("❌ Failed to update status.", show_alert=True)
@@ -339,7 +356,8 @@ async def cb_toggle_user_enable(
         callback.message.message_id,
         username,
         back_callback,
-        api_client
+        api_client,
+        user=updated_user
     )
 
 @router.callback_query(F.data.startswith("user:links:"))
@@ -383,7 +401,7 @@ async def cb_delete_user_execute(callback: CallbackQuery, state: FSMContext, api
         await callback.message.edit_text(text, reply_markup=builder.as_markup(), parse_mode="Markdown")
     else:
         await callback.answer("❌ Failed to delete the user.", show_alert=True)
-        await _display_user_details(callback.bot, callback.message.chat.id, callback.message.message_id, username, back_callback)
+        await _display_user_details(callback.bot, callback.message.chat.id, callback.message.message_id, username, back_callback, api_client)
 
 @router.callback_query(F.data.startswith("user:revoke:"))
 async def cb_revoke_user_confirm(callback: CallbackQuery):
@@ -411,8 +429,8 @@ async def cb_revoke_user_execute(
 
     api_params = {"username": username}
 
-    success = await api_client.revoke_sub(**api_params)
-    if success:
+    updated_user = await api_client.revoke_sub(**api_params)
+    if updated_user:
         await callback.answer("✅ Subscription link has been revoked.", show_alert=True)
     else:
         await callback.answer("❌ Failed to revoke the link.", show_alert=True)
@@ -426,7 +444,8 @@ async def cb_revoke_user_execute(
         callback.message.message_id,
         username,
         back_callback,
-        api_client
+        api_client,
+        user=updated_user
     )
 
 @router.callback_query(F.data.startswith("user:renew_menu:"))
@@ -529,18 +548,7 @@ async def msg_renew_user_data(
         parse_mode="Markdown"
     )
 
-    api_params = {"username": username}
-
-    current_user = await api_client.get_user(**api_params)
-    if not current_user:
-        await bot.edit_message_text(
-            "❌ User not found.",
-            chat_id=message.chat.id,
-            message_id=panel_message_id
-        )
-        return await state.clear()
-        
-    payload = {"username": username}
+    payload = {"username": username, "data_limit": data_limit_bytes}
 
     if expire_str == "0":
         payload["expire_strategy"] = "never"
@@ -549,13 +557,14 @@ async def msg_renew_user_data(
         payload["expire_strategy"] = "fixed_date"
         payload["expire_date"] = expire_datetime.isoformat()
 
-    if data_limit_bytes != current_user.data_limit:
-        payload["data_limit"] = data_limit_bytes
-
-    update_success = await api_client.update_user(username, payload)
-    reset_success = await api_client.reset_usage(username)
+    # The update and the reset touch different fields, so they run together; neither response
+    # reflects the other, and the view below reads the user back once.
+    updated_user, reset_user = await asyncio.gather(
+        api_client.update_user(username, payload),
+        api_client.reset_usage(username),
+    )
 
-    if update_success and reset_success:
+    if updated_user and reset_user:
         await bot.edit_message_text(
             f"✅ User `{username}` successfully renewed.",
             chat_id=message.chat.id,
@@ -700,6 +709,10 @@ async def cb_handle_service_selection(callback: CallbackQuery, state: FSMContext
         await state.update_data(selected_service_ids=list(selected_service_ids))
         await _display_service_selection(callback.message, state, api_client)
 
+    elif action == "refresh":
+        await callback.answer("🔄 Reloading services...")
+        await _display_service_selection(callback.message, state, api_client, refresh=True)
+
     elif action == "save":
         if not selected_service_ids:
             await callback.answer("❌ At least one service is required.", show_alert=True)
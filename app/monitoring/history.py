@@ -0,0 +1,237 @@
+import base64
+import json
+import logging
+import os
+import time
+from array import array
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import DEFAULT_PANEL, settings
+from app.utils.snapshot import DebouncedSnapshot
+
+logger = logging.getLogger(__name__)
+
+FINE_BUCKET_SECONDS = 300          # 5-minute buckets ...
+FINE_BUCKETS = 288                 # ... covering the last 24 hours
+HOUR_BUCKET_SECONDS = 3600         # hourly rollups ...
+HOUR_BUCKETS = 24 * 30             # ... covering the last 30 days
+# Gaps longer than this (monitoring paused, restarts) are not counted; slow intervals still fit under it.
+MAX_SAMPLE_GAP = max(600, 3 * settings.MONITORING_INTERVAL)
+MAX_INCIDENTS = 256
+
+WINDOWS = {"24h": 86400, "7d": 7 * 86400, "30d": 30 * 86400}
+
+class _Ring:
+    # Fixed-size ring of (up_seconds, total_seconds) buckets. Slot b % size holds bucket b for
+    # head - size < b <= head; slots are zeroed as the head advances, so no per-slot ids are needed.
+    # Running totals over the last n buckets are kept for each window length in `windows`, so an
+    # uptime lookup only touches the few buckets that expired since the last sample.
+    __slots__ = ("bucket_seconds", "size", "head", "up", "total", "windows")
+
+    def __init__(self, bucket_seconds: int, size: int, windows: Iterable[int] = ()):
+        self.bucket_seconds = bucket_seconds
+        self.size = size
+        self.head = -1
+        self.up = array("H", bytes(2 * size))
+        self.total = array("H", bytes(2 * size))
+        self.windows: Dict[int, List[int]] = {n: [0, 0] for n in windows if 0 < n <= size}
+
+    def _range(self, first: int, last: int) -> Tuple[int, int]:
+        # Sums of buckets first..last, limited to the ones the ring still holds.
+        up = total = 0
+        for b in range(max(first, self.head - self.size + 1), min(last, self.head) + 1):
+            slot = b % self.size
+            up += self.up[slot]
+            total += self.total[slot]
+        return up, total
+
+    def _recount(self):
+        for n, sums in self.windows.items():
+            sums[0], sums[1] = self._range(self.head - n + 1, self.head)
+
+    def add(self, ts: float, seconds: int, is_up: bool):
+        bucket = int(ts // self.bucket_seconds)
+        if bucket > self.head:
+            if self.head < 0 or bucket - self.head >= self.size:
+                for i in range(self.size):
+                    self.up[i] = 0
+                    self.total[i] = 0
+                for sums in self.windows.values():
+                    sums[0] = sums[1] = 0
+            else:
+                for n, sums in self.windows.items():
+                    up, total = self._range(self.head - n + 1, bucket - n)
+                    sums[0] -= up
+                    sums[1] -= total
+                for b in range(self.head + 1, bucket + 1):
+                    self.up[b % self.size] = 0
+                    self.total[b % self.size] = 0
+            self.head = bucket
+        elif bucket <= self.head - self.size:
+            return
+
+        slot = bucket % self.size
+        added_total = min(65535, self.total[slot] + seconds) - self.total[slot]
+        added_up = min(65535, self.up[slot] + seconds) - self.up[slot] if is_up else 0
+        self.total[slot] += added_total
+        self.up[slot] += added_up
+        for n, sums in self.windows.items():
+            if bucket > self.head - n:
+                sums[0] += added_up
+                sums[1] += added_total
+
+    def sums(self, now: float, window_seconds: int) -> Tuple[int, int]:
+        now_bucket = int(now // self.bucket_seconds)
+        n = window_seconds // self.bucket_seconds
+        running = self.windows.get(n)
+        if running is None or now_bucket < self.head:
+            return self._range(now_bucket - n + 1, now_bucket)
+        # Buckets that left the window since the last sample are taken back out of the running totals.
+        up, total = self._range(self.head - n + 1, now_bucket - n)
+        return running[0] - up, running[1] - total
+
+    def dump(self) -> Dict:
+        return {
+            "head": self.head,
+            "up": base64.b64encode(self.up.tobytes()).decode(),
+            "total": base64.b64encode(self.total.tobytes()).decode(),
+        }
+
+    def load(self, data: Dict):
+        up = array("H")
+        up.frombytes(base64.b64decode(data["up"]))
+        total = array("H")
+        total.frombytes(base64.b64decode(data["total"]))
+        if len(up) == self.size and len(total) == self.size:
+            self.head, self.up, self.total = int(data["head"]), up, total
+            self._recount()
+
+class NodeHistory:
+    __slots__ = ("name", "fine", "hourly", "incidents", "open_since", "last_ts", "last_up")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.fine = _Ring(FINE_BUCKET_SECONDS, FINE_BUCKETS, (w // FINE_BUCKET_SECONDS for w in WINDOWS.values()))
+        self.hourly = _Ring(HOUR_BUCKET_SECONDS, HOUR_BUCKETS, (w // HOUR_BUCKET_SECONDS for w in WINDOWS.values()))
+        self.incidents: Deque[Tuple[float, float]] = deque(maxlen=MAX_INCIDENTS)
+        self.open_since: Optional[float] = None
+        self.last_ts: Optional[float] = None
+        self.last_up: Optional[bool] = None
+
+    def record(self, is_up: bool, ts: float):
+        # Time since the previous sample is credited to the previous state, so faster polling
+        # during incidents does not skew uptime towards downtime.
+        if self.last_ts is not None and self.last_up is not None:
+            gap = ts - self.last_ts
+            if 0 < gap <= MAX_SAMPLE_GAP:
+                seconds = int(round(gap))
+                self.fine.add(ts, seconds, self.last_up)
+                self.hourly.add(ts, seconds, self.last_up)
+
+        if not is_up and self.open_since is None:
+            self.open_since = ts
+        elif is_up and self.open_since is not None:
+            self.incidents.append((self.open_since, ts))
+            self.open_since = None
+
+        self.last_ts = ts
+        self.last_up = is_up
+
+    def uptime(self, window_seconds: int, now: float) -> Optional[float]:
+        ring = self.fine if window_seconds <= FINE_BUCKET_SECONDS * FINE_BUCKETS else self.hourly
+        up, total = ring.sums(now, window_seconds)
+        return (100.0 * up / total) if total else None
+
+    def incident_stats(self, window_seconds: int, now: float) -> Tuple[int, Optional[float]]:
+        since = now - window_seconds
+        durations = [end - start for start, end in self.incidents if end >= since]
+        count = len(durations) + (1 if self.open_since is not None else 0)
+        mttr = (sum(durations) / len(durations)) if durations else None
+        return count, mttr
+
+    def dump(self) -> Dict:
+        return {
+            "name": self.name,
+            "fine": self.fine.dump(),
+            "hourly": self.hourly.dump(),
+            "incidents": list(self.incidents),
+            "open_since": self.open_since,
+            "last_ts": self.last_ts,
+            "last_up": self.last_up,
+        }
+
+    @classmethod
+    def load(cls, data: Dict) -> "NodeHistory":
+        history = cls(data.get("name", "?"))
+        history.fine.load(data["fine"])
+        history.hourly.load(data["hourly"])
+        history.incidents.extend((float(s), float(e)) for s, e in data.get("incidents", []))
+        history.open_since = data.get("open_since")
+        history.last_ts = data.get("last_ts")
+        history.last_up = data.get("last_up")
+        return history
+
+class NodeHistoryStore:
+    def __init__(self, db_path: str = "./data/node_history.json", flush_delay: float = 300.0):
+        self.db_path = db_path
+        self._nodes: Optional[Dict[str, NodeHistory]] = None
+        self._snapshot = DebouncedSnapshot(db_path, self._dump, flush_delay, "history file")
+
+    @property
+    def nodes(self) -> Dict[str, NodeHistory]:
+        if self._nodes is None:
+            self._nodes = self._load()
+        return self._nodes
+
+    def _load(self) -> Dict[str, NodeHistory]:
+        if not os.path.exists(self.db_path):
+            return {}
+        try:
+            with open(self.db_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            # Keys are "<panel>:<node id>"; files from single-panel versions used the bare id.
+            return {
+                (key if ":" in key else f"{DEFAULT_PANEL}:{key}"): NodeHistory.load(item)
+                for key, item in data.get("nodes", {}).items()
+            }
+        except Exception as e:
+            logger.error(f"History file {self.db_path} is unreadable ({e}); starting with empty history.")
+            return {}
+
+    def record(self, key: str, name: str, is_up: bool, ts: Optional[float] = None):
+        history = self.nodes.get(key)
+        if history is None:
+            history = self.nodes[key] = NodeHistory(name)
+        history.name = name
+        history.record(is_up, ts if ts is not None else time.time())
+        self._mark_dirty()
+
+    def prune(self, keep_keys: Iterable[str], prefix: str = ""):
+        keep = set(keep_keys)
+        for key in [key for key in self.nodes if key.startswith(prefix) and key not in keep]:
+            del self.nodes[key]
+            self._mark_dirty()
+
+    def get(self, key: str) -> Optional[NodeHistory]:
+        return self.nodes.get(key)
+
+    def ranked_by_uptime(self, window_seconds: int = WINDOWS["24h"], prefix: str = "") -> List[Tuple[str, NodeHistory, Optional[float]]]:
+        now = time.time()
+        rows = [
+            (key, history, history.uptime(window_seconds, now))
+            for key, history in self.nodes.items() if key.startswith(prefix)
+        ]
+        rows.sort(key=lambda row: (row[2] if row[2] is not None else 101.0, row[1].name.lower()))
+        return rows
+
+    def _dump(self) -> Dict:
+        return {"version": 1, "nodes": {key: history.dump() for key, history in self.nodes.items()}}
+
+    def _mark_dirty(self):
+        self._snapshot.mark_dirty()
+
+    async def flush(self) -> bool:
+        return await self._snapshot.flush()
+
+node_history = NodeHistoryStore()
@@ -0,0 +1,157 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# --- States ---
+HEALTHY = "healthy"
+SUSPECT = "suspect"          # failing, not yet confirmed
+DOWN = "down"                # confirmed down, alert sent
+RECOVERING = "recovering"    # passing again, not yet confirmed
+FLAPPING = "flapping"        # oscillating; individual alerts suppressed
+
+# --- Observations ---
+OK = "ok"
+FAIL = "fail"
+
+# --- Actions the monitoring loop has to carry out ---
+ACTION_RESYNC = "resync"
+ACTION_ALERT_DOWN = "alert_down"
+ACTION_REMIND = "remind"
+ACTION_ALERT_RECOVERED = "alert_recovered"
+ACTION_ALERT_FLAPPING = "alert_flapping"
+ACTION_FLAP_SUMMARY = "flap_summary"
+ACTION_ALERT_STABLE = "alert_stable"
+
+REMINDER_INTERVAL = 3600
+
+@dataclass(frozen=True)
+class FSMConfig:
+    fail_threshold: int
+    recovery_threshold: int
+    flap_window: int
+    flap_threshold: int
+    flap_summary_interval: int
+
+@dataclass(frozen=True)
+class _Rule:
+    counter: Optional[str]        # "fails" / "oks" counter incremented by this observation
+    threshold: Optional[str]      # FSMConfig field the counter is compared against
+    reached: Tuple[str, Tuple[str, ...]]
+    otherwise: Tuple[str, Tuple[str, ...]] = (HEALTHY, ())
+
+# (state, observation) -> rule. FLAPPING is handled before the table is consulted.
+TRANSITIONS: Dict[Tuple[str, str], _Rule] = {
+    (HEALTHY, OK): _Rule(None, None, (HEALTHY, ())),
+    (HEALTHY, FAIL): _Rule("fails", "fail_threshold", (DOWN, (ACTION_RESYNC, ACTION_ALERT_DOWN)), (SUSPECT, (ACTION_RESYNC,))),
+    (SUSPECT, OK): _Rule(None, None, (HEALTHY, ())),
+    (SUSPECT, FAIL): _Rule("fails", "fail_threshold", (DOWN, (ACTION_ALERT_DOWN,)), (SUSPECT, ())),
+    (DOWN, OK): _Rule("oks", "recovery_threshold", (HEALTHY, (ACTION_ALERT_RECOVERED,)), (RECOVERING, ())),
+    (DOWN, FAIL): _Rule(None, None, (DOWN, (ACTION_REMIND,))),
+    (RECOVERING, OK): _Rule("oks", "recovery_threshold", (HEALTHY, (ACTION_ALERT_RECOVERED,)), (RECOVERING, ())),
+    (RECOVERING, FAIL): _Rule(None, None, (DOWN, ())),
+}
+
+def new_record() -> Dict[str, Any]:
+    return {
+        "state": HEALTHY,
+        "fails": 0,
+        "oks": 0,
+        "last_obs": OK,
+        "flips": [],
+        "down_since": None,
+        "last_alert_time": None,
+        "message": "",
+    }
+
+def _to_timestamp(value: Any) -> Optional[float]:
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return None
+    return value
+
+def upgrade_record(saved: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    record = new_record()
+    if not saved:
+        return record
+    if "state" not in saved:
+        # Records written before the state machine: alert_sent meant confirmed down.
+        record["state"] = DOWN if saved.get("alert_sent") else SUSPECT
+        record["last_obs"] = FAIL
+        record["fails"] = 1
+    record.update({key: value for key, value in saved.items() if key in record})
+    record["down_since"] = _to_timestamp(record["down_since"])
+    record["last_alert_time"] = _to_timestamp(record["last_alert_time"])
+    if record["state"] == DOWN and record["last_alert_time"] is None:
+        record["last_alert_time"] = record["down_since"]
+    return record
+
+def is_idle(record: Dict[str, Any]) -> bool:
+    # Healthy with no recent flips: nothing worth keeping in the state file.
+    return record["state"] == HEALTHY and not record["flips"]
+
+def evaluate(record: Dict[str, Any], obs: str, now: float, message: str, config: FSMConfig) -> Tuple[Dict[str, Any], List[str]]:
+    record = dict(record)
+    previous_obs = record["last_obs"]
+    flips = [ts for ts in record["flips"] if now - ts <= config.flap_window]
+    if obs != previous_obs:
+        flips.append(now)
+    record["flips"] = flips
+    record["last_obs"] = obs
+    if obs == FAIL:
+        record["message"] = message
+
+    if record["state"] == FLAPPING:
+        return _evaluate_flapping(record, obs, now, config)
+
+    if len(flips) >= config.flap_threshold:
+        record.update(state=FLAPPING, fails=0, oks=0, last_alert_time=now)
+        if record["down_since"] is None:
+            record["down_since"] = now
+        return record, [ACTION_ALERT_FLAPPING]
+
+    rule = TRANSITIONS[(record["state"], obs)]
+    if obs == OK:
+        record["fails"] = 0
+    else:
+        record["oks"] = 0
+
+    if rule.counter is None:
+        next_state, actions = rule.reached
+    else:
+        record[rule.counter] += 1
+        if record[rule.counter] >= getattr(config, rule.threshold):
+            next_state, actions = rule.reached
+        else:
+            next_state, actions = rule.otherwise
+
+    actions = list(actions)
+    if ACTION_REMIND in actions:
+        last_alert = record["last_alert_time"]
+        if last_alert is not None and now - last_alert <= REMINDER_INTERVAL:
+            actions.remove(ACTION_REMIND)
+
+    if next_state in (SUSPECT, DOWN) and record["down_since"] is None:
+        record["down_since"] = now
+    if ACTION_ALERT_DOWN in actions or ACTION_REMIND in actions:
+        record["last_alert_time"] = now
+    if next_state == HEALTHY:
+        record.update(fails=0, oks=0, down_since=None)
+
+    record["state"] = next_state
+    return record, actions
+
+def _evaluate_flapping(record: Dict[str, Any], obs: str, now: float, config: FSMConfig) -> Tuple[Dict[str, Any], List[str]]:
+    # Hysteresis: leave FLAPPING only once the flip rate falls well below the entry threshold.
+    if len(record["flips"]) <= config.flap_threshold // 2:
+        if obs == OK:
+            record.update(state=HEALTHY, fails=0, oks=0, down_since=None, last_alert_time=now)
+            return record, [ACTION_ALERT_STABLE]
+        record.update(state=DOWN, fails=config.fail_threshold, oks=0, last_alert_time=now)
+        return record, [ACTION_ALERT_DOWN]
+
+    if now - (record["last_alert_time"] or 0) >= config.flap_summary_interval:
+        record["last_alert_time"] = now
+        return record, [ACTION_FLAP_SUMMARY]
+    return record, []
@@ -3,78 +3,108 @@ import json
 import logging
 import asyncio
 
-import aiofiles
-import aiofiles.os
-
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from datetime import datetime, timezone
 
+from app.utils.snapshot import DebouncedSnapshot
+
 logger = logging.getLogger(__name__)
 
 class MonitoringState:
-    def __init__(self, db_path: str = "./data/monitoring.json"):
+    # The in-memory dict is the source of truth; the file is a debounced snapshot of it.
+    def __init__(self, db_path: str = "./data/monitoring.json", flush_delay: float = 2.0):
         self.db_path = db_path
-        self._lock = asyncio.Lock()
-        self._default_state = {
-            "monitoring_enabled": False,
-            "nodes": {}
-        }
-
-    async def _read_state(self) -> Dict[str, Any]:
-        async with self._lock:
-            if not await aiofiles.os.path.exists(self.db_path):
-                return self._default_state.copy()
-            try:
-                async with aiofiles.open(self.db_path, "r", encoding="utf-8") as f:
-                    content = await f.read()
-                    return json.loads(content)
-            except Exception as e:
-                logger.error(f"Failed to read state file {self.db_path}: {e}")
-                return self._default_state.copy()
-
-    async def _write_state(self, state: Dict[str, Any]) -> bool:
-        async with self._lock:
+        self._state: Optional[Dict[str, Any]] = None
+        self._snapshot = DebouncedSnapshot(db_path, self._dump, flush_delay, "state file")
+        # Bumped on every settings change. Each monitoring loop waits for a change past the generation it
+        # read at the start of its cycle, so no loop can consume a toggle another one still has to see.
+        self.settings_generation = 0
+        self._settings_changed = asyncio.Event()
+
+    def _load_state(self) -> Dict[str, Any]:
+        default = {"monitoring_enabled": False, "nodes": {}}
+        if not os.path.exists(self.db_path):
+            return default
+        try:
+            with open(self.db_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if not isinstance(state, dict) or not isinstance(state.get("nodes", {}), dict):
+                raise ValueError("unexpected top-level structure")
+            state.setdefault("monitoring_enabled", False)
+            state.setdefault("nodes", {})
+            return state
+        except Exception as e:
+            corrupt_path = f"{self.db_path}.corrupt"
+            logger.error(f"State file {self.db_path} is unreadable ({e}); moving it to {corrupt_path} and starting fresh.")
             try:
-                await aiofiles.os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-                async with aiofiles.open(self.db_path, "w", encoding="utf-8") as f:
-                    await f.write(json.dumps(state, indent=2))
-                return True
-            except Exception as e:
-                logger.error(f"Failed to write state file {self.db_path}: {e}")
-                return False
+                os.replace(self.db_path, corrupt_path)
+            except OSError as move_error:
+                logger.warning(f"Could not move corrupt state file aside: {move_error}")
+            return default
+
+    @property
+    def _data(self) -> Dict[str, Any]:
+        if self._state is None:
+            self._state = self._load_state()
+        return self._state
+
+    def _dump(self) -> Dict[str, Any]:
+        # Node entries are replaced on update, never mutated, so a shallow copy is a stable snapshot.
+        return {**self._data, "nodes": dict(self._data["nodes"])}
+
+    def _mark_dirty(self):
+        self._snapshot.mark_dirty()
+
+    async def flush(self) -> bool:
+        return await self._snapshot.flush()
 
     async def is_monitoring_enabled(self) -> bool:
-        state = await self._read_state()
-        return state.get("monitoring_enabled", False)
+        return self._data.get("monitoring_enabled", False)
 
     async def set_monitoring_enabled(self, is_enabled: bool):
-        state = await self._read_state()
-        state["monitoring_enabled"] = is_enabled
-        await self._write_state(state)
+        if self._data.get("monitoring_enabled") != is_enabled:
+            self._data["monitoring_enabled"] = is_enabled
+            self._mark_dirty()
+            self.settings_generation += 1
+            self._settings_changed.set()
+            self._settings_changed = asyncio.Event()
         logger.info(f"Monitoring state set to: {is_enabled}")
 
+    async def wait_for_settings_change(self, seen_generation: int, timeout: Optional[float] = None) -> bool:
+        if self.settings_generation != seen_generation:
+            return True
+        try:
+            await asyncio.wait_for(self._settings_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
     async def get_node_status(self, node_name: str) -> Optional[Dict]:
-        state = await self._read_state()
-        return state.get("nodes", {}).get(node_name)
+        node = self._data["nodes"].get(node_name)
+        return dict(node) if node is not None else None
 
     async def update_node_status(self, node_name: str, status_data: Dict[str, Any]):
-        state = await self._read_state()
-        if "nodes" not in state:
-            state["nodes"] = {}
-        
-        existing_data = state["nodes"].get(node_name, {})
-        
-        existing_data.update(status_data)
-        
-        existing_data["last_updated"] = datetime.now(timezone.utc).isoformat()
-        
-        state["nodes"][node_name] = existing_data
-        await self._write_state(state)
+        nodes = self._data["nodes"]
+        existing_data = nodes.get(node_name, {})
+
+        changed = node_name not in nodes or any(
+            existing_data.get(key) != value for key, value in status_data.items() if key != "last_updated"
+        )
+        if not changed:
+            return
+
+        merged = dict(existing_data)
+        merged.update(status_data)
+        merged["last_updated"] = datetime.now(timezone.utc).isoformat()
+
+        nodes[node_name] = merged
+        self._mark_dirty()
 
     async def remove_node(self, node_name: str):
-        state = await self._read_state()
-        if node_name in state.get("nodes", {}):
-            del state["nodes"][node_name]
-            await self._write_state(state)
+        if self._data["nodes"].pop(node_name, None) is not None:
+            self._mark_dirty()
+
+    def get_node_names(self) -> List[str]:
+        return list(self._data["nodes"].keys())
 
-state_manager = MonitoringState()
\ No newline at end of file
+state_manager = MonitoringState()
@@ -1,104 +1,281 @@
 import asyncio
 import logging
-from datetime import datetime, timezone
+import time
+from datetime import timedelta
 
 from aiogram import Bot
 
-from typing import List
-from app.api.marzneshin import MarzneshinAPI
+from typing import Dict, List, Optional, Set
+from app.api.marzneshin import MarzneshinAPI, Node
+from app.core.config import DEFAULT_PANEL, settings
+from app.core.health import health
+from app.core.metrics import MONITORING_CYCLE, QUEUE_DEPTH
+from . import node_fsm
+from .history import node_history
 from .state_manager import state_manager
 
 logger = logging.getLogger(__name__)
 
+_background_tasks: Set[asyncio.Task] = set()
+_alert_semaphore = asyncio.Semaphore(5)
+_resyncers: Dict[str, "NodeResyncer"] = {}
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
 async def alert_sudo_admins(bot: Bot, message: str, sudo_chat_ids: List[int]):
-    for admin_id in sudo_chat_ids:
+    async def send(admin_id: int):
+        async with _alert_semaphore:
+            try:
+                await bot.send_message(admin_id, message, parse_mode="Markdown")
+            except Exception as e:
+                logger.warning(f"Failed to send alert to admin {admin_id}: {e}")
+
+    await asyncio.gather(*(send(admin_id) for admin_id in sudo_chat_ids))
+
+def dispatch_alert(bot: Bot, message: str, sudo_chat_ids: List[int]):
+    _spawn(alert_sudo_admins(bot, message, sudo_chat_ids))
+
+class NodeResyncer:
+    # Bounded, de-duplicated resyncs: a node already being resynced is not queued again.
+    def __init__(self, api_client: MarzneshinAPI, concurrency: int):
+        self.api_client = api_client
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._in_flight: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    def request(self, node: Node):
+        if node.id in self._in_flight:
+            return
+        self._in_flight.add(node.id)
+        _spawn(self._resync(node))
+
+    async def _resync(self, node: Node):
         try:
-            await bot.send_message(admin_id, message, parse_mode="Markdown")
-        except Exception as e:
-            logger.warning(f"Failed to send alert to admin {admin_id}: {e}")
+            async with self._semaphore:
+                if not await self.api_client.resync_node(node.id):
+                    logger.warning(f"Resync request for node '{node.name}' failed.")
+        finally:
+            self._in_flight.discard(node.id)
+
+# Per-node outcomes of a cycle, used to pick the delay before the next one.
+OUTCOME_HEALTHY = "healthy"
+OUTCOME_NEW_FAILURE = "new_failure"
+OUTCOME_UNHEALTHY = "unhealthy"
+OUTCOME_RECOVERED = "recovered"
+
+def _state_key(panel: str, node_name: str) -> str:
+    # The default panel keeps bare node names so state files from single-panel setups carry over.
+    return node_name if panel == DEFAULT_PANEL else f"{panel}:{node_name}"
+
+def _owns_state_key(panel: str, key: str) -> bool:
+    if panel != DEFAULT_PANEL:
+        return key.startswith(f"{panel}:")
+    return not any(key.startswith(f"{other}:") for other in settings.panel_map if other != DEFAULT_PANEL)
+
+def _history_key(panel: str, node: Node) -> str:
+    return f"{panel}:{node.id}"
+
+def _display_name(panel: str, node_name: str) -> str:
+    return f"{panel}/{node_name}" if len(settings.panels) > 1 else node_name
+
+def _fsm_config() -> node_fsm.FSMConfig:
+    return node_fsm.FSMConfig(
+        fail_threshold=settings.MONITORING_FAIL_THRESHOLD,
+        recovery_threshold=settings.MONITORING_RECOVERY_THRESHOLD,
+        flap_window=settings.MONITORING_FLAP_WINDOW,
+        flap_threshold=settings.MONITORING_FLAP_THRESHOLD,
+        flap_summary_interval=settings.MONITORING_FLAP_SUMMARY_INTERVAL,
+    )
+
+def _format_downtime(down_since: Optional[float], now: float) -> str:
+    if down_since is None:
+        return "-"
+    return str(timedelta(seconds=int(now - down_since)))
+
+def _perform_actions(
+    bot: Bot,
+    node: Node,
+    actions: List[str],
+    previous: Dict,
+    record: Dict,
+    now: float,
+    resyncer: NodeResyncer,
+    sudo_chat_ids: List[int],
+    panel: str,
+):
+    node_name = _display_name(panel, node.name)
+    window_minutes = settings.MONITORING_FLAP_WINDOW // 60
+    for action in actions:
+        if action == node_fsm.ACTION_RESYNC:
+            logger.warning(f"Node '{node_name}' detected as unhealthy. Attempting resync.")
+            resyncer.request(node)
+        elif action == node_fsm.ACTION_ALERT_DOWN:
+            logger.error(f"Node '{node_name}' is CONFIRMED down. Sending alert.")
+            dispatch_alert(
+                bot,
+                f"💔 *Node Down Alert*\n"
+                f"Node: `{node_name}`\n"
+                f"Error: `{record['message']}`",
+                sudo_chat_ids
+            )
+        elif action == node_fsm.ACTION_REMIND:
+            logger.warning(f"Node '{node_name}' is still down. Sending reminder.")
+            dispatch_alert(
+                bot,
+                f"⏰ *Node Reminder*\n"
+                f"Node: `{node_name}` is still unhealthy.",
+                sudo_chat_ids
+            )
+        elif action == node_fsm.ACTION_ALERT_RECOVERED:
+            logger.info(f"Node '{node_name}' has recovered. Sending recovery alert.")
+            dispatch_alert(
+                bot,
+                f"💚 *Node Recovered*\n"
+                f"Node: `{node_name}` is now healthy.\n"
+                f"Downtime: `{_format_downtime(previous['down_since'], now)}`",
+                sudo_chat_ids
+            )
+        elif action == node_fsm.ACTION_ALERT_FLAPPING:
+            logger.warning(f"Node '{node_name}' is flapping. Suppressing individual alerts.")
+            dispatch_alert(
+                bot,
+                f"🔀 *Node Flapping*\n"
+                f"Node: `{node_name}` changed state {len(record['flips'])} times in the last {window_minutes} minutes.\n"
+                f"Individual alerts are suppressed until it stabilises.",
+                sudo_chat_ids
+            )
+        elif action == node_fsm.ACTION_FLAP_SUMMARY:
+            dispatch_alert(
+                bot,
+                f"🔀 *Flapping Summary*\n"
+                f"Node: `{node_name}` changed state {len(record['flips'])} times in the last {window_minutes} minutes.\n"
+                f"Currently: `{node.status}`",
+                sudo_chat_ids
+            )
+        elif action == node_fsm.ACTION_ALERT_STABLE:
+            logger.info(f"Node '{node_name}' stopped flapping.")
+            dispatch_alert(
+                bot,
+                f"💚 *Node Stabilised*\n"
+                f"Node: `{node_name}` is healthy and no longer flapping.",
+                sudo_chat_ids
+            )
+
+async def _evaluate_node(bot: Bot, node: Node, resyncer: NodeResyncer, sudo_chat_ids: List[int], now: float) -> str:
+    if node.status not in ("healthy", "unhealthy"):
+        return OUTCOME_HEALTHY
+
+    panel = resyncer.api_client.panel_name
+    key = _state_key(panel, node.name)
+    saved_status_data = await state_manager.get_node_status(key)
+    previous = node_fsm.upgrade_record(saved_status_data)
+    obs = node_fsm.OK if node.status == "healthy" else node_fsm.FAIL
+    record, actions = node_fsm.evaluate(previous, obs, now, node.message, _fsm_config())
+
+    _perform_actions(bot, node, actions, previous, record, now, resyncer, sudo_chat_ids, panel)
+
+    if node_fsm.is_idle(record):
+        if saved_status_data is not None:
+            await state_manager.remove_node(key)
+    else:
+        if saved_status_data is not None and "state" not in saved_status_data:
+            await state_manager.remove_node(key)
+        await state_manager.update_node_status(key, record)
+
+    if previous["state"] == node_fsm.HEALTHY and record["state"] == node_fsm.SUSPECT:
+        return OUTCOME_NEW_FAILURE
+    if record["state"] == node_fsm.HEALTHY:
+        return OUTCOME_RECOVERED if previous["state"] != node_fsm.HEALTHY else OUTCOME_HEALTHY
+    return OUTCOME_UNHEALTHY
+
+def _next_cycle_delay(outcomes: Optional[Set[str]]) -> float:
+    if outcomes is None:
+        return settings.MONITORING_INCIDENT_INTERVAL
+    if OUTCOME_NEW_FAILURE in outcomes:
+        return settings.MONITORING_CONFIRM_DELAY
+    if OUTCOME_UNHEALTHY in outcomes or OUTCOME_RECOVERED in outcomes:
+        return settings.MONITORING_INCIDENT_INTERVAL
+    return settings.MONITORING_INTERVAL
+
+async def run_monitoring_cycle(
+    bot: Bot,
+    api_client: MarzneshinAPI,
+    resyncer: NodeResyncer,
+    sudo_chat_ids: List[int],
+) -> Optional[Set[str]]:
+    panel = api_client.panel_name
+    nodes_list = await api_client.get_all_nodes()
+    if nodes_list is None:
+        logger.warning(f"Monitoring loop: Could not fetch nodes from panel '{panel}'.")
+        return None
+
+    current_node_statuses: Dict[str, Node] = {node.name: node for node in nodes_list}
+    now = time.time()
+    semaphore = asyncio.Semaphore(settings.MONITORING_CONCURRENCY)
+
+    async def evaluate(node: Node) -> str:
+        async with semaphore:
+            try:
+                return await _evaluate_node(bot, node, resyncer, sudo_chat_ids, now)
+            except Exception as e:
+                logger.error(f"Failed to evaluate node '{node.name}': {e}", exc_info=True)
+                return OUTCOME_UNHEALTHY
+
+    outcomes = set(await asyncio.gather(*(evaluate(node) for node in current_node_statuses.values())))
+
+    for node in nodes_list:
+        if node.status in ("healthy", "unhealthy"):
+            node_history.record(_history_key(panel, node), node.name, node.status == "healthy", now)
+    node_history.prune((_history_key(panel, node) for node in nodes_list), prefix=f"{panel}:")
+
+    current_keys = {_state_key(panel, name) for name in current_node_statuses}
+    for saved_key in state_manager.get_node_names():
+        if _owns_state_key(panel, saved_key) and saved_key not in current_keys:
+            await state_manager.remove_node(saved_key)
+    return outcomes
 
 async def run_monitoring_loop(bot: Bot, api_client: MarzneshinAPI, sudo_chat_ids: List[int]):
-    logger.info("Node monitoring background task started.")
+    logger.info(f"Node monitoring background task started for panel '{api_client.panel_name}'.")
+    resyncer = _resyncers[api_client.panel_name] = NodeResyncer(api_client, settings.MONITORING_RESYNC_CONCURRENCY)
+    QUEUE_DEPTH.set_function(lambda: sum(len(r) for r in _resyncers.values()), "node_resync")
+    QUEUE_DEPTH.set_function(lambda: len(_background_tasks), "monitoring_background")
+
+    try:
+        await _run_monitoring_cycles(bot, api_client, resyncer, sudo_chat_ids)
+    finally:
+        health.monitoring_changed(api_client.panel_name, False)
+
+async def _run_monitoring_cycles(bot: Bot, api_client: MarzneshinAPI, resyncer: NodeResyncer, sudo_chat_ids: List[int]):
     while True:
+        # The next cycle is scheduled from the start of this one, so slow cycles don't drift the cadence.
+        cycle_started = time.monotonic()
+        delay: Optional[float] = settings.MONITORING_INCIDENT_INTERVAL
+        seen_generation = state_manager.settings_generation
         try:
-            if not await state_manager.is_monitoring_enabled():
-                await asyncio.sleep(60)
-                continue
-
-            nodes_list = await api_client.get_nodes(size=100)
-            if not nodes_list:
-                logger.warning("Monitoring loop: Could not fetch nodes from API.")
-                await asyncio.sleep(60)
-                continue
-
-            current_node_statuses = {node.name: node for node in nodes_list.items}
-
-            for node_name, current_node in current_node_statuses.items():
-                saved_status_data = await state_manager.get_node_status(node_name)
-                
-                if current_node.status == 'unhealthy':
-                    if saved_status_data is None:
-                        logger.warning(f"Node '{node_name}' detected as unhealthy. Attempting resync.")
-                        await api_client.resync_node(current_node.id)
-                        
-                        new_status_data = {
-                            "status": 'unhealthy',
-                            "message": current_node.message,
-                            "down_since": datetime.now(timezone.utc).isoformat(),
-                            "alert_sent": False,
-                            "last_alert_time": None
-                        }
-                        await state_manager.update_node_status(node_name, new_status_data)
-                    else:
-                        if not saved_status_data.get('alert_sent'):
-                            logger.error(f"Node '{node_name}' is CONFIRMED down. Sending alert.")
-                            await alert_sudo_admins(
-                                bot,
-                                f"💔 *Node Down Alert*\n"
-                                f"Node: `{node_name}`\n"
-                                f"Error: `{current_node.message}`",
-                                sudo_chat_ids
-                            )
-                            saved_status_data['alert_sent'] = True
-                            saved_status_data['last_alert_time'] = datetime.now(timezone.utc).isoformat()
-                            await state_manager.update_node_status(node_name, saved_status_data)
-                        
-                        else:
-                            last_alert_time_str = saved_status_data.get('last_alert_time')
-                            if last_alert_time_str:
-                                last_alert_time = datetime.fromisoformat(last_alert_time_str)
-                                if (datetime.now(timezone.utc) - last_alert_time).total_seconds() > 3600: # 1 hour
-                                    logger.warning(f"Node '{node_name}' is still down. Sending reminder.")
-                                    await alert_sudo_admins(
-                                        bot,
-                                        f"⏰ *Node Reminder*\n"
-                                        f"Node: `{node_name}` is still unhealthy.",
-                                        sudo_chat_ids
-                                    )
-                                    saved_status_data['last_alert_time'] = datetime.now(timezone.utc).isoformat()
-                                    await state_manager.update_node_status(node_name, saved_status_data)
-
-                elif current_node.status == 'healthy' and saved_status_data is not None:
-                    logger.info(f"Node '{node_name}' has recovered. Sending recovery alert.")
-                    down_since_time = datetime.fromisoformat(saved_status_data['down_since'])
-                    downtime = datetime.now(timezone.utc) - down_since_time
-                    downtime_str = str(downtime).split('.')[0]
-                    
-                    await alert_sudo_admins(
-                        bot,
-                        f"💚 *Node Recovered*\n"
-                        f"Node: `{node_name}` is now healthy.\n"
-                        f"Downtime: `{downtime_str}`",
-                        sudo_chat_ids
-                    )
-                    await state_manager.remove_node(node_name)
-
-            saved_nodes = (await state_manager._read_state()).get("nodes", {})
-            for saved_node_name in list(saved_nodes.keys()):
-                if saved_node_name not in current_node_statuses:
-                    await state_manager.remove_node(saved_node_name)
+            active = await state_manager.is_monitoring_enabled()
+            health.monitoring_changed(api_client.panel_name, active)
+            if not active:
+                # Nothing to do until an admin turns monitoring on; toggling wakes us immediately.
+                delay = None
+            else:
+                outcomes = await run_monitoring_cycle(bot, api_client, resyncer, sudo_chat_ids)
+                if outcomes is not None:
+                    MONITORING_CYCLE.observe(time.monotonic() - cycle_started)
+                    health.monitoring_cycle_finished(api_client.panel_name)
+                delay = _next_cycle_delay(outcomes)
 
         except Exception as e:
             logger.error(f"Unhandled error in monitoring loop: {e}", exc_info=True)
-        
-        await asyncio.sleep(60)
\ No newline at end of file
+
+        if delay is not None:
+            elapsed = time.monotonic() - cycle_started
+            if elapsed > delay:
+                logger.warning(f"Monitoring cycle took {elapsed:.1f}s, longer than the {delay}s interval.")
+            delay = max(0.0, delay - elapsed)
+        await state_manager.wait_for_settings_change(seen_generation, delay)
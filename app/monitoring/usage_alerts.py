@@ -0,0 +1,381 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+from datetime import timezone
+from html import escape
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.api.marzneshin import MAX_PAGE_SIZE, MarzneshinAPI, User
+from app.core.config import settings
+from app.core.events import UserEventListener, user_events
+from app.core.metrics import QUEUE_DEPTH
+from app.utils.helpers import format_expiry, format_traffic
+from app.utils.snapshot import DebouncedSnapshot
+
+logger = logging.getLogger(__name__)
+
+KIND_EXPIRY = "expiry"
+KIND_QUOTA = "quota"
+KIND_RETRY = "retry"
+
+RETRY_DELAY = 300
+REFRESH_CONCURRENCY = 5
+QUOTA_RECHECK_FROM = 0.5   # share of the quota threshold from which users are re-sampled between full scans
+QUOTA_RECHECK_MIN = 600
+SEND_INTERVAL = 0.1        # spacing between alert messages, well under Telegram's global flood limit
+DIGEST_MAX_LENGTH = 4000   # Telegram caps messages at 4096 characters
+
+# (username, ledger key, ledger marker, message): the ledger is only marked once the message went out.
+Alert = Tuple[str, str, str, str]
+
+class AlertLedger:
+    # Remembers which warnings were already sent (and for which expiry date / data limit),
+    # so restarts and rescans don't repeat them.
+    def __init__(self, db_path: str = "./data/usage_alerts.json", flush_delay: float = 5.0):
+        self.db_path = db_path
+        self._sent: Optional[Dict[str, str]] = None
+        self._snapshot = DebouncedSnapshot(db_path, lambda: dict(self.sent), flush_delay, "usage alert ledger")
+
+    @property
+    def sent(self) -> Dict[str, str]:
+        if self._sent is None:
+            self._sent = self._load()
+        return self._sent
+
+    def _load(self) -> Dict[str, str]:
+        if not os.path.exists(self.db_path):
+            return {}
+        try:
+            with open(self.db_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return {str(key): str(value) for key, value in data.items()}
+        except Exception as e:
+            logger.error(f"Usage alert ledger {self.db_path} is unreadable ({e}); starting empty.")
+            return {}
+
+    def get(self, key: str) -> Optional[str]:
+        return self.sent.get(key)
+
+    def mark(self, key: str, marker: str):
+        if self.sent.get(key) != marker:
+            self.sent[key] = marker
+            self._snapshot.mark_dirty()
+
+    def clear(self, key: str):
+        if self.sent.pop(key, None) is not None:
+            self._snapshot.mark_dirty()
+
+    async def flush(self) -> bool:
+        return await self._snapshot.flush()
+
+class UsageScanner(UserEventListener):
+    # Streams the panel's users once, keeps a min-heap of upcoming deadlines (expiry lead time and
+    # projected quota exhaustion) and sleeps until the earliest one. Users reported changed through
+    # the event bus are refetched individually; a full rescan only runs every USAGE_ALERT_SCAN_INTERVAL.
+    # Users approaching the quota threshold are re-sampled sooner, so their usage rate is known in time.
+    def __init__(self, bot: Bot, api_client: MarzneshinAPI, ledger: AlertLedger):
+        self.bot = bot
+        self.api_client = api_client
+        self.panel = api_client.panel_name
+        self.ledger = ledger
+        self._owners = {admin.panel_username for admin in settings.admins if admin.panel == self.panel}
+        self._heap: List[Tuple[float, int, str, str]] = []
+        self._deadlines: Dict[Tuple[str, str], float] = {}
+        self._samples: Dict[str, Tuple[int, float]] = {}
+        self._seq = itertools.count()
+        self._changed: Dict[str, Optional[User]] = {}
+        self._rescan_requested = True
+        self._wakeup = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    # --- event bus ---
+
+    def on_user_changed(self, panel: str, username: str, user: Optional[User]):
+        if panel == self.panel:
+            self._changed[username] = user
+            self._wakeup.set()
+
+    def on_user_deleted(self, panel: str, username: str):
+        if panel == self.panel:
+            self._forget(username)
+
+    def on_users_bulk_changed(self, panel: str):
+        if panel == self.panel:
+            self._rescan_requested = True
+            self._wakeup.set()
+
+    # --- deadlines ---
+
+    def _ledger_key(self, kind: str, username: str) -> str:
+        return f"{self.panel}:{kind}:{username}"
+
+    def _schedule(self, kind: str, username: str, due: Optional[float]):
+        key = (kind, username)
+        if due is None:
+            self._deadlines.pop(key, None)
+            return
+        if self._deadlines.get(key) == due:
+            return
+        self._deadlines[key] = due
+        heapq.heappush(self._heap, (due, next(self._seq), kind, username))
+        # Superseded entries stay in the heap until popped; rebuild once they dominate it.
+        if len(self._heap) > 2 * len(self._deadlines) + 1024:
+            self._heap = [(due, next(self._seq), kind, name) for (kind, name), due in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def _forget(self, username: str):
+        for kind in (KIND_EXPIRY, KIND_QUOTA, KIND_RETRY):
+            self._deadlines.pop((kind, username), None)
+            self.ledger.clear(self._ledger_key(kind, username))
+        self._samples.pop(username, None)
+
+    def _next_deadline(self) -> Optional[float]:
+        while self._heap:
+            due, _, kind, username = self._heap[0]
+            if self._deadlines.get((kind, username)) == due:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def _pop_due(self, now: float) -> Set[str]:
+        due_users: Set[str] = set()
+        while self._heap and self._heap[0][0] <= now:
+            due, _, kind, username = heapq.heappop(self._heap)
+            if self._deadlines.get((kind, username)) == due:
+                del self._deadlines[(kind, username)]
+                due_users.add(username)
+        return due_users
+
+    # --- evaluation ---
+
+    def _evaluate(self, user: User, now: float) -> List[Alert]:
+        username = user.username
+        if user.owner_username not in self._owners:
+            self._forget(username)
+            return []
+
+        alerts: List[Alert] = []
+        alerts.extend(self._evaluate_expiry(user, now))
+        alerts.extend(self._evaluate_quota(user, now))
+        return alerts
+
+    def _evaluate_expiry(self, user: User, now: float) -> List[Alert]:
+        ledger_key = self._ledger_key(KIND_EXPIRY, user.username)
+        if user.expire_strategy != "fixed_date" or user.expire_date is None or user.expired or not user.enabled:
+            self._schedule(KIND_EXPIRY, user.username, None)
+            if user.expire_date is None or user.expire_strategy != "fixed_date":
+                self.ledger.clear(ledger_key)
+            return []
+
+        expire_date = user.expire_date
+        if expire_date.tzinfo is None:
+            expire_date = expire_date.replace(tzinfo=timezone.utc)
+        expires_at = expire_date.timestamp()
+        marker = str(int(expires_at))
+        if self.ledger.get(ledger_key) == marker or expires_at <= now:
+            self._schedule(KIND_EXPIRY, user.username, None)
+            return []
+
+        warn_at = expires_at - settings.USAGE_ALERT_EXPIRY_LEAD
+        if warn_at > now:
+            self._schedule(KIND_EXPIRY, user.username, warn_at)
+            return []
+
+        self._schedule(KIND_EXPIRY, user.username, None)
+        return [(
+            user.username, ledger_key, marker,
+            "⏳ #ExpiringSoon\n"
+            "━━━━━━━━━━━━━━\n"
+            f"👤 User: <code>{escape(user.username)}</code>\n"
+            f"🕔 Expires: {format_expiry(user.expire_date)}"
+        )]
+
+    def _evaluate_quota(self, user: User, now: float) -> List[Alert]:
+        username = user.username
+        ledger_key = self._ledger_key(KIND_QUOTA, username)
+        previous = self._samples.get(username)
+        self._samples[username] = (user.used_traffic, now)
+
+        if user.data_limit <= 0 or not user.enabled or user.data_limit_reached:
+            self._schedule(KIND_QUOTA, username, None)
+            if user.data_limit <= 0:
+                self.ledger.clear(ledger_key)
+            return []
+
+        threshold = user.data_limit * settings.USAGE_ALERT_QUOTA_THRESHOLD
+        marker = str(user.data_limit)
+        if user.used_traffic < threshold:
+            # Below the threshold again (usage reset or limit raised): allow a future warning.
+            self.ledger.clear(ledger_key)
+            due = None
+            if previous is not None and user.used_traffic > previous[0] and now > previous[1]:
+                rate = (user.used_traffic - previous[0]) / (now - previous[1])
+                due = now + (threshold - user.used_traffic) / rate
+            headroom = 1 - user.used_traffic / threshold
+            if headroom < 1 - QUOTA_RECHECK_FROM:
+                # The projection needs a second sample; the closer the user is, the sooner it is taken.
+                recheck = now + max(QUOTA_RECHECK_MIN, settings.USAGE_ALERT_SCAN_INTERVAL * headroom)
+                due = recheck if due is None else min(due, recheck)
+            self._schedule(KIND_QUOTA, username, due)
+            return []
+
+        self._schedule(KIND_QUOTA, username, None)
+        if self.ledger.get(ledger_key) == marker:
+            return []
+        percent = user.used_traffic * 100 // user.data_limit
+        return [(
+            username, ledger_key, marker,
+            "🔋 #QuotaWarning\n"
+            "━━━━━━━━━━━━━━\n"
+            f"👤 User: <code>{escape(user.username)}</code>\n"
+            f"📊 Used: {format_traffic(user.used_traffic)} / {format_traffic(user.data_limit)} ({percent}%)"
+        )]
+
+    # --- delivery ---
+
+    async def _send(self, chat_id: int, text: str) -> bool:
+        # Sends are serialized and spaced out; a flood-limit reply is waited out once before giving up.
+        async with self._send_lock:
+            try:
+                for attempt in range(2):
+                    try:
+                        await self.bot.send_message(chat_id, text, parse_mode="HTML")
+                        return True
+                    except TelegramRetryAfter as e:
+                        if attempt:
+                            raise
+                        await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                logger.warning(f"Failed to send usage alert to admin {chat_id}: {e}")
+            finally:
+                await asyncio.sleep(SEND_INTERVAL)
+        return False
+
+    @staticmethod
+    def _digests(alerts: List[Alert]) -> List[List[Alert]]:
+        # Consecutive alerts packed into messages that stay under Telegram's length limit.
+        batches: List[List[Alert]] = []
+        length = DIGEST_MAX_LENGTH
+        for alert in alerts:
+            if length + len(alert[3]) + 2 > DIGEST_MAX_LENGTH:
+                batches.append([])
+                length = 0
+            batches[-1].append(alert)
+            length += len(alert[3]) + 2
+        return batches
+
+    async def _notify(self, owner: Optional[str], alerts: List[Alert], digest: bool = False):
+        # With `digest`, an owner's alerts are combined into as few messages as possible, so the
+        # first scan of a large panel sends a handful of messages instead of one per user.
+        if not alerts:
+            return
+        chat_ids = settings.owner_chat_ids(owner, self.panel)
+        suffix = f"\n🌐 Panel: <code>{escape(self.panel)}</code>" if len(settings.panels) > 1 else ""
+        batches = self._digests(alerts) if digest else [[alert] for alert in alerts]
+        for batch in batches:
+            text = "\n\n".join(alert[3] for alert in batch)
+            if len(batch) > 1:
+                text = f"📋 #UsageDigest ({len(batch)} warnings)\n\n{text}"
+            delivered = False
+            for chat_id in chat_ids:
+                delivered = await self._send(chat_id, text + suffix) or delivered
+            for username, ledger_key, marker, _ in batch:
+                if delivered or not chat_ids:
+                    self.ledger.mark(ledger_key, marker)
+                else:
+                    # Not marked, so the re-evaluation after RETRY_DELAY produces the warning again.
+                    self._schedule(KIND_RETRY, username, time.time() + RETRY_DELAY)
+
+    # --- scanning ---
+
+    async def _full_scan(self) -> bool:
+        started = time.monotonic()
+        seen: Set[str] = set()
+        pending: Dict[Optional[str], List[Alert]] = {}
+        error: Optional[RuntimeError] = None
+        try:
+            async for users in self.api_client.iter_users(page_size=MAX_PAGE_SIZE):
+                now = time.time()
+                for user in users:
+                    seen.add(user.username)
+                    alerts = self._evaluate(user, now)
+                    if alerts:
+                        pending.setdefault(user.owner_username, []).extend(alerts)
+        except RuntimeError as e:
+            error = e
+
+        # Warnings found before an aborted scan are still delivered.
+        for owner, alerts in pending.items():
+            await self._notify(owner, alerts, digest=True)
+        if error is not None:
+            logger.warning(f"Usage scan on panel '{self.panel}' aborted: {error}")
+            return False
+
+        for username in set(self._samples) - seen:
+            self._forget(username)
+        logger.info(
+            f"Usage scan on panel '{self.panel}' checked {len(seen)} users in {time.monotonic() - started:.1f}s; "
+            f"{len(self._deadlines)} deadlines pending."
+        )
+        return True
+
+    async def _refresh(self, usernames: Set[str], known: Dict[str, Optional[User]]):
+        semaphore = asyncio.Semaphore(REFRESH_CONCURRENCY)
+
+        async def refresh(username: str):
+            user = known.get(username)
+            if user is None:
+                async with semaphore:
+                    user = await self.api_client.get_user(username)
+            if user is None:
+                # Deleted, or the panel is unreachable; the next full scan settles which.
+                self._schedule(KIND_RETRY, username, time.time() + RETRY_DELAY)
+                return
+            await self._notify(user.owner_username, self._evaluate(user, time.time()))
+
+        await asyncio.gather(*(refresh(username) for username in usernames))
+
+    async def run(self):
+        logger.info(f"Usage alert scanner started for panel '{self.panel}'.")
+        user_events.subscribe(self)
+        next_scan = 0.0
+        try:
+            while True:
+                self._wakeup.clear()
+                if self._rescan_requested or time.time() >= next_scan:
+                    self._rescan_requested = False
+                    self._changed.clear()
+                    ok = await self._full_scan()
+                    next_scan = time.time() + (settings.USAGE_ALERT_SCAN_INTERVAL if ok else RETRY_DELAY)
+
+                changed, self._changed = self._changed, {}
+                due = self._pop_due(time.time())
+                if changed or due:
+                    await self._refresh(set(changed) | due, changed)
+                await self.ledger.flush()
+
+                wake_at = min(next_scan, self._next_deadline() or next_scan)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, wake_at - time.time()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            user_events.unsubscribe(self)
+            await self.ledger.flush()
+
+alert_ledger = AlertLedger()
+
+async def run_usage_scanner(bot: Bot, api_client: MarzneshinAPI):
+    scanner = UsageScanner(bot, api_client, alert_ledger)
+    QUEUE_DEPTH.set_function(lambda: len(scanner), f"usage_deadlines:{api_client.panel_name}")
+    await scanner.run()
@@ -1,7 +1,9 @@
 import io
+import os
 import random
 import re
 import string
+import tempfile
 from urllib.parse import urlparse
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Union, Tuple
@@ -98,6 +100,14 @@ def parse_duration_to_datetime(duration_str: str) -> Optional[datetime]:
     except ValueError:
         return None
 
+def utc_timestamp(dt_obj: Optional[datetime]) -> Optional[float]:
+    # The panel sends naive datetimes in UTC.
+    if not dt_obj:
+        return None
+    if dt_obj.tzinfo is None:
+        dt_obj = dt_obj.replace(tzinfo=timezone.utc)
+    return dt_obj.timestamp()
+
 def generate_qr_code(link: str) -> io.BytesIO:
     qr: QRCode = qrcode.QRCode(
         version=1,
@@ -115,6 +125,23 @@ def generate_qr_code(link: str) -> io.BytesIO:
     buf.seek(0)
     return buf
 
+def atomic_write_bytes(path: str, data: bytes):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def generate_random_username(length: int = 8) -> str:
     characters = string.ascii_lowercase + string.digits
     return ''.join(random.choice(characters) for _ in range(length))
@@ -141,6 +168,12 @@ def extract_inline_username(text: str) -> str | None:
             return match.group(1).strip(" `")
         return None
 
+def extract_inline_panel(text: str) -> str | None:
+        match = re.search(r"(?mi)Panel:\s*([^\n\r]+)", text)
+        if match:
+            return match.group(1).strip(" `")
+        return None
+
 def validate_username(username: str) -> bool:
     if not (USERNAME_MIN_LENGTH <= len(username) <= USERNAME_MAX_LENGTH):
         return False
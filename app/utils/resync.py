@@ -0,0 +1,25 @@
+import asyncio
+from typing import Awaitable, Callable, Dict
+
+class PeriodicResync:
+    # Drives a full resync per panel: run() repeats `sync` every `interval` seconds, or `retry_delay`
+    # after a failed attempt, and request() starts the next one early (e.g. after a bulk change).
+    def __init__(self, interval: float, retry_delay: float = 300):
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self._events: Dict[str, asyncio.Event] = {}
+
+    async def run(self, panel: str, sync: Callable[[], Awaitable[bool]]):
+        event = self._events.setdefault(panel, asyncio.Event())
+        while True:
+            event.clear()
+            ok = await sync()
+            try:
+                await asyncio.wait_for(event.wait(), timeout=self.interval if ok else self.retry_delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def request(self, panel: str):
+        event = self._events.get(panel)
+        if event is not None:
+            event.set()
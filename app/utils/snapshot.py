@@ -0,0 +1,49 @@
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Optional
+
+from app.utils.helpers import atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+class DebouncedSnapshot:
+    # Persists in-memory state as a JSON file: mark_dirty() after each change schedules one atomic
+    # write `delay` seconds later, however many changes land in between; flush() writes at once.
+    # `dump` runs on the event loop and must return a copy the caller will not mutate afterwards,
+    # since encoding and writing happen in a worker thread.
+    def __init__(self, path: str, dump: Callable[[], Any], delay: float, label: str = "snapshot"):
+        self.path = path
+        self.delay = delay
+        self.label = label
+        self.dirty = False
+        self._dump = dump
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def mark_dirty(self):
+        self.dirty = True
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._flush_later())
+            except RuntimeError:
+                pass
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    async def flush(self) -> bool:
+        async with self._lock:
+            if not self.dirty:
+                return True
+            data = self._dump()
+            self.dirty = False
+            try:
+                payload = await asyncio.to_thread(lambda: json.dumps(data, separators=(",", ":")).encode("utf-8"))
+                await asyncio.to_thread(atomic_write_bytes, self.path, payload)
+                return True
+            except Exception as e:
+                self.dirty = True
+                logger.error(f"Failed to write {self.label} {self.path}: {e}")
+                return False
@@ -1,9 +1,13 @@
+import json
 import logging
 import asyncio
 
 from aiohttp import web
 
-from app.core.config import Settings
+from app.core.config import DEFAULT_PANEL, Settings
+from app.core.health import health
+from app.core.leader import leader
+from app.core.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -13,13 +17,25 @@ async def webhook_handler(request: web.Request):
     if request.headers.get("X-Webhook-Secret") != settings.WEBHOOK_SECRET:
         logger.warning("Webhook received with invalid signature.")
         return web.Response(status=403, text="Invalid signature")
+
+    panel = request.match_info.get("panel")
+    if panel is None:
+        # The bare /webhook path belongs to the default panel (or the only one declared).
+        panel = DEFAULT_PANEL if DEFAULT_PANEL in settings.panel_map else settings.panels[0].name
+    if panel not in settings.panel_map:
+        return web.Response(status=404, text="Unknown panel")
+
+    if not leader.is_leader:
+        # Only the leader consumes the queue; make the panel retry instead of stranding the event here.
+        return web.Response(status=503, text="Standby replica")
     
     try:
         payload = await request.json()
         queue: asyncio.Queue = request.app["queue"]
 
         if isinstance(payload, dict) and "action" in payload:
-            await queue.put(payload)
+            await queue.put((panel, payload))
+            health.webhook_enqueued()
             logger.info("Successfully enqueued 1 event from webhook.")
             return web.Response(status=200, text="OK")
         
@@ -30,6 +46,28 @@ async def webhook_handler(request: web.Request):
         logger.error(f"Error in webhook handler: {e}", exc_info=True)
         return web.Response(status=500, text="Internal Server Error")
 
+async def metrics_handler(request: web.Request):
+    return web.Response(
+        text=metrics.render(),
+        content_type="text/plain",
+        headers={"X-Content-Type-Options": "nosniff"},
+        charset="utf-8",
+    )
+
+def _probe_response(ok: bool, body: dict) -> web.Response:
+    return web.Response(
+        status=200 if ok else 503,
+        text=json.dumps(body),
+        content_type="application/json",
+        headers={"Cache-Control": "no-store"},
+    )
+
+async def healthz_handler(request: web.Request):
+    return _probe_response(*health.liveness(request.app["settings"]))
+
+async def readyz_handler(request: web.Request):
+    return _probe_response(*health.readiness(request.app["settings"]))
+
 async def start_webhook_server(bot, queue, settings: Settings):
     app = web.Application()
     
@@ -37,7 +75,12 @@ async def start_webhook_server(bot, queue, settings: Settings):
     app["queue"] = queue
     app["settings"] = settings
     
-    app.router.add_post("/webhook", webhook_handler)
+    app.router.add_get("/metrics", metrics_handler)
+    app.router.add_get("/healthz", healthz_handler)
+    app.router.add_get("/readyz", readyz_handler)
+    if settings.ENABLE_WEBHOOK:
+        app.router.add_post("/webhook", webhook_handler)
+        app.router.add_post("/webhook/{panel}", webhook_handler)
     
     runner = web.AppRunner(app)
     await runner.setup()
@@ -45,9 +88,9 @@ async def start_webhook_server(bot, queue, settings: Settings):
     
     try:
         await site.start()
-        logger.info(f"Webhook server started on http://{settings.WEBHOOK_ADDRESS}:{settings.WEBHOOK_PORT}")
+        logger.info(f"HTTP server started on http://{settings.WEBHOOK_ADDRESS}:{settings.WEBHOOK_PORT}")
         await asyncio.Event().wait()
     except Exception as e:
-        logger.error(f"Webhook server failed to start: {e}")
+        logger.error(f"HTTP server failed to start: {e}")
     finally:
         await runner.cleanup()
\ No newline at end of file
@@ -1,27 +1,39 @@
 import asyncio
 import logging
 from html import escape
-from typing import List
 
 from aiogram import Bot
 
 from app.core.config import Settings
+from app.core.events import user_events
+from app.core.health import health
 from app.api.marzneshin import User
 
 logger = logging.getLogger(__name__)
 
-async def find_admin_chat_ids(owner_username: str, settings: Settings) -> List[int]:
-    chat_ids = []
-    for admin in settings.admins:
-        if admin.panel_username == owner_username:
-            chat_ids.extend(admin.chat_ids)
-    return chat_ids
+def _publish_user_event(panel: str, event):
+    if not isinstance(event, dict) or not isinstance(event.get("user"), dict):
+        return
+    user_data = event["user"]
+    username = user_data.get("username")
+    if not username:
+        return
+    if event.get("action") == "user_deleted":
+        user_events.user_deleted(panel, username)
+        return
+    try:
+        user = User(**user_data)
+    except Exception:
+        user = None
+    user_events.user_changed(panel, username, user)
 
 async def run_webhook_worker(queue: asyncio.Queue, bot: Bot, settings: Settings):
     logger.info("Webhook event worker started.")
     while True:
         try:
-            event = await queue.get()
+            panel, event = await queue.get()
+            health.webhook_dequeued()
+            _publish_user_event(panel, event)
             
             if not (event and isinstance(event, dict) and event.get("action") == "user_deactivated"):
                 queue.task_done()
@@ -40,7 +52,7 @@ async def run_webhook_worker(queue: asyncio.Queue, bot: Bot, settings: Settings)
                 queue.task_done()
                 continue
 
-            chat_ids = await find_admin_chat_ids(owner, settings)
+            chat_ids = settings.owner_chat_ids(owner, panel)
             if not chat_ids:
                 logger.warning(f"Owner '{owner}' found for user '{user.username}', but no matching chat_id in config.")
                 queue.task_done()
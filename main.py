@@ -1,75 +1,134 @@
 import asyncio
 import logging
-from typing import Optional, List, Tuple
+from typing import Dict, Optional, List, Tuple
 
 from app.api.marzneshin import MarzneshinAPI
+from app.cache.mirror import user_mirror
+from app.cache.qr import qr_file_ids
+from app.cache.user_index import username_index
 from app.core.api_manager import api_manager
 from app.core.bot import bot, dp
 from app.core.config import settings
+from app.core.health import PollingHealthMiddleware, health
+from app.core.leader import leader
 from app.core.logger import setup_logging
+from app.core.metrics import QUEUE_DEPTH, run_loop_lag_probe
 from app.handlers import main_router
-from app.handlers.middleware import AdminAuthMiddleware
+from app.handlers.middleware import AdminAuthMiddleware, MetricsMiddleware
+from app.monitoring.history import node_history
+from app.monitoring.state_manager import state_manager
 from app.monitoring.task import run_monitoring_loop
+from app.monitoring.usage_alerts import alert_ledger, run_usage_scanner
 from app.webhook.server import start_webhook_server
 from app.webhook.worker import run_webhook_worker
 
-async def find_sudo_client() -> Tuple[Optional[MarzneshinAPI], List[int]]:
-    logging.info("Attempting to find a 'sudo' admin and all sudo chat IDs...")
+async def find_sudo_client(panel: str) -> Tuple[Optional[MarzneshinAPI], List[int]]:
+    logging.info(f"Attempting to find a 'sudo' admin and all sudo chat IDs on panel '{panel}'...")
     sudo_client_found: Optional[MarzneshinAPI] = None
     sudo_chat_ids: List[int] = []
 
-    for admin in settings.admins:
+    for client, admin in api_manager.clients_for_panel(panel):
         if not admin.chat_ids:
             continue
         
-        first_chat_id = admin.chat_ids[0]
-        
         try:
-            client, _ = await api_manager.get_client(first_chat_id)
             admin_info = await client.get_current_admin()
             
             if admin_info and admin_info.is_sudo:
-                logging.info(f"Admin '{admin.panel_username}' is SUDO. Adding {len(admin.chat_ids)} chat(s) to alert list.")
+                logging.info(f"Admin '{admin.panel_username}' is SUDO on '{panel}'. Adding {len(admin.chat_ids)} chat(s) to alert list.")
                 sudo_chat_ids.extend(admin.chat_ids)
                 
                 if sudo_client_found is None:
-                    logging.info(f"Monitoring task will use '{admin.panel_username}' client.")
+                    logging.info(f"Monitoring task for '{panel}' will use '{admin.panel_username}' client.")
                     sudo_client_found = client
         except Exception as e:
-            logging.warning(f"Could not check sudo status for admin '{admin.panel_username}': {e}")
+            logging.warning(f"Could not check sudo status for admin '{admin.panel_username}' on '{panel}': {e}")
             
     return sudo_client_found, list(set(sudo_chat_ids))
 
+async def find_sudo_clients() -> Dict[str, Tuple[Optional[MarzneshinAPI], List[int]]]:
+    panels = [panel.name for panel in settings.panels]
+    results = await asyncio.gather(*(find_sudo_client(panel) for panel in panels))
+    return dict(zip(panels, results))
+
+async def run_polling():
+    # Only the leader polls: two getUpdates consumers on one token get 409 Conflict. A replica taking
+    # over from a failed leader keeps the updates that queued up meanwhile; only a fresh start drops them.
+    await bot.delete_webhook(drop_pending_updates=leader.started_as_leader)
+    logging.info("Bot is starting polling...")
+    health.polling_started()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    try:
+        await asyncio.shield(polling)
+    except asyncio.CancelledError:
+        # Cancelling start_polling() would leave its getUpdates task running; stop it the graceful way.
+        try:
+            await dp.stop_polling()
+        except RuntimeError:
+            polling.cancel()
+        await asyncio.gather(polling, return_exceptions=True)
+        raise
+    finally:
+        health.polling_stopped()
+
 async def main():
     setup_logging()
     
+    bot.session.middleware(PollingHealthMiddleware())
+    dp.update.outer_middleware(MetricsMiddleware())
     dp.update.middleware(AdminAuthMiddleware())
 
-    sudo_client, sudo_admin_chat_ids = await find_sudo_client()
+    sudo_clients = await find_sudo_clients()
         
     webhook_queue = asyncio.Queue()
+    QUEUE_DEPTH.set_function(webhook_queue.qsize, "webhook")
     
-    bot_polling_task = dp.start_polling(bot)
-    
-    all_tasks = [bot_polling_task]
+    all_tasks = [leader.run_while_leader("telegram polling", run_polling), run_loop_lag_probe(), leader.run()]
     
-    if sudo_client:
-        all_tasks.append(run_monitoring_loop(bot, sudo_client, sudo_admin_chat_ids))
-    else:
-        logging.warning("No 'sudo' admin found. Node monitoring task will not start.")
+    # One monitoring loop per panel, running concurrently on the leader.
+    for panel, (sudo_client, sudo_admin_chat_ids) in sudo_clients.items():
+        if sudo_client:
+            all_tasks.append(leader.run_while_leader(
+                f"node monitoring ({panel})",
+                lambda client=sudo_client, chat_ids=sudo_admin_chat_ids: run_monitoring_loop(bot, client, chat_ids)
+            ))
+            # Every replica answers username checks, so each keeps its own index.
+            all_tasks.append(username_index.run_sync(sudo_client))
+            if settings.USAGE_ALERTS_ENABLED:
+                all_tasks.append(leader.run_while_leader(
+                    f"usage alerts ({panel})",
+                    lambda client=sudo_client: run_usage_scanner(bot, client)
+                ))
+            all_tasks.append(leader.run_while_leader(
+                f"user mirror ({panel})",
+                lambda client=sudo_client: user_mirror.run_sync(client)
+            ))
+        else:
+            logging.warning(f"No 'sudo' admin found on panel '{panel}'. Node monitoring will not start for it.")
+
+    # The HTTP server always runs so /metrics can be scraped; /webhook is only routed when enabled.
+    all_tasks.append(start_webhook_server(bot, webhook_queue, settings))
 
     if settings.ENABLE_WEBHOOK:
-        all_tasks.append(start_webhook_server(bot, webhook_queue, settings))
-        all_tasks.append(run_webhook_worker(webhook_queue, bot, settings))
+        all_tasks.append(leader.run_while_leader(
+            "webhook worker", lambda: run_webhook_worker(webhook_queue, bot, settings)
+        ))
         logging.info("Webhook server and worker are enabled and will start.")
     else:
         logging.info("Webhook feature is disabled in .env file.")
 
     dp.include_router(main_router)
-    
-    await bot.delete_webhook(drop_pending_updates=True)
-    logging.info("Bot is starting polling...")
-    await asyncio.gather(*all_tasks)
+
+    try:
+        await asyncio.gather(*all_tasks)
+    finally:
+        await leader.release()
+        await state_manager.flush()
+        await node_history.flush()
+        await alert_ledger.flush()
+        await qr_file_ids.flush()
+        await user_mirror.close()
+        await api_manager.close()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,98 @@
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+import httpx
+import pytest
+
+# Settings are read when app.core.config is imported; environment values take precedence over config.yml.
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("PANEL_URL", "http://panel.test")
+os.environ.setdefault("ADMIN_CONFIG", json.dumps([
+    {"chat_ids": [1001], "panel_username": "root", "panel_password": "secret"},
+    {"chat_ids": [2002], "panel_username": "reseller", "panel_password": "secret"},
+]))
+
+from app.api.marzneshin import MarzneshinAPI, User  # noqa: E402
+from app.core.events import user_events  # noqa: E402
+
+def user_payload(username: str, **overrides: Any) -> Dict[str, Any]:
+    # A user as the panel serializes it.
+    payload = {
+        "id": 1,
+        "username": username,
+        "key": f"key-{username}",
+        "data_limit": 0,
+        "expire_strategy": "never",
+        "expire_date": None,
+        "service_ids": [],
+        "activated": True,
+        "is_active": True,
+        "expired": False,
+        "data_limit_reached": False,
+        "enabled": True,
+        "used_traffic": 0,
+        "lifetime_used_traffic": 0,
+        "note": None,
+        "owner_username": "root",
+        "created_at": datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat(),
+        "subscription_url": f"https://panel.test/sub/{username}/key-{username}",
+    }
+    payload.update(overrides)
+    return payload
+
+def make_user(username: str, **overrides: Any) -> User:
+    return User(**user_payload(username, **overrides))
+
+class MockPanel:
+    # An in-memory Marzneshin panel behind httpx.MockTransport; `calls` lists every API request
+    # except token requests as (method, path).
+    def __init__(self, users: List[Dict[str, Any]], is_sudo: bool = True):
+        self.users = {user["username"]: dict(user) for user in users}
+        self.is_sudo = is_sudo
+        self.calls: List[Tuple[str, str]] = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path == "/api/admins/token":
+            return httpx.Response(200, json={"access_token": "token", "expires_in": 86400})
+        self.calls.append((request.method, path))
+        if path == "/api/admins/current":
+            return httpx.Response(200, json={"id": 1, "username": "root", "is_sudo": self.is_sudo})
+
+        parts = path.strip("/").split("/")
+        if parts[0] == "sub" and len(parts) == 4 and parts[3] == "info":
+            user = self.users.get(parts[1])
+            if user is None or user["key"] != parts[2]:
+                return httpx.Response(404, json={"detail": "Not found"})
+            return httpx.Response(200, json=user)
+        if parts[:2] != ["api", "users"] or len(parts) < 3 or parts[2] not in self.users:
+            return httpx.Response(404, json={"detail": "Not found"})
+        user = self.users[parts[2]]
+        action = parts[3] if len(parts) > 3 else None
+        if request.method == "PUT" and action is None:
+            user.update({key: value for key, value in json.loads(request.content).items() if key in user})
+        elif action == "enable":
+            user["enabled"] = True
+        elif action == "disable":
+            user["enabled"] = False
+        elif action == "reset":
+            user["used_traffic"] = 0
+        elif action == "revoke_sub":
+            user["key"] = f"{user['key']}-revoked"
+            user["subscription_url"] = f"https://panel.test/sub/{user['username']}/{user['key']}"
+        elif request.method != "GET" or action is not None:
+            return httpx.Response(405, json={"detail": "Method not allowed"})
+        return httpx.Response(200, json=user)
+
+    def client(self) -> MarzneshinAPI:
+        transport = httpx.MockTransport(self.handle)
+        return MarzneshinAPI("http://panel.test", "root", "secret", http_client=httpx.AsyncClient(transport=transport))
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    # Module-level caches subscribe to the user event bus at import time and write under ./data;
+    # each test gets its own working directory and an empty bus.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(user_events, "_listeners", [])
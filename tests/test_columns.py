@@ -0,0 +1,35 @@
+import numpy as np
+
+from app.cache.columns import UserColumns
+
+GB = 1024 ** 3
+
+def _columns() -> UserColumns:
+    # (username, owner, enabled, is_active, expired, data_limit_reached, activated, expire_ts, data_limit, used)
+    return UserColumns.build([
+        ("full", "alice", True, True, False, True, True, None, 10 * GB, 10 * GB),
+        ("near", "alice", True, True, False, False, True, None, 10 * GB, 9 * GB),
+        ("half", "alice", True, True, False, False, True, None, 10 * GB, 5 * GB),
+        ("unlimited", "alice", True, True, False, False, True, None, 0, 50 * GB),
+        ("other", "bob", True, True, False, False, True, None, 1 * GB, 1 * GB),
+    ])
+
+def _names(columns: UserColumns, mask: np.ndarray):
+    return sorted(columns.usernames[i] for i in np.flatnonzero(mask))
+
+def test_over_quota_matches_limited_users_above_the_threshold():
+    columns = _columns()
+    assert _names(columns, columns.over_quota(0.9, columns.select("alice"))) == ["full", "near"]
+    assert _names(columns, columns.over_quota(0.9, columns.select())) == ["full", "near", "other"]
+    assert _names(columns, columns.over_quota(0.95, columns.select("alice"))) == ["full"]
+
+def test_usage_ratio_is_nan_for_unlimited_users():
+    columns = _columns()
+    ratio = columns.usage_ratio()
+    assert ratio[columns.rows["half"]] == 0.5
+    assert np.isnan(ratio[columns.rows["unlimited"]])
+
+def test_deleted_users_drop_out_of_queries():
+    columns = _columns()
+    columns.delete("near")
+    assert _names(columns, columns.over_quota(0.9, columns.select("alice"))) == ["full"]
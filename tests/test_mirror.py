@@ -0,0 +1,86 @@
+import asyncio
+
+from app.api.marzneshin import MAX_PAGE_SIZE
+from app.cache.mirror import UserMirror
+from tests.conftest import make_user
+
+USERS = [
+    make_user("alice", owner_username="root"),
+    make_user("bob", owner_username="reseller", enabled=False),
+    make_user("carol", owner_username="reseller"),
+]
+
+class FakeClient:
+    panel_name = "default"
+
+    def __init__(self, username: str, sudo):
+        self.username = username
+        self.sudo = sudo
+
+    async def is_sudo(self):
+        return self.sudo
+
+    async def iter_users(self, page_size: int = 100):
+        # The panel rejects pages above MAX_PAGE_SIZE; a full sync has to stay within it.
+        assert page_size <= MAX_PAGE_SIZE
+        yield USERS
+
+def _names(page):
+    return [user.username for user in page["users"]]
+
+def _with_mirror(tmp_path, scenario):
+    async def run():
+        mirror = UserMirror(str(tmp_path / "users.db"))
+        try:
+            await scenario(mirror)
+        finally:
+            await mirror.close()
+    asyncio.run(run())
+
+def test_mirror_answers_only_after_a_full_sync(tmp_path):
+    async def scenario(mirror):
+        root = FakeClient("root", True)
+        assert await mirror.get_page(root, {}, 0) is None
+        assert await mirror.sync(root)
+        page = await mirror.get_page(root, {}, 0)
+        assert sorted(_names(page)) == ["alice", "bob", "carol"]
+        assert page["total"] == 3
+
+    _with_mirror(tmp_path, scenario)
+
+def test_non_sudo_admins_only_see_their_own_users(tmp_path):
+    async def scenario(mirror):
+        await mirror.sync(FakeClient("root", True))
+        reseller = FakeClient("reseller", False)
+
+        page = await mirror.get_page(reseller, {}, 0)
+        assert sorted(_names(page)) == ["bob", "carol"]
+        # Asking for another owner's users does not widen the scope.
+        page = await mirror.get_page(reseller, {"owner_username": "root"}, 0)
+        assert sorted(_names(page)) == ["bob", "carol"]
+        page = await mirror.get_page(reseller, {"enabled": True}, 0)
+        assert _names(page) == ["carol"]
+
+        # Sudo admins can narrow down to any owner.
+        page = await mirror.get_page(FakeClient("root", True), {"owner_username": "reseller"}, 0)
+        assert sorted(_names(page)) == ["bob", "carol"]
+
+    _with_mirror(tmp_path, scenario)
+
+def test_unknown_role_or_filter_falls_back_to_the_panel(tmp_path):
+    async def scenario(mirror):
+        await mirror.sync(FakeClient("root", True))
+        assert await mirror.get_page(FakeClient("reseller", None), {}, 0) is None
+        assert await mirror.get_page(FakeClient("root", True), {"username": "ali"}, 0) is None
+        assert await mirror.get_page(FakeClient("root", True), {"order_by": "note"}, 0) is None
+
+    _with_mirror(tmp_path, scenario)
+
+def test_pages_are_zero_based(tmp_path):
+    async def scenario(mirror):
+        await mirror.sync(FakeClient("root", True))
+        page = await mirror.get_page(FakeClient("root", True), {"order_by": "username"}, 1, page_size=2)
+        assert _names(page) == ["carol"]
+        assert (page["page"], page["pages"], page["total"]) == (2, 2, 3)
+
+    _with_mirror(tmp_path, scenario)
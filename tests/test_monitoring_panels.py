@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from app.core.config import settings
+from app.core.health import HealthState
+from app.monitoring.history import NodeHistoryStore
+from app.monitoring.state_manager import MonitoringState
+
+def test_a_stalled_panel_fails_readiness_on_its_own(monkeypatch):
+    monkeypatch.setattr(settings, "panels", [*settings.panels, settings.panels[0].model_copy(update={"name": "eu"})])
+    health = HealthState()
+    health.monitoring_changed("default", True)
+    health.monitoring_changed("eu", True)
+    health.monitoring_cycle_finished("eu")
+    # The default panel's loop went quiet long ago; eu keeps finishing cycles.
+    health.monitoring_since["default"] -= settings.HEALTH_MAX_MONITORING_AGE * 4
+
+    ok, body = health.readiness(settings)
+    assert not ok
+    assert body["checks"]["monitoring:default"]["ok"] is False
+    assert body["checks"]["monitoring:eu"]["ok"] is True
+
+    alive, body = health.liveness(settings)
+    assert not alive
+    assert body["stalled_monitoring"] == ["default"]
+
+    # One loop stopping leaves the other panel's check in place.
+    health.monitoring_changed("default", False)
+    _, body = health.readiness(settings)
+    assert body["checks"]["monitoring:default"] == {"ok": True, "active": False, "last_cycle_age_seconds": None}
+    assert body["checks"]["monitoring:eu"]["active"] is True
+    assert health.liveness(settings)[0]
+
+def test_every_loop_sees_a_toggle(tmp_path):
+    state = MonitoringState(str(tmp_path / "monitoring.json"))
+
+    async def scenario():
+        # Both loops read the generation at the start of their cycle; one is still busy when the toggle lands.
+        first_seen = second_seen = state.settings_generation
+        waiter = asyncio.ensure_future(state.wait_for_settings_change(first_seen, 5))
+        await asyncio.sleep(0)
+        await state.set_monitoring_enabled(True)
+        assert await waiter
+        assert await state.wait_for_settings_change(second_seen, 0.01)
+        assert not await state.wait_for_settings_change(state.settings_generation, 0.01)
+
+    asyncio.run(scenario())
+
+def test_uptime_ranking_is_scoped_to_one_panel(tmp_path):
+    store = NodeHistoryStore(str(tmp_path / "history.json"))
+    now = time.time()
+    for key, name in (("default:1", "de-1"), ("eu:1", "eu-1"), ("eu:2", "eu-2")):
+        store.record(key, name, True, now - 60)
+        store.record(key, name, True, now)
+
+    assert sorted(key for key, _, _ in store.ranked_by_uptime(prefix="eu:")) == ["eu:1", "eu:2"]
+    assert [key for key, _, _ in store.ranked_by_uptime(prefix="default:")] == ["default:1"]
@@ -0,0 +1,75 @@
+from app.monitoring.node_fsm import (
+    ACTION_ALERT_DOWN, ACTION_ALERT_FLAPPING, ACTION_ALERT_RECOVERED, ACTION_ALERT_STABLE, ACTION_FLAP_SUMMARY,
+    ACTION_REMIND, ACTION_RESYNC, DOWN, FAIL, FLAPPING, HEALTHY, OK, RECOVERING, REMINDER_INTERVAL, SUSPECT,
+    FSMConfig, evaluate, is_idle, new_record, upgrade_record,
+)
+
+CONFIG = FSMConfig(fail_threshold=2, recovery_threshold=2, flap_window=1800, flap_threshold=6, flap_summary_interval=1800)
+
+def _feed(record, observations, config=CONFIG):
+    # Applies (timestamp, observation) pairs and returns the final record with every step's actions.
+    steps = []
+    for now, obs in observations:
+        record, actions = evaluate(record, obs, now, "connection refused" if obs == FAIL else "", config)
+        steps.append((record["state"], actions))
+    return record, steps
+
+def test_failures_are_confirmed_before_alerting():
+    record, steps = _feed(new_record(), [(100, FAIL), (110, FAIL)])
+    assert steps == [(SUSPECT, [ACTION_RESYNC]), (DOWN, [ACTION_ALERT_DOWN])]
+    assert record["down_since"] == 100
+    assert record["last_alert_time"] == 110
+    assert record["message"] == "connection refused"
+
+def test_single_failure_recovers_silently():
+    record, steps = _feed(new_record(), [(100, FAIL), (110, OK)])
+    assert steps == [(SUSPECT, [ACTION_RESYNC]), (HEALTHY, [])]
+    assert record["down_since"] is None
+    assert is_idle(new_record())
+
+def test_down_node_reminds_once_an_hour():
+    record, _ = _feed(new_record(), [(0, FAIL), (10, FAIL)])
+    record, steps = _feed(record, [(20, FAIL), (10 + REMINDER_INTERVAL + 1, FAIL), (10 + REMINDER_INTERVAL + 2, FAIL)])
+    assert steps == [(DOWN, []), (DOWN, [ACTION_REMIND]), (DOWN, [])]
+
+def test_recovery_is_confirmed_and_can_relapse():
+    record, _ = _feed(new_record(), [(0, FAIL), (10, FAIL)])
+    record, steps = _feed(record, [(20, OK), (30, FAIL), (40, OK), (50, OK)])
+    assert steps == [(RECOVERING, []), (DOWN, []), (RECOVERING, []), (HEALTHY, [ACTION_ALERT_RECOVERED])]
+    assert record["down_since"] is None
+    assert record["fails"] == record["oks"] == 0
+
+def test_flapping_suppresses_alerts_until_stable():
+    config = FSMConfig(fail_threshold=2, recovery_threshold=2, flap_window=1800, flap_threshold=6, flap_summary_interval=100)
+    flips = [(t, FAIL if t % 20 == 0 else OK) for t in range(0, 60, 10)]
+    record, steps = _feed(new_record(), flips, config)
+    assert steps[-1] == (FLAPPING, [ACTION_ALERT_FLAPPING])
+    # Each brief failure healed before the threshold, so the episode dates from the last one.
+    assert record["down_since"] == 40
+
+    record, steps = _feed(record, [(60, FAIL), (170, OK)], config)
+    assert steps == [(FLAPPING, []), (FLAPPING, [ACTION_FLAP_SUMMARY])]
+
+    # Once the flips age out of the window, the next healthy check ends the episode.
+    record, steps = _feed(record, [(170 + config.flap_window, OK)], config)
+    assert steps == [(HEALTHY, [ACTION_ALERT_STABLE])]
+    assert record["down_since"] is None
+
+def test_flapping_settles_into_down():
+    flips = [(t, FAIL if t % 20 == 0 else OK) for t in range(0, 70, 10)]
+    record, steps = _feed(new_record(), flips)
+    assert steps[-1][0] == FLAPPING
+    record, steps = _feed(record, [(60 + CONFIG.flap_window + 1, FAIL)])
+    assert steps == [(DOWN, [ACTION_ALERT_DOWN])]
+    assert record["fails"] == CONFIG.fail_threshold
+
+def test_upgrade_record_from_legacy_format():
+    record = upgrade_record({"alert_sent": True, "down_since": "2024-01-01T00:00:00+00:00"})
+    assert record["state"] == DOWN
+    assert record["last_obs"] == FAIL
+    assert record["down_since"] == 1704067200.0
+    assert record["last_alert_time"] == record["down_since"]
+
+    assert upgrade_record({"alert_sent": False})["state"] == SUSPECT
+    assert upgrade_record(None) == new_record()
+    assert upgrade_record({"state": RECOVERING, "oks": 1, "last_obs": OK})["state"] == RECOVERING
@@ -0,0 +1,66 @@
+import asyncio
+
+import httpx
+
+from app.api.marzneshin import MarzneshinAPI
+from app.core.events import UserEventListener, user_events
+from app.core.health import health
+from app.core.metrics import PANEL_ERRORS
+
+class BulkRecorder(UserEventListener):
+    def __init__(self):
+        self.panels = []
+
+    def on_users_bulk_changed(self, panel: str):
+        self.panels.append(panel)
+
+def _client(handler) -> MarzneshinAPI:
+    transport = httpx.MockTransport(handler)
+    return MarzneshinAPI("http://panel.test", "root", "secret", http_client=httpx.AsyncClient(transport=transport))
+
+def test_a_failed_token_refresh_counts_as_a_panel_error():
+    tokens = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/api/admins/token":
+            tokens.append(request)
+            if len(tokens) > 1:
+                return httpx.Response(401, json={"detail": "Incorrect username or password"})
+            return httpx.Response(200, json={"access_token": "token", "expires_in": 86400})
+        return httpx.Response(401, json={"detail": "Token expired"})
+
+    errors = PANEL_ERRORS.labels("default", "GET", "/api/admins/current")
+    before = errors.value
+    health.panel_last_failure_at.pop("default", None)
+
+    assert asyncio.run(_client(handle).get_current_admin()) is None
+    assert len(tokens) == 2
+    assert errors.value == before + 1
+    assert "default" in health.panel_last_failure_at
+
+def test_delete_expired_users_goes_through_the_request_path():
+    recorder = BulkRecorder()
+    user_events.subscribe(recorder)
+    deleted = {"count": 0}
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/api/admins/token":
+            return httpx.Response(200, json={"access_token": "token", "expires_in": 86400})
+        assert request.headers["Authorization"] == "Bearer token"
+        assert request.url.params["passed_time"] == "3600"
+        if not deleted["count"]:
+            return httpx.Response(404, json={"detail": "No expired user found."})
+        return httpx.Response(200, json=deleted)
+
+    client = _client(handle)
+    errors = PANEL_ERRORS.labels("default", "DELETE", "/api/users/expired")
+    before = errors.value
+
+    # "Nothing to delete" is an answer, not a failure, and changes nothing.
+    assert asyncio.run(client.delete_expired_users(3600)) == {"detail": "No expired user found."}
+    assert recorder.panels == []
+    assert errors.value == before
+
+    deleted["count"] = 3
+    assert asyncio.run(client.delete_expired_users(3600)) == {"count": 3}
+    assert recorder.panels == ["default"]
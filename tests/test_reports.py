@@ -0,0 +1,76 @@
+import csv
+import io
+import time
+
+from app.api.marzneshin import User
+from app.cache.columns import UserColumns
+from app.cache.reports import build_report
+
+GB = 1024 ** 3
+
+def _columns() -> UserColumns:
+    now = time.time()
+    # (username, owner, enabled, is_active, expired, data_limit_reached, activated, expire_ts, data_limit, used)
+    return UserColumns.build([
+        ("a1", "alice", True, True, False, False, True, now + 3600, 10 * GB, 5 * GB),
+        ("a2", "alice", False, False, False, False, True, None, 0, 1 * GB),
+        ("b1", "bob", True, False, True, False, True, now - 60, 1 * GB, 2 * GB),
+        ("b2", "bob", True, False, False, True, True, now + 5 * 86400, 1 * GB, 1 * GB),
+    ])
+
+def _rows(report):
+    return list(csv.DictReader(io.StringIO(report.to_csv().decode("utf-8"))))
+
+def test_csv_has_one_row_per_owner_and_a_total():
+    rows = _rows(build_report("default", _columns(), None))
+
+    assert [row["owner"] for row in rows] == ["alice", "bob", "TOTAL"]
+    alice, bob, total = rows
+    assert alice == {
+        "owner": "alice", "users": "2", "active": "1", "disabled": "1", "expired": "0", "limited": "0",
+        "inactive": "0", "allocated_bytes": str(10 * GB), "used_bytes": str(6 * GB), "unlimited_users": "1",
+        "over_quota": "0",
+        "expiring_24h": "1", "expiring_7d": "1", "expiring_30d": "1", "no_expiry": "1",
+        "top_user": "a1", "top_user_used_bytes": str(5 * GB),
+    }
+    assert (bob["expired"], bob["limited"], bob["expiring_24h"], bob["expiring_7d"]) == ("1", "1", "0", "1")
+    assert (bob["top_user"], bob["top_user_used_bytes"]) == ("b1", str(2 * GB))
+    assert (total["users"], total["used_bytes"], total["allocated_bytes"]) == ("4", str(9 * GB), str(12 * GB))
+    assert (total["top_user"], total["no_expiry"]) == ("a1", "1")
+    assert (bob["over_quota"], total["over_quota"]) == ("2", "2")
+
+def test_over_quota_users_are_listed_fullest_first():
+    report = build_report("default", _columns(), None)
+    assert report.over_quota == [("b1", 2.0), ("b2", 1.0)]
+
+def test_owner_scope_and_deleted_users():
+    columns = _columns()
+    columns.delete("b1")
+    report = build_report("default", columns, "bob")
+    rows = _rows(report)
+
+    assert [row["owner"] for row in rows] == ["bob", "TOTAL"]
+    assert rows[0]["users"] == rows[1]["users"] == "1"
+    assert rows[0]["top_user"] == "b2"
+    assert report.top_consumers == [("b2", 1 * GB)]
+
+def test_unknown_owner_gives_an_empty_report():
+    rows = _rows(build_report("default", _columns(), "nobody"))
+    assert [row["owner"] for row in rows] == ["TOTAL"]
+    assert rows[0]["users"] == "0"
+    assert rows[0]["top_user"] == ""
+
+def test_copy_is_isolated_from_in_place_updates():
+    columns = _columns()
+    snapshot = columns.copy()
+    changed = User.model_construct(
+        username="a1", owner_username="alice", enabled=False, is_active=False, expired=False,
+        data_limit_reached=False, activated=True, expire_date=None, data_limit=10 * GB, used_traffic=9 * GB,
+    )
+    assert columns.update(changed)
+    columns.delete("b1")
+
+    rows = _rows(build_report("default", snapshot, None))
+    assert rows[-1]["users"] == "4"
+    assert rows[-1]["used_bytes"] == str(9 * GB)
+    assert rows[0]["disabled"] == "1"
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from app.cache import subscriptions
+from app.cache.mirror import UserMirror
+from app.cache.subscriptions import SubscriptionResolver
+from tests.conftest import MockPanel, make_user, user_payload
+
+class _Index:
+    # Stands in for the username index: knows exactly the (panel, username, key) links it is given.
+    def __init__(self, *links):
+        self.links = set(links)
+
+    def has_subscription(self, panel, username, key):
+        return (panel, username, key) in self.links
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    mirror = UserMirror(str(tmp_path / "users.db"))
+    monkeypatch.setattr(subscriptions, "user_mirror", mirror)
+    return mirror
+
+def _resolve(panel, mirror_users, username, key, is_sudo=True):
+    async def scenario():
+        client = panel.client()
+        await client.is_sudo()
+        if mirror_users is not None:
+            class Source:
+                panel_name = client.panel_name
+
+                async def iter_users(self, page_size=100):
+                    yield mirror_users
+            await subscriptions.user_mirror.sync(Source())
+        panel.calls.clear()
+        resolver = SubscriptionResolver()
+        first = await resolver.resolve(client, username, key)
+        second = await resolver.resolve(client, username, key)
+        await subscriptions.user_mirror.close()
+        return first, second
+
+    panel.is_sudo = is_sudo
+    return asyncio.run(scenario())
+
+def test_known_link_is_answered_without_a_panel_call(mirror, monkeypatch):
+    monkeypatch.setattr(subscriptions, "username_index", _Index(("default", "alice", "key-alice")))
+    panel = MockPanel([user_payload("alice")])
+
+    first, second = _resolve(panel, [make_user("alice")], "alice", "key-alice")
+
+    assert first.username == second.username == "alice"
+    assert panel.calls == []
+
+def test_unknown_link_costs_one_panel_call(mirror, monkeypatch):
+    monkeypatch.setattr(subscriptions, "username_index", _Index())
+    panel = MockPanel([user_payload("alice")])
+
+    first, second = _resolve(panel, None, "alice", "key-alice")
+
+    assert first.username == "alice"
+    # The first paste asks the panel once; the remembered link then resolves like a known one,
+    # and with the mirror not synced that is one lookup.
+    assert panel.calls == [("GET", "/sub/alice/key-alice/info"), ("GET", "/api/users/alice")]
+    assert second.username == "alice"
+
+def test_revoked_link_does_not_resolve(mirror, monkeypatch):
+    monkeypatch.setattr(subscriptions, "username_index", _Index())
+    panel = MockPanel([user_payload("alice", key="new-key")])
+
+    first, _ = _resolve(panel, None, "alice", "key-alice")
+
+    assert first is None
+
+def test_other_admins_users_stay_hidden(mirror, monkeypatch):
+    monkeypatch.setattr(subscriptions, "username_index", _Index(("default", "alice", "key-alice")))
+    panel = MockPanel([user_payload("alice", owner_username="someone-else")])
+
+    first, _ = _resolve(panel, [make_user("alice", owner_username="someone-else")], "alice", "key-alice", is_sudo=False)
+
+    assert first is None
+    assert panel.calls == []
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+from app.monitoring import usage_alerts
+from app.core.config import settings
+from app.monitoring.usage_alerts import KIND_EXPIRY, KIND_QUOTA, KIND_RETRY, AlertLedger, UsageScanner
+from tests.conftest import make_user
+
+GB = 1024 ** 3
+
+class FakePanel:
+    panel_name = "default"
+
+    def __init__(self, users):
+        self.users = users
+
+    async def iter_users(self, page_size: int = 100):
+        for start in range(0, len(self.users), page_size):
+            yield self.users[start:start + page_size]
+
+    async def get_user(self, username: str):
+        return next((user for user in self.users if user.username == username), None)
+
+def _expiring(username: str, days: float = 1.0, owner: str = "root"):
+    expire_date = datetime.now(timezone.utc) + timedelta(days=days)
+    return make_user(username, expire_strategy="fixed_date", expire_date=expire_date.isoformat(), owner_username=owner)
+
+@pytest.fixture(autouse=True)
+def no_send_spacing(monkeypatch):
+    monkeypatch.setattr(usage_alerts, "SEND_INTERVAL", 0)
+
+def _scanner(users, bot, ledger):
+    return UsageScanner(bot, FakePanel(users), ledger)
+
+def test_warning_is_sent_once_per_expiry_date(tmp_path):
+    bot = SimpleNamespace(send_message=AsyncMock())
+    ledger = AlertLedger(str(tmp_path / "alerts.json"))
+    users = [_expiring("alice")]
+
+    async def scenario():
+        scanner = _scanner(users, bot, ledger)
+        assert await scanner._full_scan()
+        assert await scanner._full_scan()
+        assert bot.send_message.await_count == 1
+        assert bot.send_message.await_args.args[0] == 1001
+
+        # A renewal moves the expiry date, which earns a new warning.
+        users[0] = _expiring("alice", days=2)
+        assert await scanner._full_scan()
+        assert bot.send_message.await_count == 2
+        assert await ledger.flush()
+
+    asyncio.run(scenario())
+
+    # The ledger survives a restart, so a fresh scanner stays quiet.
+    restarted = AlertLedger(str(tmp_path / "alerts.json"))
+    assert restarted.get(f"default:{KIND_EXPIRY}:alice") == ledger.get(f"default:{KIND_EXPIRY}:alice")
+    asyncio.run(_scanner(users, bot, restarted)._full_scan())
+    assert bot.send_message.await_count == 2
+
+def test_failed_delivery_is_not_marked_and_retried(tmp_path):
+    bot = SimpleNamespace(send_message=AsyncMock(side_effect=RuntimeError("network down")))
+    ledger = AlertLedger(str(tmp_path / "alerts.json"))
+
+    async def scenario():
+        scanner = _scanner([_expiring("alice")], bot, ledger)
+        await scanner._full_scan()
+        assert ledger.get(f"default:{KIND_EXPIRY}:alice") is None
+        assert (KIND_RETRY, "alice") in scanner._deadlines
+
+        bot.send_message = AsyncMock()
+        await scanner._full_scan()
+        assert bot.send_message.await_count == 1
+        assert ledger.get(f"default:{KIND_EXPIRY}:alice") is not None
+
+    asyncio.run(scenario())
+
+def test_full_scan_digests_each_owners_warnings(tmp_path):
+    bot = SimpleNamespace(send_message=AsyncMock())
+    ledger = AlertLedger(str(tmp_path / "alerts.json"))
+    users = [_expiring(f"user{i}") for i in range(3)] + [_expiring("other", owner="reseller")]
+
+    asyncio.run(_scanner(users, bot, ledger)._full_scan())
+
+    messages = {call.args[0]: call.args[1] for call in bot.send_message.await_args_list}
+    assert bot.send_message.await_count == 2
+    assert "#UsageDigest (3 warnings)" in messages[1001]
+    assert all(f"user{i}" in messages[1001] for i in range(3))
+    assert "#UsageDigest" not in messages[2002]
+
+def test_users_of_other_admins_are_ignored(tmp_path):
+    bot = SimpleNamespace(send_message=AsyncMock())
+    ledger = AlertLedger(str(tmp_path / "alerts.json"))
+
+    asyncio.run(_scanner([_expiring("alice", owner="someone-else")], bot, ledger)._full_scan())
+
+    bot.send_message.assert_not_awaited()
+    assert ledger.sent == {}
+
+def test_users_near_the_quota_are_resampled_before_the_next_scan(tmp_path):
+    bot = SimpleNamespace(send_message=AsyncMock())
+    ledger = AlertLedger(str(tmp_path / "alerts.json"))
+    users = [
+        make_user("alice", data_limit=10 * GB, used_traffic=8 * GB),
+        make_user("bob", data_limit=10 * GB, used_traffic=1 * GB),
+    ]
+
+    async def scenario():
+        scanner = _scanner(users, bot, ledger)
+        assert await scanner._full_scan()
+        # A single sample gives no rate yet; alice is close enough to be looked at again well before the rescan.
+        assert scanner._deadlines[(KIND_QUOTA, "alice")] < time.time() + settings.USAGE_ALERT_SCAN_INTERVAL / 2
+        assert (KIND_QUOTA, "bob") not in scanner._deadlines
+
+        # The re-check finds her past the threshold and warns without waiting for the full scan.
+        users[0] = make_user("alice", data_limit=10 * GB, used_traffic=19 * GB // 2)
+        await scanner._refresh(scanner._pop_due(scanner._deadlines[(KIND_QUOTA, "alice")]), {})
+        assert bot.send_message.await_count == 1
+        assert "#QuotaWarning" in bot.send_message.await_args.args[1]
+
+    asyncio.run(scenario())
@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+from app.handlers.user import cb_revoke_user_execute, cb_toggle_user_enable, msg_renew_user_data
+from tests.conftest import MockPanel, user_payload
+
+# Mutations render the user view from the panel's response, so none of them needs a follow-up GET.
+
+def _state(data=None) -> SimpleNamespace:
+    return SimpleNamespace(get_data=AsyncMock(return_value=data or {}), clear=AsyncMock())
+
+def _callback(data: str) -> SimpleNamespace:
+    return SimpleNamespace(data=data, answer=AsyncMock(), message=SimpleNamespace(chat=SimpleNamespace(id=1001), message_id=7))
+
+def _rendered_text(bot: SimpleNamespace) -> str:
+    return bot.edit_message_text.await_args_list[-1].args[0]
+
+def test_toggle_with_target_state_is_one_call():
+    panel = MockPanel([user_payload("alice")])
+    bot = SimpleNamespace(edit_message_text=AsyncMock())
+
+    asyncio.run(cb_toggle_user_enable(_callback("user:toggle_enable:alice:0"), _state(), bot, panel.client()))
+
+    assert panel.calls == [("POST", "/api/users/alice/disable")]
+    assert bot.edit_message_text.await_count == 1
+    assert "alice" in _rendered_text(bot)
+
+def test_toggle_from_old_button_looks_the_user_up_once():
+    panel = MockPanel([user_payload("alice", enabled=False)])
+    bot = SimpleNamespace(edit_message_text=AsyncMock())
+
+    asyncio.run(cb_toggle_user_enable(_callback("user:toggle_enable:alice"), _state(), bot, panel.client()))
+
+    assert panel.calls == [("GET", "/api/users/alice"), ("POST", "/api/users/alice/enable")]
+    assert panel.users["alice"]["enabled"] is True
+
+def test_revoke_renders_the_new_link_without_refetching():
+    panel = MockPanel([user_payload("alice")])
+    bot = SimpleNamespace(edit_message_text=AsyncMock())
+
+    asyncio.run(cb_revoke_user_execute(_callback("user:revoke_execute:alice"), _state(), bot, panel.client()))
+
+    assert panel.calls == [("POST", "/api/users/alice/revoke_sub")]
+    assert bot.edit_message_text.await_count == 1
+
+def test_renew_runs_update_and_reset_together_then_reads_once():
+    panel = MockPanel([user_payload("alice", used_traffic=5 * 1024 ** 3)])
+    bot = SimpleNamespace(edit_message_text=AsyncMock())
+    message = SimpleNamespace(text="30g 30d", chat=SimpleNamespace(id=1001), delete=AsyncMock())
+    state = _state({"username": "alice", "panel_message_id": 7})
+
+    asyncio.run(msg_renew_user_data(message, state, bot, panel.client()))
+
+    assert sorted(panel.calls[:2]) == [("POST", "/api/users/alice/reset"), ("PUT", "/api/users/alice")]
+    assert panel.calls[2:] == [("GET", "/api/users/alice")]
+    assert panel.users["alice"]["data_limit"] == 30 * 1024 ** 3
+    assert panel.users["alice"]["used_traffic"] == 0
+
+def test_renew_reports_a_failed_mutation():
+    panel = MockPanel([])
+    bot = SimpleNamespace(edit_message_text=AsyncMock())
+    message = SimpleNamespace(text="30g 30d", chat=SimpleNamespace(id=1001), delete=AsyncMock())
+    state = _state({"username": "ghost", "panel_message_id": 7})
+
+    asyncio.run(msg_renew_user_data(message, state, bot, panel.client()))
+
+    assert sorted(panel.calls[:2]) == [("POST", "/api/users/ghost/reset"), ("PUT", "/api/users/ghost")]
+    assert panel.calls[2:] == [("GET", "/api/users/ghost")]
+    assert bot.edit_message_text.await_args_list[1].args[0] == "❌ Failed to renew User."